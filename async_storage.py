@@ -0,0 +1,138 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas_v4
+
+Runs storage work (SQLite and decryption) on a background thread so the GUI never waits for it """
+import itertools
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+from PySide2.QtCore import QObject, Signal, Slot
+
+import instrumentation
+from storage import StorageSession
+
+
+class AsyncStorage(QObject):
+    """Storage facade for the GUI.
+
+    Every call is executed in order on one worker thread and its result is
+    handed to a callback on the GUI thread. Calls made on a channel (for
+    example "editor") replace the previous call of that channel: a request
+    that did not start yet is cancelled and a result that arrives late is
+    dropped, so quick clicks only render the last selection.
+    """
+
+    resultReady = Signal(int, object)  # request id, result
+
+    def __init__(self, session: StorageSession, parent: Optional[QObject] = None):
+        super().__init__(parent)
+        self.session = session
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="storage")
+        self.requestIds = itertools.count(1)
+        self.callbacks: Dict[int, Callable] = {}
+        self.requestChannel: Dict[int, str] = {}
+        self.channelRequest: Dict[str, int] = {}
+        self.channelFuture: Dict[str, Future] = {}
+        self.droppedResults = 0
+        # pages are read ahead on a thread of their own, only the latest request is wanted
+        self.prefetchExecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch")
+        self.prefetchGeneration = 0
+        # the signal is emitted by the worker thread and delivered in the GUI thread
+        self.resultReady.connect(self.deliverResult)
+
+    def call(self, function: Callable, args: tuple = (), callback: Optional[Callable] = None,
+             channel: Optional[str] = None) -> int:
+        """run function(*args) on the worker thread, return the request id"""
+        requestId = next(self.requestIds)
+        if callback is not None:
+            self.callbacks[requestId] = callback
+        if channel is not None:
+            previous = self.channelFuture.get(channel)
+            if previous is not None and previous.cancel():
+                previousId = self.channelRequest[channel]
+                self.callbacks.pop(previousId, None)
+                self.requestChannel.pop(previousId, None)
+            self.channelRequest[channel] = requestId
+            self.requestChannel[requestId] = channel
+        future = self.executor.submit(self.runRequest, requestId, function, args, instrumentation.now())
+        if channel is not None:
+            self.channelFuture[channel] = future
+        return requestId
+
+    def runRequest(self, requestId: int, function: Callable, args: tuple, submitted: int) -> None:
+        """executed by the worker thread"""
+        instrumentation.recordSpan("async.queueWait", "async", submitted)
+        try:
+            result = function(*args)
+        except:
+            traceback.print_exc()
+            result = None
+        if requestId in self.callbacks:
+            self.resultReady.emit(requestId, result)
+
+    @Slot(int, object)
+    def deliverResult(self, requestId: int, result) -> None:
+        """executed by the GUI thread, call the callback unless the request went stale"""
+        callback = self.callbacks.pop(requestId, None)
+        channel = self.requestChannel.pop(requestId, None)
+        if callback is None:
+            return
+        if channel is not None and self.channelRequest.get(channel) != requestId:
+            self.droppedResults += 1
+            instrumentation.count("async.droppedResults")
+            return
+        with instrumentation.span("async.callback." + getattr(callback, "__name__", "callback"), "async"):
+            callback(result)
+
+    def callAndWait(self, function: Callable, args: tuple = ()):
+        """run function(*args) after every call submitted so far and return its result.
+        Blocks the GUI, only meant for rare maintenance operations."""
+        return self.executor.submit(function, *args).result()
+
+    # ******************* storage calls used by the GUI
+    def getBookIds(self, callback: Callable) -> int:
+        return self.call(self.session.getBookIds, (), callback, "books")
+
+    def getTitles(self, user_key, kind: str, ids: list, callback: Callable) -> int:
+        return self.call(self.session.getTitles, (user_key, kind, ids), callback, f"{kind} titles")
+
+    def getBookText(self, user_key, book_id: int, callback: Callable) -> int:
+        return self.call(self.session.getBookText, (user_key, book_id), callback, "editor")
+
+    def getPageText(self, user_key, page_id: int, callback: Callable) -> int:
+        return self.call(self.session.getPageText, (user_key, page_id), callback, "editor")
+
+    def getPageIdsOfBook(self, book_id: int, callback: Callable) -> int:
+        return self.call(self.session.getPageIdsOfBook, (book_id,), callback, "pages")
+
+    def updatePageText(self, user_key, page_id: int, new_text: str) -> int:
+        return self.call(self.session.updatePageText, (user_key, page_id, new_text))
+
+    def updateBookText(self, user_key, book_id: int, new_text: str) -> int:
+        return self.call(self.session.updateBookText, (user_key, book_id, new_text))
+
+    def queuePageText(self, user_key, page_id: int, new_text: str) -> int:
+        return self.call(self.session.queuePageText, (user_key, page_id, new_text))
+
+    def queueBookText(self, user_key, book_id: int, new_text: str) -> int:
+        return self.call(self.session.queueBookText, (user_key, book_id, new_text))
+
+    def flushPendingWrites(self) -> int:
+        return self.call(self.session.flushPendingWrites)
+
+    def prefetchPages(self, user_key, page_ids: list) -> None:
+        """warm the session text cache with page_ids, in the background. A newer
+        request makes the pages of the previous one unwanted."""
+        self.prefetchGeneration += 1
+        generation = self.prefetchGeneration
+        self.prefetchExecutor.submit(self.session.prefetchPages, user_key, page_ids,
+                                     lambda: self.prefetchGeneration == generation)
+
+    def shutdown(self) -> None:
+        """wait until every submitted call has finished"""
+        self.prefetchGeneration += 1
+        self.prefetchExecutor.shutdown(wait=True)
+        self.executor.shutdown(wait=True)
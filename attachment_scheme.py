@@ -0,0 +1,150 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas_v4
+
+Serves attachments to the web view at maite-attachment:ID urls, so a page can
+show its images with ![name](maite-attachment:12).
+
+The reply of a request is a device that reads the attachment one frame at a time
+on the storage thread: the next frame is decrypted once the web engine has read
+the one before, a big file never sits in memory as a whole. The lookup of the
+attachment's layout runs on the storage thread too, the GUI thread never waits.
+
+registerAttachmentScheme must be called before the QApplication is created.
+"""
+from typing import Callable, Optional
+
+from PySide2.QtCore import QIODevice, QObject, QUrl
+from PySide2.QtWebEngineCore import QWebEngineUrlRequestJob, QWebEngineUrlScheme, QWebEngineUrlSchemeHandler
+
+from async_storage import AsyncStorage
+from attachments import AttachmentInfo
+from crypto import UserKey
+
+ATTACHMENT_SCHEME = b"maite-attachment"
+
+
+def registerAttachmentScheme() -> None:
+    scheme = QWebEngineUrlScheme(ATTACHMENT_SCHEME)
+    scheme.setSyntax(QWebEngineUrlScheme.Syntax.Path)
+    scheme.setFlags(QWebEngineUrlScheme.SecureScheme | QWebEngineUrlScheme.LocalScheme |
+                    QWebEngineUrlScheme.LocalAccessAllowed)
+    QWebEngineUrlScheme.registerScheme(scheme)
+
+
+def attachmentUrl(attachment_id: int) -> str:
+    return f"{ATTACHMENT_SCHEME.decode()}:{attachment_id}"
+
+
+def attachmentLink(attachment_id: int, file_name: str, mime_type: str) -> str:
+    """markdown link to an attachment, an image link for images"""
+    link = f"[{file_name}]({attachmentUrl(attachment_id)})"
+    return "!" + link if mime_type.startswith("image/") else link
+
+
+def attachmentIdOfUrl(url: QUrl) -> int:
+    """attachment id of a maite-attachment url, 0 when there is none"""
+    path = url.path().strip("/")
+    return int(path) if path.isdigit() else 0
+
+
+class AttachmentStream(QIODevice):
+    """Sequential, read only device over the decrypted bytes of an attachment.
+    One frame is read ahead: it is asked to the storage thread when the device
+    opens and again each time the web engine took the bytes already there."""
+
+    def __init__(self, storage: AsyncStorage, user_key: UserKey, info: AttachmentInfo,
+                 parent: Optional[QObject] = None):
+        super().__init__(parent)
+        self.storage = storage
+        self.user_key = user_key
+        self.info = info
+        self.buffer = b""
+        self.requested = 0  # bytes asked to the storage thread so far
+        self.reading = False
+        self.failed = False
+        self.open(QIODevice.ReadOnly)
+        self.readAhead()
+
+    def isSequential(self) -> bool:
+        return True
+
+    def bytesAvailable(self) -> int:
+        return len(self.buffer) + super().bytesAvailable()
+
+    def atEnd(self) -> bool:
+        return (self.failed or self.requested >= self.info.size) and not self.reading and \
+            not self.buffer and super().atEnd()
+
+    def close(self) -> None:
+        self.buffer = b""
+        super().close()
+
+    def readAhead(self) -> None:
+        if self.reading or self.failed or self.requested >= self.info.size or not self.isOpen():
+            return
+        start = self.requested
+        end = min(start + self.info.frame_size, self.info.size)
+        self.reading = True
+        self.requested = end
+        self.storage.call(self.storage.session.readAttachment, (self.user_key, self.info, start, end),
+                          self.frameRead)
+
+    def frameRead(self, data: Optional[bytes]) -> None:
+        """called in the GUI thread with a decrypted frame, None when reading failed"""
+        self.reading = False
+        if not self.isOpen():
+            return
+        if data is None:
+            self.failed = True
+        else:
+            self.buffer += data
+            self.readyRead.emit()
+        if self.atEnd():
+            self.readChannelFinished.emit()
+
+    def readData(self, maxlen: int) -> bytes:
+        data = self.buffer[:maxlen]
+        self.buffer = self.buffer[maxlen:]
+        if not self.buffer:
+            self.readAhead()
+        return data
+
+    def writeData(self, data) -> int:
+        return -1
+
+
+class AttachmentSchemeHandler(QWebEngineUrlSchemeHandler):
+    """Answers maite-attachment:ID requests of a web engine profile. The key is
+    asked for on every request, it changes with the password."""
+
+    def __init__(self, storage: AsyncStorage, userKey: Callable[[], UserKey], parent: Optional[QObject] = None):
+        super().__init__(parent)
+        self.storage = storage
+        self.userKey = userKey
+
+    def requestStarted(self, job: QWebEngineUrlRequestJob) -> None:
+        attachmentId = attachmentIdOfUrl(job.requestUrl())
+        if not attachmentId:
+            job.fail(QWebEngineUrlRequestJob.UrlNotFound)
+            return
+        userKey = self.userKey()
+        # the job is answered when the lookup is done, unless the web engine dropped it meanwhile
+        alive = [True]
+        job.destroyed.connect(lambda: alive.clear())
+        self.storage.call(self.storage.session.getAttachment, (userKey, attachmentId),
+                          lambda info: self.answer(job, alive, userKey, info))
+
+    def answer(self, job: QWebEngineUrlRequestJob, alive: list, userKey: UserKey,
+               info: Optional[AttachmentInfo]) -> None:
+        """called in the GUI thread with the layout of the attachment, None if there is none"""
+        if not alive:
+            return
+        if info is None:
+            job.fail(QWebEngineUrlRequestJob.UrlNotFound)
+            return
+        device = AttachmentStream(self.storage, userKey, info)
+        # the web engine reads the device until the job is gone
+        job.destroyed.connect(device.deleteLater)
+        job.reply(info.mime_type.encode(), device)
@@ -0,0 +1,243 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas_v4
+
+Files attached to pages. A file is cut in FRAME_SIZE pieces and each one is
+encrypted on its own. Frames have the same encrypted size (the last one may be
+shorter), SEGMENT_FRAMES of them are stored one after the other in a row of
+attachment_blob, and the rows of an attachment have consecutive ids starting at
+its blob_id. Frame n is found in row blob_id + n // SEGMENT_FRAMES at a fixed
+offset, so any range of the file is read by decrypting only the frames it
+covers. Each frame is encrypted with (attachment id, frame index) as associated
+data: a frame copied to another place of the file, or to another file, fails to
+decrypt. Attachments stored before that (bound_frames 0) are read without it
+until a re-key (rekey.py) writes their frames again. Rows are written and read with SQLite incremental blob I/O, a file never
+sits in memory as a whole. (SQLite walks the overflow pages of a blob to reach
+an offset, rows of a few MB keep that walk short.)
+
+Names and media types are encrypted like page names. Deleting an attachment (or
+its page) deletes its rows through the attachment_deleted trigger.
+
+Incremental blob I/O (Connection.blobopen) needs Python 3.11 or newer.
+The functions here run inside the caller's transaction and never commit.
+"""
+import mimetypes
+import sqlite3
+import struct
+from typing import BinaryIO, List, Optional, Tuple
+
+from crypto import UserKey, encryptTextToData, decryptDataToText
+
+FRAME_SIZE = 256 * 1024  # plain bytes encrypted together
+SEGMENT_FRAMES = 16  # frames stored in one row of attachment_blob
+DEFAULT_MIME_TYPE = "application/octet-stream"
+
+SQL_CREATE_ATTACHMENT_TABLE = """
+CREATE TABLE IF NOT EXISTS attachment (
+    id integer PRIMARY KEY AUTOINCREMENT,
+    page_id integer NOT NULL REFERENCES page(id) ON DELETE CASCADE,
+    file_name blob NOT NULL,
+    mime_type blob NOT NULL,
+    size integer NOT NULL,
+    frame_size integer NOT NULL,
+    segment_frames integer NOT NULL,
+    stored_frame_size integer NOT NULL,
+    added_at real NOT NULL,
+    blob_id integer NOT NULL
+); """
+
+SQL_ADD_FRAME_BINDING = "ALTER TABLE attachment ADD COLUMN bound_frames integer NOT NULL DEFAULT 0"
+
+SQL_CREATE_ATTACHMENT_PAGE_INDEX = "CREATE INDEX IF NOT EXISTS attachment_page_id ON attachment(page_id)"
+
+SQL_CREATE_ATTACHMENT_BLOB_TABLE = """
+CREATE TABLE IF NOT EXISTS attachment_blob (
+    id integer PRIMARY KEY,
+    data blob NOT NULL
+); """
+
+# rows blob_id to blob_id + segment count - 1 belong to the attachment
+SQL_CREATE_ATTACHMENT_TRIGGER = """
+CREATE TRIGGER IF NOT EXISTS attachment_deleted AFTER DELETE ON attachment
+BEGIN
+    DELETE FROM attachment_blob WHERE id >= old.blob_id
+    AND id < old.blob_id + (old.size + old.frame_size * old.segment_frames - 1) / (old.frame_size * old.segment_frames);
+END; """
+
+SQL_NEXT_BLOB_ID = "select coalesce(max(id), 0) + 1 from attachment_blob"
+SQL_INSERT_BLOB = "insert into attachment_blob(id, data) values(?, zeroblob(?))"
+SQL_INSERT_ATTACHMENT = """
+insert into attachment(page_id, file_name, mime_type, size, frame_size, segment_frames, stored_frame_size,
+                       added_at, blob_id, bound_frames)
+values(?,?,?,?,?,?,0,?,0,1)"""
+SQL_READ_ATTACHMENT = """
+select page_id, file_name, mime_type, size, frame_size, segment_frames, stored_frame_size, added_at, blob_id,
+       bound_frames
+from attachment where id=?"""
+SQL_LIST_ATTACHMENTS = """
+select id, file_name, mime_type, size, added_at from attachment where page_id=? order by id"""
+SQL_DELETE_ATTACHMENT = "delete from attachment where id=?"
+SQL_REPLACE_BLOB = "update attachment set stored_frame_size=?, blob_id=?, bound_frames=1 where id=?"
+SQL_DELETE_BLOB = "delete from attachment_blob where id >= ? and id < ?"
+
+
+class AttachmentInfo:
+    """one attachment, with its name and media type decrypted"""
+
+    def __init__(self, attachment_id: int, row: tuple, user_key: UserKey):
+        self.id = attachment_id
+        self.page_id = row[0]
+        self.file_name = decryptDataToText(row[1], user_key)
+        self.mime_type = decryptDataToText(row[2], user_key)
+        (self.size, self.frame_size, self.segment_frames, self.stored_frame_size,
+         self.added_at, self.blob_id, self.bound_frames) = row[3:]
+
+    @property
+    def frames(self) -> int:
+        return -(-self.size // self.frame_size)
+
+    def frameLocation(self, index: int) -> Tuple[int, int]:
+        return frameLocation(self.blob_id, self.segment_frames, self.stored_frame_size, index)
+
+    def frameData(self, index: int) -> bytes:
+        """associated data the frame was encrypted with"""
+        return frameData(self.id, index) if self.bound_frames else b""
+
+
+def checkBlobSupport(conn: sqlite3.Connection) -> None:
+    if not hasattr(conn, "blobopen"):
+        raise RuntimeError("attachments need Python 3.11 or newer (sqlite3 blobopen)")
+
+
+def guessMimeType(file_name: str) -> str:
+    return mimetypes.guess_type(file_name)[0] or DEFAULT_MIME_TYPE
+
+
+def frameLocation(blob_id: int, segment_frames: int, stored_frame_size: int, index: int) -> Tuple[int, int]:
+    """(attachment_blob row, offset in the row) of frame index"""
+    segment, position = divmod(index, segment_frames)
+    return blob_id + segment, position * stored_frame_size
+
+
+def frameData(attachment_id: int, index: int) -> bytes:
+    """associated data of a frame: where it belongs"""
+    return struct.pack(">QQ", attachment_id, index)
+
+
+def segmentSizes(user_key: UserKey, size: int, frame_size: int = FRAME_SIZE,
+                 segment_frames: int = SEGMENT_FRAMES) -> Tuple[int, List[int]]:
+    """(stored size of a full frame, stored size of every row) of size bytes.
+    Frames are encrypted without compression, their stored size only depends on
+    their length."""
+    associated_data = frameData(0, 0)  # always the same length
+    stored_frame = len(user_key.encrypt(bytes(frame_size), associated_data=associated_data))
+    frames = -(-size // frame_size)
+    sizes = []
+    for first in range(0, frames, segment_frames):
+        sizes.append(min(segment_frames, frames - first) * stored_frame)
+    rest = size % frame_size
+    if rest:
+        sizes[-1] += len(user_key.encrypt(bytes(rest), associated_data=associated_data)) - stored_frame
+    return stored_frame, sizes
+
+
+def allocateSegments(conn: sqlite3.Connection, sizes: List[int]) -> int:
+    """zero filled rows of these sizes with consecutive ids, return the first id"""
+    blob_id = conn.execute(SQL_NEXT_BLOB_ID).fetchone()[0]
+    conn.executemany(SQL_INSERT_BLOB, [(blob_id + segment, size) for segment, size in enumerate(sizes)])
+    return blob_id
+
+
+def readExactly(source: BinaryIO, size: int) -> bytes:
+    parts = []
+    while size > 0:
+        part = source.read(size)
+        if not part:
+            break
+        parts.append(part)
+        size -= len(part)
+    return b"".join(parts)
+
+
+def writeFrames(conn: sqlite3.Connection, user_key: UserKey, attachment_id: int, source: BinaryIO,
+                size: int) -> Tuple[int, int]:
+    """encrypt size bytes of source into new rows, return (blob id, stored frame size)"""
+    checkBlobSupport(conn)
+    stored_frame, sizes = segmentSizes(user_key, size)
+    blob_id = allocateSegments(conn, sizes)
+    remaining = size
+    index = 0
+    for segment in range(len(sizes)):
+        with conn.blobopen("attachment_blob", "data", blob_id + segment) as blob:
+            for _ in range(SEGMENT_FRAMES):
+                if remaining <= 0:
+                    break
+                frame = readExactly(source, min(FRAME_SIZE, remaining))
+                if not frame:
+                    raise ValueError("attachment source ended before its size")
+                blob.write(user_key.encrypt(frame, associated_data=frameData(attachment_id, index)))
+                remaining -= len(frame)
+                index += 1
+    return blob_id, stored_frame
+
+
+# ***************** attachments
+def addAttachment(conn: sqlite3.Connection, user_key: UserKey, page_id: int, file_name: str,
+                  source: BinaryIO, size: int, now: float, mime_type: Optional[str] = None) -> int:
+    """store size bytes read from source as an attachment of a page, return its id"""
+    # the frames are bound to the id, the row comes first
+    cur = conn.execute(SQL_INSERT_ATTACHMENT, (
+        page_id, encryptTextToData(file_name, user_key),
+        encryptTextToData(mime_type or guessMimeType(file_name), user_key),
+        size, FRAME_SIZE, SEGMENT_FRAMES, now))
+    attachment_id = cur.lastrowid
+    blob_id, stored_frame = writeFrames(conn, user_key, attachment_id, source, size)
+    conn.execute(SQL_REPLACE_BLOB, (stored_frame, blob_id, attachment_id))
+    return attachment_id
+
+
+def getAttachment(conn: sqlite3.Connection, user_key: UserKey, attachment_id: int) -> Optional[AttachmentInfo]:
+    row = conn.execute(SQL_READ_ATTACHMENT, (attachment_id,)).fetchone()
+    return AttachmentInfo(attachment_id, row, user_key) if row else None
+
+
+def listAttachments(conn: sqlite3.Connection, user_key: UserKey, page_id: int) -> List[tuple]:
+    """(id, file name, media type, size, added_at) of the attachments of a page"""
+    return [(row[0], decryptDataToText(row[1], user_key), decryptDataToText(row[2], user_key), row[3], row[4])
+            for row in conn.execute(SQL_LIST_ATTACHMENTS, (page_id,))]
+
+
+def deleteAttachment(conn: sqlite3.Connection, attachment_id: int) -> None:
+    conn.execute(SQL_DELETE_ATTACHMENT, (attachment_id,))
+
+
+def readRange(conn: sqlite3.Connection, user_key: UserKey, info: AttachmentInfo,
+              start: int, end: int) -> bytes:
+    """bytes start to end (excluded) of an attachment, only the frames holding them
+    are read and decrypted"""
+    checkBlobSupport(conn)
+    end = min(end, info.size)
+    if start >= end:
+        return b""
+    first = start // info.frame_size
+    last = (end - 1) // info.frame_size
+    frames = []
+    blob = None
+    blob_row = None
+    try:
+        for index in range(first, last + 1):
+            row, offset = info.frameLocation(index)
+            if row != blob_row:
+                if blob is not None:
+                    blob.close()
+                blob = conn.blobopen("attachment_blob", "data", row, readonly=True)
+                blob_row = row
+            blob.seek(offset)
+            frames.append(user_key.decrypt(blob.read(info.stored_frame_size), info.frameData(index)))
+    finally:
+        if blob is not None:
+            blob.close()
+    data = b"".join(frames)
+    offset = first * info.frame_size
+    return data[start - offset:end - offset]
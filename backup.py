@@ -0,0 +1,444 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas_v4
+
+Backups of a vault while it is in use:
+
+  hot backup  a copy of the database file made with the SQLite online backup API
+  archive     a stream of records holding every book and page, either with the
+              rows as stored (raw, opened with the vault password) or encrypted
+              again with a key derived from a backup password (reencrypted)
+  markdown    decrypted texts as a directory tree, one folder per book
+
+Archives and markdown trees are written from one read transaction, so they are
+a consistent snapshot, and the vault is read and written one batch at a time:
+memory use does not grow with the size of the vault. The page history and the
+search index are not part of archives (the index is rebuilt on restore).
+
+Archive layout (ARCHIVE_VERSION 1), integers are big endian:
+
+  ARCHIVE_MAGIC, version byte, then records: type byte, payload length (4 bytes),
+  payload. A payload is a list of fields, each one a 4 byte length and its bytes.
+
+  RECORD_HEADER  settings as JSON, password verifier
+  RECORD_BOOK    id, name, text
+  RECORD_PAGE    id, book id, name, text parts (the text is the parts decrypted
+                 and joined, big pages have one part per chunk)
+  RECORD_END     counts as JSON, SHA-256 of every byte before this record
+"""
+import hashlib
+import itertools
+import json
+import os
+import re
+import sqlite3
+import struct
+import time
+from typing import BinaryIO, Iterable, Iterator, List, Optional, Tuple
+
+from crypto import UserKey, encryptTextToData, decryptDataToText
+from page_chunks import PAGE_LAYOUT_CHUNKED, SQL_READ_CHUNKS_OF_PAGE
+import page_chunks
+import storage
+from storage import StorageSession
+from worker_pool import batched, flatten, mapBatches
+
+ARCHIVE_MAGIC = b"MAITEBAK"
+ARCHIVE_VERSION = 1
+
+MODE_RAW = "raw"
+MODE_REENCRYPTED = "reencrypted"
+ARCHIVE_MODES = (MODE_RAW, MODE_REENCRYPTED)
+
+RECORD_HEADER = 1
+RECORD_BOOK = 2
+RECORD_PAGE = 3
+RECORD_END = 4
+
+BACKUP_BATCH_SIZE = 64  # rows sent to a worker at once
+PARALLEL_MIN_ROWS = 500  # smaller vaults are processed in this process
+RESTORE_COMMIT_ROWS = 1000  # restored rows written per transaction
+MARKDOWN_BOOK_FILE = "_book.md"
+
+SQL_READ_BOOKS_FOR_BACKUP = "select id, book_name, book_text from book where id >= 2 order by id"
+SQL_READ_PAGES_FOR_BACKUP = "select id, book_id, page_name, page_text, page_layout from page order by id"
+SQL_COUNT_ROWS = "select (select count(*) from book) + (select count(*) from page)"
+SQL_RESTORE_BOOK = "insert into book(id, book_name, book_text) values(?,?,?)"
+SQL_RESTORE_PAGE = "insert into page(id, book_id, page_name, page_text) values(?,?,?,?)"
+
+
+# ***************** hot backup
+def hotBackup(session: StorageSession, destination: str) -> None:
+    """Copy the vault to destination while it stays in use. The copy is made by a
+    connection of its own in one step, which keeps a read snapshot: with WAL,
+    saves go on meanwhile and are not part of the copy."""
+    session.flushPendingWrites()
+    partial = destination + ".partial"
+    source = sqlite3.connect(session.dbfile)
+    try:
+        target = sqlite3.connect(partial)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+    finally:
+        source.close()
+    os.replace(partial, destination)
+
+
+# ***************** record encoding
+def packFields(fields: Iterable[bytes]) -> bytes:
+    return b"".join(struct.pack(">I", len(field)) + field for field in fields)
+
+
+def unpackFields(payload: bytes) -> List[bytes]:
+    fields = []
+    position = 0
+    while position < len(payload):
+        (size,) = struct.unpack_from(">I", payload, position)
+        position += 4
+        if position + size > len(payload):
+            raise ValueError("archive record is damaged")
+        fields.append(payload[position:position + size])
+        position += size
+    return fields
+
+
+def encodeRecord(record_type: int, fields: Iterable[bytes]) -> bytes:
+    payload = packFields(fields)
+    return struct.pack(">BI", record_type, len(payload)) + payload
+
+
+def kdfToJson(kdf_params: dict) -> dict:
+    params = dict(kdf_params)
+    if params.get("salt") is not None:
+        params["salt"] = params["salt"].hex()
+    return params
+
+
+def kdfFromJson(params: dict) -> dict:
+    kdf_params = dict(params)
+    if kdf_params.get("salt") is not None:
+        kdf_params["salt"] = bytes.fromhex(kdf_params["salt"])
+    return kdf_params
+
+
+def writeArchive(records: Iterable[Tuple[int, List[bytes]]], output: BinaryIO) -> dict:
+    """write the header and the records, then the end record; return the counts"""
+    digest = hashlib.sha256()
+    counts = {"books": 0, "pages": 0}
+
+    def write(data: bytes) -> None:
+        digest.update(data)
+        output.write(data)
+
+    write(ARCHIVE_MAGIC + bytes([ARCHIVE_VERSION]))
+    for record_type, fields in records:
+        if record_type == RECORD_BOOK:
+            counts["books"] += 1
+        elif record_type == RECORD_PAGE:
+            counts["pages"] += 1
+        write(encodeRecord(record_type, fields))
+    output.write(encodeRecord(RECORD_END, [json.dumps(counts).encode(), digest.digest()]))
+    return counts
+
+
+def readRecord(archive: BinaryIO) -> Tuple[int, bytes, bytes]:
+    """(type, payload, raw bytes) of the next record"""
+    prefix = archive.read(5)
+    if len(prefix) < 5:
+        raise ValueError("archive is truncated")
+    record_type, size = struct.unpack(">BI", prefix)
+    payload = archive.read(size)
+    if len(payload) < size:
+        raise ValueError("archive is truncated")
+    return record_type, payload, prefix + payload
+
+
+def readArchive(archive: BinaryIO) -> Iterator[Tuple[int, List[bytes]]]:
+    """Yield (type, fields) of every record, the header first. The checksum is
+    verified when the end record is reached, a damaged archive raises ValueError."""
+    digest = hashlib.sha256()
+    start = archive.read(len(ARCHIVE_MAGIC) + 1)
+    if len(start) <= len(ARCHIVE_MAGIC) or start[:len(ARCHIVE_MAGIC)] != ARCHIVE_MAGIC:
+        raise ValueError("not a maitenotas archive")
+    if start[-1] > ARCHIVE_VERSION:
+        raise ValueError(f"archive version {start[-1]} is newer than this program")
+    digest.update(start)
+    while True:
+        record_type, payload, raw = readRecord(archive)
+        if record_type == RECORD_END:
+            fields = unpackFields(payload)
+            if len(fields) != 2 or fields[1] != digest.digest():
+                raise ValueError("archive is damaged (checksum does not match)")
+            return
+        digest.update(raw)
+        yield record_type, unpackFields(payload)
+
+
+def readArchiveHeader(path: str) -> dict:
+    """settings of an archive: mode, kdf, created, verifier"""
+    with open(path, "rb") as archive:
+        for record_type, fields in readArchive(archive):
+            if record_type != RECORD_HEADER:
+                break
+            header = json.loads(fields[0])
+            header["kdf"] = kdfFromJson(header["kdf"])
+            header["verifier"] = fields[1]
+            return header
+    raise ValueError("archive has no header")
+
+
+# ***************** reading the vault
+def vaultRows(conn: sqlite3.Connection) -> Iterator[tuple]:
+    """("book", id, name, text) and ("page", id, book_id, name, parts) rows as
+    stored, parts being the encrypted text or the encrypted chunks of the page"""
+    for book_id, name, text in conn.execute(SQL_READ_BOOKS_FOR_BACKUP):
+        yield "book", book_id, name, text
+    for page_id, book_id, name, text, layout in conn.execute(SQL_READ_PAGES_FOR_BACKUP):
+        if layout == PAGE_LAYOUT_CHUNKED:
+            parts = [row[0] for row in conn.execute(SQL_READ_CHUNKS_OF_PAGE, (page_id,))]
+        else:
+            parts = [text]
+        yield "page", page_id, book_id, name, parts
+
+
+def chooseWorkers(conn: sqlite3.Connection, workers: Optional[int]) -> int:
+    if workers is not None:
+        return workers
+    workers = os.cpu_count() or 1
+    if workers < 2 or conn.execute(SQL_COUNT_ROWS).fetchone()[0] < PARALLEL_MIN_ROWS:
+        return 0
+    return workers
+
+
+# state of a worker process, set once by initWorker
+_workerFromKey: Optional[UserKey] = None
+_workerToKey: Optional[UserKey] = None
+_workerChunkedSize: Optional[int] = None
+
+def initWorker(from_key: Optional[UserKey], to_key: Optional[UserKey],
+               chunked_size: Optional[int] = None) -> None:
+    global _workerFromKey, _workerToKey, _workerChunkedSize
+    _workerFromKey = from_key
+    _workerToKey = to_key
+    _workerChunkedSize = chunked_size
+
+
+def reencryptBatch(rows: list) -> list:
+    """rows encrypted again with the worker keys, chunk by chunk"""
+    def convert(data: bytes, compress: bool = False) -> bytes:
+        return encryptTextToData(decryptDataToText(data, _workerFromKey), _workerToKey, compress)
+
+    converted = []
+    for row in rows:
+        if row[0] == "book":
+            converted.append(("book", row[1], convert(row[2]), convert(row[3], True)))
+        else:
+            converted.append(("page", row[1], row[2], convert(row[3]),
+                              [convert(part, True) for part in row[4]]))
+    return converted
+
+
+def decryptBatch(rows: list) -> list:
+    """rows with their names and texts decrypted"""
+    decrypted = []
+    for row in rows:
+        if row[0] == "book":
+            decrypted.append(("book", row[1], decryptDataToText(row[2], _workerFromKey),
+                              decryptDataToText(row[3], _workerFromKey)))
+        else:
+            decrypted.append(("page", row[1], row[2], decryptDataToText(row[3], _workerFromKey),
+                              "".join(decryptDataToText(part, _workerFromKey) for part in row[4])))
+    return decrypted
+
+
+def restoreBatch(rows: list) -> list:
+    """archive rows ready to insert: ("book", id, name, text) with the texts
+    encrypted for the vault, ("page", id, book_id, name, text, plain) where plain is
+    the decrypted text of a page big enough to be stored in chunks (text is None)"""
+    restored = []
+    for row in rows:
+        if row[0] == "book":
+            restored.append(("book", row[1],
+                             encryptTextToData(decryptDataToText(row[2], _workerFromKey), _workerToKey),
+                             encryptTextToData(decryptDataToText(row[3], _workerFromKey), _workerToKey, True)))
+            continue
+        name = encryptTextToData(decryptDataToText(row[3], _workerFromKey), _workerToKey)
+        text = "".join(decryptDataToText(part, _workerFromKey) for part in row[4])
+        if _workerChunkedSize is not None and len(text) >= _workerChunkedSize:
+            restored.append(("page", row[1], row[2], name, None, text))
+        else:
+            restored.append(("page", row[1], row[2], name, encryptTextToData(text, _workerToKey, True), None))
+    return restored
+
+
+def rowRecord(row: tuple) -> Tuple[int, List[bytes]]:
+    if row[0] == "book":
+        return RECORD_BOOK, [str(row[1]).encode(), row[2], row[3]]
+    return RECORD_PAGE, [str(row[1]).encode(), str(row[2]).encode(), row[3], *row[4]]
+
+
+def recordRow(record_type: int, fields: List[bytes]) -> tuple:
+    if record_type == RECORD_BOOK:
+        return "book", int(fields[0]), fields[1], fields[2]
+    return "page", int(fields[0]), int(fields[1]), fields[2], fields[3:]
+
+
+# ***************** export
+def exportArchive(session: StorageSession, destination: str, mode: str = MODE_RAW,
+                  user_key: Optional[UserKey] = None, backup_key: Optional[UserKey] = None,
+                  backup_password: Optional[str] = None, backup_kdf: Optional[dict] = None,
+                  workers: Optional[int] = None) -> dict:
+    """Write an archive of the vault, return the counts of books and pages.
+
+    MODE_RAW copies the encrypted rows as they are, no key is needed and the
+    archive opens with the vault password. MODE_REENCRYPTED decrypts with
+    user_key and encrypts with backup_key, derived from backup_password with
+    backup_kdf."""
+    if mode not in ARCHIVE_MODES:
+        raise ValueError(f"unknown archive mode: {mode}")
+    session.flushPendingWrites()
+    conn = sqlite3.connect(f"file:{session.dbfile}?mode=ro", uri=True)
+    partial = destination + ".partial"
+    try:
+        # every read below sees the same snapshot of the vault
+        conn.execute("BEGIN")
+        if mode == MODE_RAW:
+            kdf = session.getKdfParams()
+            verifier = conn.execute(storage.SQL_READ_VERIFIER, (1,)).fetchone()[0]
+            rows = vaultRows(conn)
+        else:
+            kdf = backup_kdf
+            verifier = encryptTextToData(backup_password, backup_key)
+            rows = flatten(mapBatches(batched(vaultRows(conn), BACKUP_BATCH_SIZE), reencryptBatch,
+                                      chooseWorkers(conn, workers), initWorker, (user_key, backup_key)))
+        header = {"mode": mode, "created": time.time(), "schema": storage.SCHEMA_VERSION,
+                  "kdf": kdfToJson(kdf)}
+        records = (rowRecord(row) for row in rows)
+        with open(partial, "wb") as output:
+            counts = writeArchive(
+                itertools.chain([(RECORD_HEADER, [json.dumps(header).encode(), verifier])], records), output)
+            output.flush()
+            os.fsync(output.fileno())
+        os.replace(partial, destination)
+        return counts
+    finally:
+        conn.close()
+        if os.path.exists(partial):
+            os.remove(partial)
+
+
+def markdownName(name: str, taken: set, row_id: int) -> str:
+    """file name for a book or page name, unique within its folder"""
+    cleaned = re.sub(r'[\\/:*?"<>|\x00-\x1f]', "_", name).strip(" .") or "untitled"
+    cleaned = cleaned[:120]
+    if cleaned.lower() in taken:
+        cleaned = f"{cleaned} ({row_id})"
+    taken.add(cleaned.lower())
+    return cleaned
+
+
+def exportMarkdown(session: StorageSession, user_key: UserKey, directory: str,
+                   workers: Optional[int] = None) -> dict:
+    """write every book as a folder of markdown files (the book text is in
+    MARKDOWN_BOOK_FILE), return the counts of books and pages"""
+    session.flushPendingWrites()
+    os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(f"file:{session.dbfile}?mode=ro", uri=True)
+    counts = {"books": 0, "pages": 0}
+    try:
+        conn.execute("BEGIN")
+        book_folders = {}
+        folder_names = set()
+        page_names = {}
+        batches = mapBatches(batched(vaultRows(conn), BACKUP_BATCH_SIZE), decryptBatch,
+                             chooseWorkers(conn, workers), initWorker, (user_key, None))
+        for row in flatten(batches):
+            if row[0] == "book":
+                folder = os.path.join(directory, markdownName(row[2], folder_names, row[1]))
+                os.makedirs(folder, exist_ok=True)
+                book_folders[row[1]] = folder
+                page_names[row[1]] = {MARKDOWN_BOOK_FILE[:-3]}
+                with open(os.path.join(folder, MARKDOWN_BOOK_FILE), "w", encoding="utf-8") as output:
+                    output.write(row[3])
+                counts["books"] += 1
+            elif row[2] in book_folders:
+                name = markdownName(row[3], page_names[row[2]], row[1])
+                with open(os.path.join(book_folders[row[2]], name + ".md"), "w", encoding="utf-8") as output:
+                    output.write(row[4])
+                counts["pages"] += 1
+        return counts
+    finally:
+        conn.close()
+
+
+# ***************** restore
+def restoreArchive(source: str, dbfile: str, archive_key: UserKey, vault_key: UserKey,
+                   vault_password: str, kdf_params: Optional[dict],
+                   workers: Optional[int] = None) -> dict:
+    """Create the vault dbfile (it must not exist) from an archive, return the
+    counts of books and pages. Rows are decrypted with archive_key and encrypted
+    with vault_key; the vault gets vault_password and kdf_params. Nothing is left
+    at dbfile if the archive turns out to be damaged."""
+    if os.path.exists(dbfile):
+        raise FileExistsError(f"{dbfile} already exists")
+    partial = dbfile + ".partial"
+    for leftover in (partial, partial + "-wal", partial + "-shm"):
+        if os.path.exists(leftover):
+            os.remove(leftover)
+    if workers is None:
+        workers = os.cpu_count() or 1
+        if workers < 2:
+            workers = 0
+    session = StorageSession(partial)
+    counts = {"books": 0, "pages": 0}
+    try:
+        if not session.createDatabase(vault_key, vault_password, kdf_params):
+            raise ValueError("unable to create the vault")
+        with open(source, "rb") as archive:
+            records = readArchive(archive)
+            record_type, fields = next(records)
+            if record_type != RECORD_HEADER:
+                raise ValueError("archive has no header")
+            rows = (recordRow(record_type, fields) for record_type, fields in records
+                    if record_type in (RECORD_BOOK, RECORD_PAGE))
+            batches = mapBatches(batched(rows, BACKUP_BATCH_SIZE), restoreBatch, workers, initWorker,
+                                 (archive_key, vault_key, session.chunked_page_size))
+            conn = session.conn
+            written = 0
+            # pages are indexed one commit at a time, postings of the whole vault never sit in memory
+            unindexed = []
+
+            def commitRestored():
+                session.searchIndex.indexPages(conn, vault_key, unindexed,
+                                               lambda page_id: session._readPageText(vault_key, page_id))
+                unindexed.clear()
+                conn.commit()
+
+            for row in flatten(batches):
+                if row[0] == "book":
+                    conn.execute(SQL_RESTORE_BOOK, row[1:])
+                    counts["books"] += 1
+                else:
+                    _, page_id, book_id, name, text, plain = row
+                    conn.execute(SQL_RESTORE_PAGE, (page_id, book_id, name, text if text is not None else b""))
+                    if plain is not None:
+                        page_chunks.writeChunkedText(conn, vault_key, page_id, plain, session.compress_bodies)
+                        conn.execute(storage.SQL_SET_PAGE_CHUNKED, (page_id,))
+                    unindexed.append(page_id)
+                    counts["pages"] += 1
+                written += 1
+                if written % RESTORE_COMMIT_ROWS == 0:
+                    commitRestored()
+            commitRestored()
+        session.close()
+        os.replace(partial, dbfile)
+    finally:
+        # closing again is harmless, it matters when the restore failed
+        session.close()
+        for leftover in (partial, partial + "-wal", partial + "-shm"):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+    return counts
@@ -0,0 +1,5 @@
+"""Benchmarks for Maitenotas storage and crypto code.
+
+Run them from the repository root, for example:
+    python -m benchmarks.bench_session
+"""
@@ -0,0 +1,65 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas_v4
+
+Benchmark: attaching, reading ranges of and saving a big file. Peak memory is
+measured with tracemalloc and should stay near a few frames whatever the size
+of the file. """
+import argparse
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from crypto import generateUserKey, newKdfParams, KDF_PBKDF2
+from storage import StorageSession
+
+
+def measure(label: str, function) -> None:
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    result = function()
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    print(f"{label:<24} {seconds:>7.2f}s  peak {peak / 1024 / 1024:>6.1f} MB")
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size-mb", type=int, default=200, help="size of the attached file")
+    parser.add_argument("--reads", type=int, default=200, help="random 64 KB ranges read")
+    args = parser.parse_args()
+
+    kdf_params = newKdfParams(KDF_PBKDF2, iterations=1000)
+    user_key = generateUserKey("benchmark", kdf_params)
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "big.bin")
+        with open(source, "wb") as output:
+            for _ in range(args.size_mb):
+                output.write(os.urandom(1024 * 1024))
+        session = StorageSession(os.path.join(tmp, "pages.data"))
+        session.createDatabase(user_key, "benchmark", kdf_params)
+        page_id = session.createPage(user_key, session.createBook(user_key, "book", ""), "page", "")
+
+        tracemalloc.start()
+        attachment_id = measure(f"attach {args.size_mb} MB", lambda: session.addAttachment(user_key, page_id, source))
+        info = session.getAttachment(user_key, attachment_id)
+        rnd = random.Random(2)
+
+        def readRanges() -> None:
+            for _ in range(args.reads):
+                start = rnd.randrange(info.size - 65536)
+                session.readAttachment(user_key, info, start, start + 65536)
+
+        measure(f"{args.reads} range reads", readRanges)
+        measure("save to a file", lambda: session.exportAttachment(user_key, attachment_id,
+                                                                    os.path.join(tmp, "saved.bin")))
+        tracemalloc.stop()
+        session.close()
+
+
+if __name__ == "__main__":
+    main()
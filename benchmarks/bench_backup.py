@@ -0,0 +1,84 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas_v4
+
+Benchmark: hot backup, archive export (raw and re-encrypted) and restore on
+vaults of growing size. Peak memory of this process (tracemalloc) should stay
+the same whatever the size of the vault. """
+import argparse
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+import backup
+from crypto import generateUserKey, encryptTextToData, newKdfParams, KDF_PBKDF2
+from storage import StorageSession, SQL_INSERT_BOOK, SQL_INSERT_PAGE
+from benchmarks.bench_compression import markdownPage
+
+
+def createVault(dbfile: str, user_key, password: str, kdf_params: dict, pages: int, page_size: int) -> None:
+    session = StorageSession(dbfile)
+    session.createDatabase(user_key, password, kdf_params)
+    rnd = random.Random(5)
+    texts = [encryptTextToData(markdownPage(rnd, page_size), user_key, True) for _ in range(50)]
+    books = max(1, pages // 100)
+    name = encryptTextToData("name", user_key)
+    session.conn.executemany(SQL_INSERT_BOOK, [(name, texts[0])] * books)
+    session.conn.executemany(SQL_INSERT_PAGE, [(2 + p % books, name, texts[p % len(texts)])
+                                               for p in range(pages)])
+    session.conn.commit()
+    session.close()
+
+
+def measure(function) -> tuple:
+    """(seconds, peak traced MB) of function()"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    function()
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak / 1024 / 1024
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", type=int, nargs="+", default=[1000, 4000, 16000])
+    parser.add_argument("--page-size", type=int, default=8 * 1024)
+    parser.add_argument("--workers", type=int, help="worker processes, 0 works in this process")
+    args = parser.parse_args()
+
+    # cheap key derivation, the benchmark is about the data
+    kdf_params = newKdfParams(KDF_PBKDF2, iterations=1000)
+    user_key = generateUserKey("benchmark", kdf_params)
+    backup_key = generateUserKey("backup", kdf_params)
+    print(f"{'pages':>7} {'vault':>8} {'operation':<12} {'time':>8} {'peak memory':>12}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for pages in args.pages:
+            dbfile = os.path.join(tmp, f"{pages}.data")
+            createVault(dbfile, user_key, "benchmark", kdf_params, pages, args.page_size)
+            size = os.path.getsize(dbfile) / 1024 / 1024
+            session = StorageSession(dbfile)
+            raw = os.path.join(tmp, f"{pages}-raw.mbk")
+            reencrypted = os.path.join(tmp, f"{pages}-reencrypted.mbk")
+            operations = [
+                ("hot backup", lambda: backup.hotBackup(session, os.path.join(tmp, f"{pages}-copy.data"))),
+                ("export raw", lambda: backup.exportArchive(session, raw, workers=args.workers)),
+                ("export reenc", lambda: backup.exportArchive(session, reencrypted, backup.MODE_REENCRYPTED,
+                                                              user_key, backup_key, "backup", kdf_params,
+                                                              args.workers)),
+                ("restore", lambda: backup.restoreArchive(reencrypted, os.path.join(tmp, f"{pages}-restored.data"),
+                                                          backup_key, user_key, "benchmark", kdf_params,
+                                                          args.workers)),
+            ]
+            for label, function in operations:
+                seconds, peak = measure(function)
+                print(f"{pages:>7} {size:>6.1f}MB {label:<12} {seconds:>7.2f}s {peak:>10.1f}MB")
+            session.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas_v4
+
+Benchmark: write amplification of small edits to big pages, stored in one value
+against stored in content defined chunks. Bytes written are measured as growth
+of the WAL file, which holds every database page a commit changed. """
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from crypto import generateUserKey
+from storage import StorageSession
+from benchmarks.bench_compression import markdownPage
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[256 * 1024, 1024 * 1024, 10 * 1024 * 1024])
+    parser.add_argument("--edits", type=int, default=20)
+    args = parser.parse_args()
+
+    user_key = generateUserKey("benchmark")
+    rnd = random.Random(4)
+    print(f"{'page':>9} {'layout':<8} {'written per edit':>17} {'amplification':>14} "
+          f"{'save':>9} {'read':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes:
+            text = markdownPage(rnd, size)
+            positions = [rnd.randrange(len(text)) for _ in range(args.edits)]
+            for layout, chunked_page_size in (("inline", None), ("chunked", 1)):
+                dbfile = os.path.join(tmp, f"{size}-{layout}.data")
+                session = StorageSession(dbfile, chunked_page_size=chunked_page_size)
+                session.createDatabase(user_key, "benchmark")
+                # keep every written page in the WAL so its growth can be measured
+                session.conn.execute("PRAGMA wal_autocheckpoint=0")
+                book_id = session.createBook(user_key, "Book", "")
+                page_id = session.createPage(user_key, book_id, "Page", text)
+                edited = text
+                written = []
+                saves = []
+                for position in positions:
+                    edited = edited[:position] + "x" + edited[position:]
+                    wal_before = os.path.getsize(dbfile + "-wal")
+                    start = time.perf_counter()
+                    session.updatePageText(user_key, page_id, edited)
+                    saves.append(time.perf_counter() - start)
+                    written.append(os.path.getsize(dbfile + "-wal") - wal_before)
+                start = time.perf_counter()
+                assert session.getPageText(user_key, page_id) == edited
+                read = time.perf_counter() - start
+                session.close()
+                per_edit = statistics.median(written)
+                print(f"{size / 1024:>7.0f}KB {layout:<8} {per_edit / 1024:>15.1f}KB "
+                      f"{per_edit / len(text.encode()):>13.3f}x "
+                      f"{statistics.median(saves) * 1000:>7.1f}ms {read * 1000:>7.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
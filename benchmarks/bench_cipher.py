@@ -0,0 +1,47 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas_v4
+
+Benchmark: stored size and encrypt/decrypt throughput of every cipher engine """
+import argparse
+import os
+import time
+
+from crypto import UserKey, CIPHER_ENGINES
+
+
+def throughput(function, data, repeat: int) -> float:
+    """MB per second"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function(data)
+    elapsed = time.perf_counter() - start
+    return len(data) * repeat / elapsed / 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[32, 4096, 102400, 1048576])
+    parser.add_argument("--megabytes", type=float, default=20.0,
+                        help="amount of data to process per measurement")
+    args = parser.parse_args()
+
+    key_bytes = os.urandom(32)
+    print(f"{'engine':<20} {'plain':>9} {'stored':>9} {'overhead':>9} "
+          f"{'encrypt MB/s':>13} {'decrypt MB/s':>13}")
+    for size in args.sizes:
+        data = ("markdown text " * (size // 14 + 1)).encode()[:size]
+        repeat = max(1, int(args.megabytes * 1e6 / size))
+        for name in CIPHER_ENGINES:
+            key = UserKey(key_bytes, name)
+            token = key.encrypt(data)
+            assert key.decrypt(token) == data
+            overhead = (len(token) - size) / size * 100
+            print(f"{name:<20} {size:>9} {len(token):>9} {overhead:>8.1f}% "
+                  f"{throughput(key.encrypt, data, repeat):>13.1f} "
+                  f"{throughput(key.decrypt, token, repeat):>13.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas_v4
+
+Benchmark: database size and read latency with and without compression of page bodies """
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from crypto import generateUserKey
+from storage import StorageSession
+
+WORDS = ("the of and to in is you that it he was for on are as with his they at be this have "
+         "from or one had by word but not what all were we when your can said there use an each "
+         "which she do how their if will up other about out many then them these so some her "
+         "would make like him into time has look two more write go see number no way could people "
+         "my than first water been call who oil its now find long down day did get come made may "
+         "part meeting project budget review notes idea draft todo python storage journal").split()
+
+
+def markdownPage(rnd: random.Random, size: int) -> str:
+    """text that looks like notes: headings, paragraphs, lists and some code"""
+    parts = []
+    length = 0
+    while length < size:
+        kind = rnd.random()
+        if kind < 0.1:
+            line = "## " + " ".join(rnd.choices(WORDS, k=rnd.randint(2, 6))).capitalize()
+        elif kind < 0.35:
+            line = "\n".join(" - " + " ".join(rnd.choices(WORDS, k=rnd.randint(3, 10)))
+                             for _ in range(rnd.randint(2, 6)))
+        elif kind < 0.4:
+            line = "```\n" + "\n".join(f"value_{rnd.randint(0, 99)} = {rnd.randint(0, 9999)}"
+                                       for _ in range(rnd.randint(2, 8))) + "\n```"
+        else:
+            line = " ".join(rnd.choices(WORDS, k=rnd.randint(15, 60))).capitalize() + "."
+        parts.append(line)
+        length += len(line) + 2
+    return "\n\n".join(parts)[:size]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", type=int, default=500)
+    parser.add_argument("--median-size", type=int, default=6000,
+                        help="median page size, sizes follow a log-normal distribution")
+    parser.add_argument("--reads", type=int, default=1000)
+    args = parser.parse_args()
+
+    rnd = random.Random(1)
+    corpus = [markdownPage(rnd, int(rnd.lognormvariate(0, 1.2) * args.median_size) + 1)
+              for _ in range(args.pages)]
+    print(f"corpus: {args.pages} pages, {sum(map(len, corpus)) / 1e6:.1f} MB of text")
+
+    user_key = generateUserKey("benchmark")
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, compress in (("encrypted only", False), ("compressed+encrypted", True)):
+            dbfile = os.path.join(tmp, f"{compress}.data")
+            session = StorageSession(dbfile, compress_bodies=compress)
+            session.createDatabase(user_key, "benchmark")
+            book_id = session.createBook(user_key, "Book", "")
+            page_ids = [session.createPage(user_key, book_id, f"Page {i}", text)
+                        for i, text in enumerate(corpus)]
+            session.vacuum()
+            samples = []
+            for i in range(args.reads):
+                page_id = page_ids[(i * 7919) % len(page_ids)]
+                start = time.perf_counter()
+                session.getPageText(user_key, page_id)
+                samples.append(time.perf_counter() - start)
+            session.close()
+            print(f"{label:<22} file {os.path.getsize(dbfile) / 1e6:8.2f} MB"
+                  f"   read median {statistics.median(samples) * 1000:7.3f} ms"
+                  f"   max {max(samples) * 1000:7.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
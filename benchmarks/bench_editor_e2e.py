@@ -0,0 +1,273 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas_v4
+
+End-to-end latency of the editor window: a MaiteBody on a generated vault,
+driven with mouse clicks on the book and page lists and key presses in the
+editor, as a user would. Reports percentiles of
+
+    book.clickToPages        book clicked -> first page names listed
+    book.clickToText         book clicked -> book text visible in CodeMirror
+    page.clickToRead         page clicked -> text read and decrypted (storage thread)
+    page.editorLoad          text read -> text visible (web channel chunks, setValue)
+    page.clickToVisible      page clicked -> text visible
+    bridge.roundTrip         flush asked from python -> editor answered changesFlushed
+    edit.keystrokeToPython   keys typed -> every change in the python buffer (debounced)
+    edit.saveToPersisted     save asked -> text committed to the vault
+    edit.keystrokeToPersisted  keys typed -> text committed
+
+Times are taken by hooks on the signals and calls of each step, not by polling.
+Needs PySide2 with QtWebEngine; without a display run it with
+QT_QPA_PLATFORM=offscreen. --input script types through CodeMirror's API when
+key events do not reach the web view (some offscreen setups).
+
+    QT_QPA_PLATFORM=offscreen python -m benchmarks.bench_editor_e2e --output e2e.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+from PySide2.QtCore import QEventLoop, QTimer, Qt
+from PySide2.QtTest import QTest
+from PySide2.QtWidgets import QApplication
+
+from crypto import generateUserKey
+from storage import StorageSession
+from maitenotas import MaiteBody
+from attachment_scheme import registerAttachmentScheme
+from benchmarks.bench_editor_load import evaluate
+from benchmarks.suite import gitCommit
+from benchmarks.vault_generator import generateVault
+
+METRICS = ["book.clickToPages", "book.clickToText", "page.clickToRead", "page.editorLoad",
+           "page.clickToVisible", "bridge.roundTrip", "edit.keystrokeToPython", "edit.saveToPersisted",
+           "edit.keystrokeToPersisted"]
+PERCENTILES = (50, 90, 99)
+
+
+def waitFor(condition: Callable[[], bool], timeout_ms: int = 30000) -> None:
+    """run the event loop until condition() is true, checked every millisecond"""
+    deadline = time.perf_counter() + timeout_ms / 1000
+    loop = QEventLoop()
+    timer = QTimer()
+    timer.setInterval(1)
+    timer.timeout.connect(loop.quit)
+    timer.start()
+    try:
+        while not condition():
+            if time.perf_counter() > deadline:
+                raise TimeoutError("the editor window did not answer")
+            loop.exec_()
+    finally:
+        timer.stop()
+
+
+def percentile(samples: List[float], p: int) -> float:
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, max(0, int(round(len(samples) * p / 100)) - 1))]
+
+
+class EditorHarness:
+    """A MaiteBody with hooks that note when each step of a click or an edit ends"""
+
+    def __init__(self, session: StorageSession, reader: StorageSession, user_key, input_mode: str):
+        self.session = session
+        self.reader = reader  # a connection of its own, what is committed is what it reads
+        self.user_key = user_key
+        self.input_mode = input_mode
+        self.samples: Dict[str, List[float]] = {metric: [] for metric in METRICS}
+        self.rnd = random.Random(6)
+        self.edits = 0
+        self.body = MaiteBody(user_key, session)
+        self.body.resize(1200, 800)
+        self.body.show()
+        self.page = self.body.webEngineView.page()
+        # moments the steps ended, set by the hooks
+        self.shown: Dict[int, float] = {}
+        self.textRead = None
+        self.pagesListed = None
+        self.queued = None
+        self.body.handler.documentShown.connect(lambda docId: self.shown.setdefault(docId, time.perf_counter()))
+        self.body.pagesModel.firstBatchLoaded.connect(self.notePagesListed)
+        showTextInEditor = self.body.showTextInEditor
+
+        def hookedShowText(document, text):
+            self.textRead = time.perf_counter()
+            showTextInEditor(document, text)
+
+        self.body.showTextInEditor = hookedShowText
+        queuePageText = self.body.storage.queuePageText
+
+        def hookedQueuePageText(user_key, page_id, text):
+            self.queued = time.perf_counter()
+            return queuePageText(user_key, page_id, text)
+
+        self.body.storage.queuePageText = hookedQueuePageText
+        waitFor(lambda: evaluate(self.page, "typeof bridge !== 'undefined' && bridge.handler !== null"))
+        waitFor(lambda: self.body.booksModel.rowCount() > 0)
+
+    def notePagesListed(self) -> None:
+        if self.pagesListed is None:
+            self.pagesListed = time.perf_counter()
+
+    def click(self, view, row: int) -> float:
+        """left click on a row of a list view, return the time of the click"""
+        index = view.model().index(row, 0)
+        view.scrollTo(index)
+        center = view.visualRect(index).center()
+        start = time.perf_counter()
+        QTest.mouseClick(view.viewport(), Qt.LeftButton, Qt.NoModifier, center)
+        return start
+
+    def waitShown(self) -> int:
+        """wait until the document being loaded is visible, return its id"""
+        waitFor(lambda: self.body.editorDocument is not None and self.body.handler.currentDocId in self.shown)
+        return self.body.handler.currentDocId
+
+    # ***************** steps
+    def openBook(self) -> None:
+        model = self.body.booksModel
+        self.pagesListed = None
+        start = self.click(self.body.listBooksWidget, self.rnd.randrange(model.rowCount()))
+        docId = self.waitShown()
+        self.samples["book.clickToText"].append(self.shown[docId] - start)
+        if self.body.pagesModel.ids:
+            waitFor(lambda: self.pagesListed is not None)
+            self.samples["book.clickToPages"].append(self.pagesListed - start)
+
+    def openPage(self) -> bool:
+        model = self.body.pagesModel
+        if model.rowCount() == 0:
+            return False
+        self.textRead = None
+        start = self.click(self.body.listPagesWidget, self.rnd.randrange(model.rowCount()))
+        docId = self.waitShown()
+        self.samples["page.clickToRead"].append(self.textRead - start)
+        self.samples["page.editorLoad"].append(self.shown[docId] - self.textRead)
+        self.samples["page.clickToVisible"].append(self.shown[docId] - start)
+        return True
+
+    def bridgeRoundTrip(self) -> None:
+        answered = []
+        docId = self.body.handler.currentDocId
+        start = time.perf_counter()
+        self.body.handler.whenSaved(docId, lambda text: answered.append(time.perf_counter()))
+        waitFor(lambda: answered)
+        self.samples["bridge.roundTrip"].append(answered[0] - start)
+
+    def type(self, text: str) -> None:
+        if self.input_mode == "keys":
+            QTest.keyClicks(self.body.webEngineView.focusProxy(), text)
+        else:
+            evaluate(self.page, f"editor.replaceSelection({json.dumps(text)}); true;")
+
+    def edit(self) -> None:
+        """type a word at the end of the page and save it as a page switch would"""
+        kind, pageId = self.body.editorDocument
+        docId = self.body.handler.currentDocId
+        buffer = self.body.handler.buffers[docId]
+        self.edits += 1
+        marker = f" zq{self.edits}x"
+        evaluate(self.page, "editor.focus(); editor.setCursor(editor.lineCount(), 0); true;")
+        revision = buffer.revision
+        expected = revision + (len(marker) if self.input_mode == "keys" else 1)
+        start = time.perf_counter()
+        self.type(marker)
+        # the editor sends its changes once typing paused
+        try:
+            waitFor(lambda: buffer.revision >= expected, 5000)
+        except TimeoutError:
+            raise SystemExit("typed keys did not reach the editor, try --input script")
+        typed = time.perf_counter()
+        self.samples["edit.keystrokeToPython"].append(typed - start)
+
+        self.queued = None
+        self.body.saveCurrentTextOnScreen()
+        waitFor(lambda: self.queued is not None)
+        persisted = []
+        # the storage thread runs calls in order, the flush comes after the queued save
+        self.body.storage.call(self.session.flushPendingWrites, (),
+                               lambda count: persisted.append(time.perf_counter()))
+        waitFor(lambda: persisted)
+        self.samples["edit.saveToPersisted"].append(persisted[0] - typed)
+        self.samples["edit.keystrokeToPersisted"].append(persisted[0] - start)
+        self.reader.textCache.clear()
+        if marker not in self.reader.getPageText(self.user_key, pageId):
+            raise RuntimeError(f"page {pageId} was not saved with its edit")
+
+    def close(self) -> None:
+        self.body.shutdown()
+        self.body.close()
+
+
+def report(samples: Dict[str, List[float]]) -> dict:
+    results = {}
+    print(f"{'metric':<28} {'n':>5} " + " ".join(f"{'p' + str(p):>9}" for p in PERCENTILES) + f" {'max':>9}")
+    for metric in METRICS:
+        values = samples[metric]
+        if not values:
+            continue
+        results[metric] = {"samples": len(values), "maxMs": max(values) * 1000,
+                           **{f"p{p}Ms": percentile(values, p) * 1000 for p in PERCENTILES}}
+        print(f"{metric:<28} {len(values):>5} " +
+              " ".join(f"{percentile(values, p) * 1000:>7.1f}ms" for p in PERCENTILES) +
+              f" {max(values) * 1000:>7.1f}ms")
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--books", type=int, default=10)
+    parser.add_argument("--pages-per-book", type=int, default=100)
+    parser.add_argument("--page-size", default="lognormal:2048:1.0", help="page size distribution")
+    parser.add_argument("--rounds", type=int, default=20, help="books opened")
+    parser.add_argument("--pages", type=int, default=10, help="pages opened in each book")
+    parser.add_argument("--edit-every", type=int, default=3, help="edit one page in this many")
+    parser.add_argument("--input", choices=["keys", "script"], default="keys")
+    parser.add_argument("--output", help="write the percentiles to this JSON file")
+    args = parser.parse_args()
+
+    # the web engine needs its url schemes before the application exists
+    registerAttachmentScheme()
+    app = QApplication(sys.argv)
+    with tempfile.TemporaryDirectory() as tmp:
+        summary = generateVault(os.path.join(tmp, "e2e.data"), args.books, args.pages_per_book, args.page_size)
+        user_key = generateUserKey(summary.password, summary.kdf_params)
+        session = StorageSession(summary.dbfile)
+        reader = StorageSession(summary.dbfile)
+        harness = EditorHarness(session, reader, user_key, args.input)
+        try:
+            opened = 0
+            for _ in range(args.rounds):
+                harness.openBook()
+                for _ in range(args.pages):
+                    if not harness.openPage():
+                        break
+                    opened += 1
+                    harness.bridgeRoundTrip()
+                    if opened % args.edit_every == 0:
+                        harness.edit()
+        finally:
+            harness.close()
+            reader.close()
+            session.close()
+        vault = summary.describe()
+    results = report(harness.samples)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump({"meta": {"commit": gitCommit(), "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                                "python": platform.python_version(), "platform": platform.platform(),
+                                "input": args.input},
+                       "vault": vault, "results": results}, output, indent=1)
+    app.quit()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas_v4
+
+Benchmark: time to display a page in the editor, chunks through the web channel
+against the old runJavaScript("setText('...')") source string, and opening and
+scrolling a log-style page in large document mode. Needs PySide2 with
+QtWebEngine; without a display run it with QT_QPA_PLATFORM=offscreen """
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+from PySide2.QtCore import QEventLoop, QTimer, QUrl
+from PySide2.QtWebChannel import QWebChannel
+from PySide2.QtWebEngineWidgets import QWebEngineView
+from PySide2.QtWidgets import QApplication
+
+from maitenotas import Handler
+from benchmarks.bench_compression import markdownPage
+
+
+def waitFor(condition, timeout_ms: int = 60000) -> None:
+    """run the event loop until condition() is true"""
+    deadline = time.perf_counter() + timeout_ms / 1000
+    loop = QEventLoop()
+    while not condition():
+        if time.perf_counter() > deadline:
+            raise TimeoutError("the editor did not answer")
+        QTimer.singleShot(5, loop.quit)
+        loop.exec_()
+
+
+def evaluate(page, script: str):
+    result = []
+    page.runJavaScript(script, result.append)
+    waitFor(lambda: result)
+    return result[0]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100 * 1024, 1024 * 1024, 10 * 1024 * 1024])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--log-lines", type=int, default=50000)
+    args = parser.parse_args()
+
+    app = QApplication(sys.argv)
+    view = QWebEngineView()
+    handler = Handler()
+    channel = QWebChannel()
+    channel.registerObject("handler", handler)
+    view.page().setWebChannel(channel)
+    view.load(QUrl.fromLocalFile(os.path.join(os.getcwd(), "codemirror_ui.html")))
+    view.show()
+    waitFor(lambda: evaluate(view.page(), "typeof bridge !== 'undefined' && bridge.handler !== null"))
+
+    shown = []
+    handler.documentShown.connect(shown.append)
+    rnd = random.Random(2)
+    for size in args.sizes:
+        # the old escaping breaks on backslashes, keep them out of the comparison
+        text = markdownPage(rnd, size).replace("\\", "")
+        channel_samples = []
+        legacy_samples = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            docId = handler.newDocument(text)
+            handler.sendDocument(docId, text)
+            waitFor(lambda: docId in shown)
+            channel_samples.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            docId = handler.newDocument(text)
+            escaped = text.replace("\n", "\\n").replace("'", "\\'")
+            evaluate(view.page(), f"setText({docId}, '{escaped}'); true;")
+            legacy_samples.append(time.perf_counter() - start)
+        assert evaluate(view.page(), "editor.getValue().length") == len(text)
+        print(f"{size / 1024:>8.0f} KB   channel chunks {statistics.median(channel_samples) * 1000:8.1f} ms"
+              f"   runJavaScript literal {statistics.median(legacy_samples) * 1000:8.1f} ms")
+
+    text = "\n".join(f"2021-03-{i % 28 + 1:02d} 12:{i % 60:02d}:00 INFO worker {i % 16} "
+                      f"processed batch {i} in {rnd.randint(1, 999)} ms" for i in range(args.log_lines))
+    start = time.perf_counter()
+    docId = handler.newDocument(text)
+    handler.sendDocument(docId, text)
+    waitFor(lambda: docId in shown)
+    opened = time.perf_counter() - start
+    assert evaluate(view.page(), "largeDocumentMode")
+    # scrollIntoView lays out the new viewport before it returns
+    scroll_ms = evaluate(view.page(), """
+        (function () {
+            var times = [];
+            for (var i = 0; i < 50; i++) {
+                var start = performance.now();
+                editor.scrollIntoView({line: Math.floor(Math.random() * editor.lineCount()), ch: 0});
+                times.push(performance.now() - start);
+            }
+            times.sort(function (a, b) { return a - b; });
+            return [times[25], times[49]];
+        })();""")
+    print(f"{args.log_lines} line log: opened in {opened * 1000:.1f} ms, "
+          f"scroll jump median {scroll_ms[0]:.1f} ms, max {scroll_ms[1]:.1f} ms")
+    view.close()
+    app.quit()
+
+
+if __name__ == "__main__":
+    main()
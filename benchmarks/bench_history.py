@@ -0,0 +1,81 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas_v4
+
+Benchmark: page revision history. Bytes of history per edit against the page
+size, time to save with and without history, time to open the current text and
+to rebuild older versions. """
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+import page_history
+from crypto import generateUserKey
+from storage import StorageSession
+from benchmarks.bench_compression import markdownPage
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10 * 1024, 100 * 1024, 1024 * 1024])
+    parser.add_argument("--edits", type=int, default=100)
+    args = parser.parse_args()
+
+    # every save becomes a revision, as if they were minutes apart
+    page_history.HISTORY_COALESCE_SECONDS = 0
+    user_key = generateUserKey("benchmark")
+    rnd = random.Random(6)
+    print(f"{'page':>9} {'history':<8} {'per edit':>10} {'of page':>8} {'save':>9} {'open':>9} "
+          f"{'revision':>9} {'oldest':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes:
+            text = markdownPage(rnd, size)
+            edits = [(rnd.randrange(len(text)), markdownPage(rnd, 40)) for _ in range(args.edits)]
+            for keep_history in (False, True):
+                dbfile = os.path.join(tmp, f"{size}-{keep_history}.data")
+                session = StorageSession(dbfile, keep_history=keep_history)
+                session.createDatabase(user_key, "benchmark")
+                book_id = session.createBook(user_key, "Book", "")
+                page_id = session.createPage(user_key, book_id, "Page", text)
+                edited = text
+                saves = []
+                for position, insert in edits:
+                    edited = edited[:position] + insert + edited[position:]
+                    start = time.perf_counter()
+                    session.updatePageText(user_key, page_id, edited)
+                    saves.append(time.perf_counter() - start)
+                opens = []
+                for _ in range(5):
+                    start = time.perf_counter()
+                    assert session.getPageText(user_key, page_id) == edited
+                    opens.append(time.perf_counter() - start)
+                label = "on" if keep_history else "off"
+                line = f"{size / 1024:>7.0f}KB {label:<8}"
+                history = session.getPageHistory(page_id)
+                if history:
+                    stored = sum(row[3] for row in history)
+                    rebuilds = []
+                    for revision in rnd.sample([row[0] for row in history], min(20, len(history))):
+                        start = time.perf_counter()
+                        session.getPageRevision(user_key, page_id, revision)
+                        rebuilds.append(time.perf_counter() - start)
+                    start = time.perf_counter()
+                    assert session.getPageRevision(user_key, page_id, history[0][0]) == text
+                    oldest = time.perf_counter() - start
+                    line += (f" {stored / len(history) / 1024:>8.1f}KB "
+                             f"{stored / len(history) / len(text.encode()):>7.3f}x")
+                else:
+                    line += f" {'':>10} {'':>8}"
+                line += (f" {statistics.median(saves) * 1000:>7.1f}ms {statistics.median(opens) * 1000:>7.1f}ms")
+                if history:
+                    line += f" {statistics.median(rebuilds) * 1000:>7.1f}ms {oldest * 1000:>7.1f}ms"
+                print(line)
+                session.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas_v4
+
+Benchmark: importing a folder of markdown files, one createPage (one commit)
+per file as the dialogs do, against markdown_import (parallel encryption,
+executemany, one commit per IMPORT_COMMIT_ROWS pages). The createPage rate is
+measured on the first --baseline files only. """
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import markdown_import
+from crypto import generateUserKey
+from storage import StorageSession
+from benchmarks.bench_compression import markdownPage
+
+
+def writeTree(directory: str, files: int, page_size: int) -> None:
+    rnd = random.Random(4)
+    texts = [markdownPage(rnd, page_size) for _ in range(50)]
+    books = max(1, files // 1000)
+    for book in range(books):
+        os.makedirs(os.path.join(directory, f"Book {book}"))
+    for index in range(files):
+        with open(os.path.join(directory, f"Book {index % books}", f"Page {index:06d}.md"), "w",
+                  encoding="utf-8") as output:
+            output.write(texts[index % len(texts)])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=50000)
+    parser.add_argument("--page-size", type=int, default=2 * 1024)
+    parser.add_argument("--baseline", type=int, default=500)
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, os.cpu_count() or 1])
+    args = parser.parse_args()
+
+    user_key = generateUserKey("benchmark")
+    with tempfile.TemporaryDirectory() as tmp:
+        tree = os.path.join(tmp, "notes")
+        writeTree(tree, args.files, args.page_size)
+
+        session = StorageSession(os.path.join(tmp, "pages.data"))
+        session.createDatabase(user_key, "benchmark")
+        books = markdown_import.scanDirectory(tree)
+        book_id = session.createBook(user_key, books[0][0], "")
+        start = time.perf_counter()
+        for name, path in books[0][2][:args.baseline]:
+            session.createPage(user_key, book_id, name, markdown_import.readMarkdownFile(path))
+        seconds = (time.perf_counter() - start) / args.baseline * args.files
+        session.close()
+        print(f"{'createPage':<22} {seconds:>8.1f}s {args.files / seconds:>8.0f} pages/s (estimated)")
+
+        for workers in args.workers:
+            session = StorageSession(os.path.join(tmp, f"import-{workers}.data"))
+            session.createDatabase(user_key, "benchmark")
+            start = time.perf_counter()
+            counts = markdown_import.importMarkdown(session, user_key, tree, workers)
+            seconds = time.perf_counter() - start
+            session.close()
+            label = f"import, {workers} workers"
+            print(f"{label:<22} {seconds:>8.1f}s {counts['pages'] / seconds:>8.0f} pages/s")
+
+
+if __name__ == "__main__":
+    main()
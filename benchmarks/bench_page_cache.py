@@ -0,0 +1,71 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas_v4
+
+Benchmark: paging through a book one page after the other, as listPagesClicked
+does, without the text cache, with it, and with it warmed by the prefetcher
+(the next pages are read on a second thread while the user reads). """
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from crypto import generateUserKey
+from storage import StorageSession
+from benchmarks.bench_compression import markdownPage
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", type=int, default=100)
+    parser.add_argument("--page-size", type=int, default=20 * 1024)
+    parser.add_argument("--read-ms", type=float, default=50, help="time spent on each page")
+    parser.add_argument("--neighbours", type=int, default=2)
+    args = parser.parse_args()
+
+    user_key = generateUserKey("benchmark")
+    rnd = random.Random(8)
+    with tempfile.TemporaryDirectory() as tmp:
+        dbfile = os.path.join(tmp, "cache.data")
+        session = StorageSession(dbfile)
+        session.createDatabase(user_key, "benchmark")
+        book_id = session.createBook(user_key, "Book", "")
+        page_ids = [session.createPage(user_key, book_id, f"Page {i}", markdownPage(rnd, args.page_size))
+                    for i in range(args.pages)]
+        session.close()
+
+        prefetcher = ThreadPoolExecutor(max_workers=1)
+        print(f"{'mode':<10} {'median open':>12} {'p90 open':>10} {'hit rate':>9} {'held':>9}")
+        for mode in ("no cache", "cache", "prefetch"):
+            session = StorageSession(dbfile, text_cache_bytes=0 if mode == "no cache" else 64 * 1024 * 1024)
+            opens = []
+            for index, page_id in enumerate(page_ids):
+                start = time.perf_counter()
+                session.getPageText(user_key, page_id)
+                opens.append(time.perf_counter() - start)
+                if mode == "prefetch":
+                    prefetcher.submit(session.prefetchPages, user_key,
+                                      page_ids[index + 1:index + 1 + args.neighbours])
+                time.sleep(args.read_ms / 1000)
+            # the second pass shows the cache, the first one the prefetcher
+            if mode == "cache":
+                opens = []
+                for page_id in page_ids:
+                    start = time.perf_counter()
+                    session.getPageText(user_key, page_id)
+                    opens.append(time.perf_counter() - start)
+            stats = session.getTextCacheStatistics()
+            opens.sort()
+            print(f"{mode:<10} {statistics.median(opens) * 1000:>10.2f}ms "
+                  f"{opens[int(len(opens) * 0.9)] * 1000:>8.2f}ms {stats['hitRate']:>8.0%} "
+                  f"{stats['bytesHeld'] / 1024:>7.0f}KB")
+            session.close()
+        prefetcher.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas_v4
+
+Benchmark: opening a book with many pages, the old QListWidget filled with every
+decrypted name against the lazy ItemListModel (ids first, names one batch at a
+time). Needs PySide2 QtWidgets; without a display run it with
+QT_QPA_PLATFORM=offscreen """
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from PySide2.QtCore import QEventLoop, QTimer
+from PySide2.QtWidgets import QApplication, QListWidget, QListWidgetItem
+
+from crypto import generateUserKey
+from storage import StorageSession
+from async_storage import AsyncStorage
+from list_models import ItemListModel, createListView
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", type=int, nargs="+", default=[1000, 10000, 50000])
+    args = parser.parse_args()
+
+    app = QApplication(sys.argv)
+    user_key = generateUserKey("benchmark")
+    print(f"{'pages':>7} {'widget, cold':>13} {'widget, cached':>15} {'model, cold':>12} {'model, cached':>14}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for count in args.pages:
+            dbfile = os.path.join(tmp, f"{count}.data")
+            session = StorageSession(dbfile)
+            session.createDatabase(user_key, "benchmark")
+            book_id = session.createBook(user_key, "Book", "")
+            with session.lock:
+                for i in range(count):
+                    session.createPage(user_key, book_id, f"Page {i:06d}", "")
+            session.close()
+
+            results = []
+            # the old way: decrypt and sort every name, then one item per page
+            session = StorageSession(dbfile)
+            widget = QListWidget()
+            widget.show()
+            for _ in range(2):
+                start = time.perf_counter()
+                widget.clear()
+                for page_id, name in session.getPagesOfBook(user_key, book_id):
+                    item = QListWidgetItem(name)
+                    item.itemId = page_id
+                    widget.addItem(item)
+                app.processEvents()
+                results.append(time.perf_counter() - start)
+            widget.close()
+            session.close()
+
+            # the model: time until the first rows are on screen
+            session = StorageSession(dbfile)
+            storage = AsyncStorage(session)
+            model = ItemListModel(lambda ids, callback: storage.getTitles(user_key, "page", ids, callback))
+            view = createListView(model)
+            view.show()
+            for _ in range(2):
+                start = time.perf_counter()
+                model.reset([])
+                storage.getPageIdsOfBook(book_id, model.reset)
+                loop = QEventLoop()
+                while model.rowCount() == 0:
+                    QTimer.singleShot(1, loop.quit)
+                    loop.exec_()
+                app.processEvents()
+                results.append(time.perf_counter() - start)
+            view.close()
+            storage.shutdown()
+            session.close()
+            print(f"{count:>7} " + " ".join(f"{seconds * 1000:>{width - 2}.1f}ms"
+                                            for seconds, width in zip(results, (13, 15, 12, 14))))
+
+
+if __name__ == "__main__":
+    main()
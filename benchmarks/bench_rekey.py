@@ -0,0 +1,55 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas_v4
+
+Benchmark: changing the password of a vault (every row decrypted and encrypted
+again in one transaction) with a growing number of worker processes. The time
+should drop with the number of cores until writing the rows dominates. """
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from crypto import generateUserKey, newKdfParams, KDF_PBKDF2
+from storage import StorageSession
+from benchmarks.bench_backup import createVault
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=100000, help="pages in the vault")
+    parser.add_argument("--page-size", type=int, default=1024)
+    cores = os.cpu_count() or 1
+    parser.add_argument("--workers", type=int, nargs="+",
+                        default=sorted({0, *(n for n in (1, 2, 4, 8) if n <= cores), cores}))
+    args = parser.parse_args()
+
+    # cheap key derivation, the benchmark is about the rows
+    kdf_params = newKdfParams(KDF_PBKDF2, iterations=1000)
+    user_key = generateUserKey("benchmark", kdf_params)
+    new_key = generateUserKey("changed", kdf_params)
+    print(f"{cores} cores")
+    print(f"{'workers':>7} {'time':>8} {'rows/s':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        original = os.path.join(tmp, "original.data")
+        createVault(original, user_key, "benchmark", kdf_params, args.rows, args.page_size)
+        for workers in args.workers:
+            dbfile = os.path.join(tmp, f"rekey-{workers}.data")
+            shutil.copyfile(original, dbfile)
+            session = StorageSession(dbfile)
+            rows = []
+            start = time.perf_counter()
+            changed = session.reencryptVault(user_key, new_key, "changed", kdf_params, workers,
+                                             lambda done, total: rows.append(done))
+            seconds = time.perf_counter() - start
+            session.close()
+            os.remove(dbfile)
+            if not changed:
+                raise SystemExit("re-key failed")
+            print(f"{workers:>7} {seconds:>7.2f}s {rows[-1] / seconds:>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas_v4
+
+Scaling check: page listing and book deletion on a large vault, before and after the
+schema migrations (index on page.book_id, foreign key with ON DELETE CASCADE) """
+import argparse
+import os
+import tempfile
+import time
+
+from crypto import generateUserKey, encryptTextToData
+from storage import (StorageSession, createConnection, createTable, migrateDatabase,
+                     getSchemaVersion, SQL_CREATE_BOOK_TABLE, SQL_CREATE_PAGE_TABLE,
+                     SQL_INSERT_BOOK, SQL_INSERT_PAGE, SQL_READ_PAGES_OF_BOOK, SCHEMA_VERSION)
+
+
+def createVersion0Database(dbfile: str, user_key, books: int, pages: int) -> None:
+    """write a database the way the first releases did, without any migration"""
+    conn = createConnection(dbfile)
+    createTable(conn, SQL_CREATE_BOOK_TABLE)
+    createTable(conn, SQL_CREATE_PAGE_TABLE)
+    name = encryptTextToData("name", user_key)
+    text = encryptTextToData("text", user_key)
+    conn.execute(SQL_INSERT_BOOK, (encryptTextToData("benchmark", user_key), ""))
+    conn.executemany(SQL_INSERT_BOOK, [(name, text)] * books)
+    # spread the pages over all books, like years of use would
+    conn.executemany(SQL_INSERT_PAGE, [(2 + (p % books), name, text) for p in range(pages)])
+    conn.commit()
+    conn.close()
+
+
+def timeQueries(conn, books: int, repeat: int) -> float:
+    start = time.perf_counter()
+    for i in range(repeat):
+        conn.execute(SQL_READ_PAGES_OF_BOOK, (2 + (i * 37) % books,)).fetchall()
+    return (time.perf_counter() - start) / repeat
+
+
+def describePlan(conn) -> str:
+    rows = conn.execute("EXPLAIN QUERY PLAN " + SQL_READ_PAGES_OF_BOOK, (2,)).fetchall()
+    return "; ".join(row[-1] for row in rows)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--books", type=int, default=1000)
+    parser.add_argument("--pages", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    user_key = generateUserKey("benchmark")
+    with tempfile.TemporaryDirectory() as tmp:
+        dbfile = os.path.join(tmp, "bench.data")
+        createVersion0Database(dbfile, user_key, args.books, args.pages)
+
+        conn = createConnection(dbfile)
+        before = timeQueries(conn, args.books, args.repeat)
+        print(f"version {getSchemaVersion(conn)}: pages of a book {before * 1000:8.3f} ms"
+              f"   plan: {describePlan(conn)}")
+        start = time.perf_counter()
+        conn.execute("delete from page where book_id=?", (2,))
+        conn.execute("delete from book where id=?", (2,))
+        conn.rollback()
+        print(f"version {getSchemaVersion(conn)}: delete book   "
+              f"{(time.perf_counter() - start) * 1000:8.3f} ms")
+
+        start = time.perf_counter()
+        migrateDatabase(conn)
+        print(f"migration to version {SCHEMA_VERSION} took {time.perf_counter() - start:.3f} s")
+        conn.close()
+
+        session = StorageSession(dbfile)
+        after = timeQueries(session.conn, args.books, args.repeat)
+        print(f"version {getSchemaVersion(session.conn)}: pages of a book {after * 1000:8.3f} ms"
+              f"   plan: {describePlan(session.conn)}")
+        start = time.perf_counter()
+        session.deleteBook(user_key, 3)
+        print(f"version {getSchemaVersion(session.conn)}: delete book   "
+              f"{(time.perf_counter() - start) * 1000:8.3f} ms")
+        remaining = session.conn.execute("select count(*) from page where book_id=3").fetchone()[0]
+        total = session.conn.execute("select count(*) from page").fetchone()[0]
+        assert remaining == 0, "pages of a deleted book must be deleted with it"
+        assert total == args.pages - args.pages // args.books, "migration must keep every page"
+        session.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas_v4
+
+Benchmark: full vault search throughput and time to first hit, in process and with worker processes """
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from crypto import generateUserKey
+from storage import StorageSession
+from search import searchVault, SEARCH_SUBSTRING, SEARCH_REGEX
+from benchmarks.bench_compression import markdownPage
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", type=int, default=10000)
+    parser.add_argument("--page-size", type=int, default=4000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, 2, os.cpu_count() or 1])
+    args = parser.parse_args()
+
+    user_key = generateUserKey("benchmark")
+    rnd = random.Random(3)
+    with tempfile.TemporaryDirectory() as tmp:
+        session = StorageSession(os.path.join(tmp, "bench.data"))
+        session.createDatabase(user_key, "benchmark")
+        book_id = session.createBook(user_key, "Book", "")
+        total = 0
+        for i in range(args.pages):
+            text = markdownPage(rnd, args.page_size)
+            if i % 100 == 0:
+                text += "\nneedle in the haystack"
+            total += len(text)
+            session.createPage(user_key, book_id, f"Page {i}", text)
+        print(f"{args.pages} pages, {total / 1e6:.1f} MB of text")
+
+        for query, mode in (("needle", SEARCH_SUBSTRING), ("NEEDLE", SEARCH_SUBSTRING),
+                            (r"need\w+ in", SEARCH_REGEX)):
+            for workers in args.workers:
+                start = time.perf_counter()
+                first = None
+                hits = 0
+                for _ in searchVault(session, user_key, query, mode, ignore_case=True,
+                                     workers=workers):
+                    if first is None:
+                        first = time.perf_counter() - start
+                    hits += 1
+                elapsed = time.perf_counter() - start
+                print(f"{mode:<10} {query!r:<14} workers {workers:>2}: {hits} hits, "
+                      f"first after {first * 1000:7.1f} ms, total {elapsed:6.2f} s, "
+                      f"{total / elapsed / 1e6:7.1f} MB/s")
+        session.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas_v4
+
+Benchmark: search index upkeep on save, rebuild time and query latency against a full scan """
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from crypto import generateUserKey
+from storage import StorageSession
+from search import searchVault
+from benchmarks.bench_compression import markdownPage
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", type=int, default=5000)
+    parser.add_argument("--page-size", type=int, default=4000)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    user_key = generateUserKey("benchmark")
+    rnd = random.Random(5)
+    with tempfile.TemporaryDirectory() as tmp:
+        session = StorageSession(os.path.join(tmp, "bench.data"))
+        session.createDatabase(user_key, "benchmark")
+        book_id = session.createBook(user_key, "Book", "")
+        page_ids = []
+        start = time.perf_counter()
+        for i in range(args.pages):
+            text = markdownPage(rnd, args.page_size)
+            if i % 100 == 0:
+                text += "\nneedle in the haystack"
+            page_ids.append(session.createPage(user_key, book_id, f"Page {i}", text))
+        elapsed = time.perf_counter() - start
+        print(f"{args.pages} pages created with indexing: {elapsed / args.pages * 1000:.2f} ms per page")
+
+        samples = []
+        for i in range(args.queries):
+            page_id = page_ids[(i * 7919) % len(page_ids)]
+            text = session.getPageText(user_key, page_id) + " one more edit"
+            start = time.perf_counter()
+            session.updatePageText(user_key, page_id, text)
+            samples.append(time.perf_counter() - start)
+        print(f"small edit saved: median {statistics.median(samples) * 1000:.2f} ms, "
+              f"max {max(samples) * 1000:.2f} ms")
+
+        start = time.perf_counter()
+        session.rebuildSearchIndex(user_key)
+        print(f"rebuild: {time.perf_counter() - start:.2f} s")
+
+        for label, query, prefix in (("keyword", "needle", False), ("two keywords", "needle haystack", False),
+                                     ("frequent word", "the", False), ("prefix", "need", True),
+                                     ("short prefix", "bu", True)):
+            session.searchIndex.clear()  # first query decrypts the vocabulary again
+            samples = []
+            for _ in range(args.queries):
+                start = time.perf_counter()
+                hits = len(session.findPages(user_key, query, prefix))
+                samples.append(time.perf_counter() - start)
+            print(f"index {label:<14} {query!r:<18} {hits:>6} hits: first {samples[0] * 1000:7.2f} ms, "
+                  f"median {statistics.median(samples) * 1000:7.2f} ms")
+
+        start = time.perf_counter()
+        hits = sum(1 for _ in searchVault(session, user_key, "needle", workers=0))
+        print(f"full scan 'needle': {hits} hits in {(time.perf_counter() - start) * 1000:.1f} ms")
+        session.close()
+
+
+if __name__ == "__main__":
+    main()
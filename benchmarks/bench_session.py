@@ -0,0 +1,92 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas_v4
+
+Benchmark: click-to-text latency with a connection per call versus a StorageSession """
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from crypto import generateUserKey, decryptDataToText
+from storage import StorageSession, createConnection, SQL_READ_PAGE_TEXT, SQL_READ_PAGES_OF_BOOK
+
+
+def legacyGetPageText(dbfile: str, user_key, page_id: int) -> str:
+    """the old storage path: open, select, decrypt, close"""
+    conn = createConnection(dbfile)
+    try:
+        row = conn.execute(SQL_READ_PAGE_TEXT, (page_id,)).fetchone()
+        return decryptDataToText(row[0], user_key)
+    finally:
+        conn.close()
+
+
+def legacyGetPagesOfBook(dbfile: str, user_key, book_id: int) -> list:
+    """the old listing path: open, select, decrypt every name, close"""
+    conn = createConnection(dbfile)
+    try:
+        rows = conn.execute(SQL_READ_PAGES_OF_BOOK, (book_id,)).fetchall()
+        return sorted([(row[0], decryptDataToText(row[1], user_key)) for row in rows],
+                      key=lambda elem: elem[1])
+    finally:
+        conn.close()
+
+
+def fillDatabase(session: StorageSession, user_key, books: int, pages: int, page_size: int) -> list:
+    """create a vault and return the page ids"""
+    session.createDatabase(user_key, "benchmark")
+    text = ("lorem ipsum dolor sit amet\n" * (page_size // 27 + 1))[:page_size]
+    page_ids = []
+    for b in range(books):
+        book_id = session.createBook(user_key, f"Book {b}", text)
+        for p in range(pages):
+            page_ids.append((book_id, session.createPage(user_key, book_id, f"Page {p}", text)))
+    return page_ids
+
+
+def report(label: str, samples: list) -> None:
+    samples = sorted(samples)
+    p95 = samples[int(len(samples) * 0.95) - 1]
+    print(f"{label:<28} median {statistics.median(samples) * 1000:8.3f} ms"
+          f"   p95 {p95 * 1000:8.3f} ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--books", type=int, default=10)
+    parser.add_argument("--pages", type=int, default=50)
+    parser.add_argument("--page-size", type=int, default=4096)
+    parser.add_argument("--clicks", type=int, default=500)
+    args = parser.parse_args()
+
+    user_key = generateUserKey("benchmark")
+    with tempfile.TemporaryDirectory() as tmp:
+        dbfile = os.path.join(tmp, "bench.data")
+        session = StorageSession(dbfile)
+        page_ids = fillDatabase(session, user_key, args.books, args.pages, args.page_size)
+        clicks = [page_ids[(i * 7919) % len(page_ids)] for i in range(args.clicks)]
+
+        legacy, pooled = [], []
+        for book_id, page_id in clicks:
+            start = time.perf_counter()
+            legacyGetPagesOfBook(dbfile, user_key, book_id)
+            legacyGetPageText(dbfile, user_key, page_id)
+            legacy.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            session.getPagesOfBook(user_key, book_id)
+            session.getPageText(user_key, page_id)
+            pooled.append(time.perf_counter() - start)
+        session.close()
+
+    print(f"{args.books} books x {args.pages} pages, {args.page_size} bytes per page, "
+          f"{args.clicks} clicks")
+    report("connection per call", legacy)
+    report("StorageSession", pooled)
+
+
+if __name__ == "__main__":
+    main()
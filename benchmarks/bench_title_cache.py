@@ -0,0 +1,50 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas_v4
+
+Benchmark: switching books with and without the decrypted title cache """
+import argparse
+import os
+import tempfile
+import time
+
+from crypto import generateUserKey
+from storage import StorageSession
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--books", type=int, default=5)
+    parser.add_argument("--pages", type=int, default=2000)
+    parser.add_argument("--switches", type=int, default=50)
+    args = parser.parse_args()
+
+    user_key = generateUserKey("benchmark")
+    with tempfile.TemporaryDirectory() as tmp:
+        session = StorageSession(os.path.join(tmp, "bench.data"))
+        session.createDatabase(user_key, "benchmark")
+        book_ids = []
+        for b in range(args.books):
+            book_id = session.createBook(user_key, f"Book {b}", "")
+            book_ids.append(book_id)
+            for p in range(args.pages):
+                session.createPage(user_key, book_id, f"Page {p:06d}", "")
+
+        for label, cached in (("no title cache", False), ("title cache", True)):
+            session.titleCache.clear()
+            start = time.perf_counter()
+            for i in range(args.switches):
+                if not cached:
+                    session.titleCache.clear()
+                session.getBooks(user_key)
+                session.getPagesOfBook(user_key, book_ids[i % len(book_ids)])
+            elapsed = time.perf_counter() - start
+            print(f"{label:<16} {elapsed / args.switches * 1000:9.3f} ms per book switch"
+                  f"   decryptions {session.titleCache.misses}")
+            session.titleCache.hits = session.titleCache.misses = 0
+        session.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas_v4
+
+Benchmark: unlock latency (key derivation plus password check) for legacy and calibrated settings """
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from crypto import generateUserKey, legacyKdfParams, calibrateKdf, availableKdfAlgorithms
+from storage import StorageSession
+
+
+def timeUnlock(dbfile: str, password: str, repeat: int) -> list:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        session = StorageSession(dbfile)
+        user_key = generateUserKey(password, session.getKdfParams())
+        assert session.verifyDatabasePassword(user_key, password)
+        samples.append(time.perf_counter() - start)
+        session.close()
+    return samples
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--target-seconds", type=float, default=0.5)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    password = "benchmark password"
+    settings = [("legacy", legacyKdfParams())]
+    for algorithm in availableKdfAlgorithms():
+        start = time.perf_counter()
+        params = calibrateKdf(args.target_seconds, algorithm)
+        print(f"calibrated {algorithm} in {time.perf_counter() - start:.2f} s")
+        settings.append((algorithm, params))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, params in settings:
+            dbfile = os.path.join(tmp, f"{label}.data")
+            session = StorageSession(dbfile)
+            session.createDatabase(generateUserKey(password, params), password,
+                                   None if label == "legacy" else params)
+            session.close()
+            samples = timeUnlock(dbfile, password, args.repeat)
+            cost = ", ".join(f"{k}={v}" for k, v in sorted(params.items())
+                             if k not in ("algorithm", "salt"))
+            print(f"{label:<14} unlock median {statistics.median(samples) * 1000:8.1f} ms"
+                  f"   max {max(samples) * 1000:8.1f} ms   ({cost})")
+
+
+if __name__ == "__main__":
+    main()
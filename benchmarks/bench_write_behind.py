@@ -0,0 +1,70 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas_v4
+
+Benchmark: one commit per save (rollback journal) versus the coalescing write-behind queue (WAL) """
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from crypto import generateUserKey
+from storage import StorageSession
+
+
+def simulateEditing(session: StorageSession, user_key, page_ids: list, saves: int,
+                    flush_every: int, queued: bool) -> tuple:
+    """save random pages, return (seconds, worst stall seconds)"""
+    rnd = random.Random(42)
+    text = "some edited markdown text\n" * 200
+    worst = 0.0
+    start = time.perf_counter()
+    for i in range(saves):
+        page_id = rnd.choice(page_ids)
+        t0 = time.perf_counter()
+        if queued:
+            session.queuePageText(user_key, page_id, text + str(i))
+            if (i + 1) % flush_every == 0:
+                session.flushPendingWrites()
+        else:
+            session.updatePageText(user_key, page_id, text + str(i))
+        worst = max(worst, time.perf_counter() - t0)
+    if queued:
+        session.flushPendingWrites(durable=True)
+    return time.perf_counter() - start, worst
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--saves", type=int, default=500)
+    parser.add_argument("--flush-every", type=int, default=50,
+                        help="saves between two flushes, stands for the flush timer")
+    args = parser.parse_args()
+
+    user_key = generateUserKey("benchmark")
+    with tempfile.TemporaryDirectory() as tmp:
+        results = {}
+        for label, journal, synchronous, queued in (
+                ("commit per save (DELETE)", "DELETE", "FULL", False),
+                ("write-behind queue (WAL)", "WAL", "NORMAL", True)):
+            session = StorageSession(os.path.join(tmp, f"{journal}.data"),
+                                     synchronous=synchronous, journal_mode=journal)
+            session.createDatabase(user_key, "benchmark")
+            book_id = session.createBook(user_key, "Book", "")
+            page_ids = [session.createPage(user_key, book_id, f"Page {p}", "")
+                        for p in range(args.pages)]
+            results[label] = simulateEditing(session, user_key, page_ids, args.saves,
+                                             args.flush_every, queued)
+            queue = session.writeQueue
+            commits = queue.flushes if queued else args.saves
+            session.close()
+            total, worst = results[label]
+            print(f"{label:<28} total {total:7.3f} s   worst save {worst * 1000:8.3f} ms"
+                  f"   commits {commits}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,432 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas_v4
+
+Benchmark suite: every public method of StorageSession and every public function
+of crypto.py timed on a generated vault (benchmarks/vault_generator.py), with
+the peak Python memory of each call. It does not need PySide2.
+
+    python -m benchmarks.suite --output before.json
+    python -m benchmarks.suite --output after.json --compare before.json
+
+Results are JSON: for each case the median, p95, min and mean time of its
+samples, the traced memory peak (tracemalloc, Python allocations only) of one
+extra call made before the timed ones, and the public functions it covers.
+--compare prints the ratio to a previous run and exits with status 1 when a
+median got slower than --threshold times the old one. Public functions without
+a case are listed under "uncovered".
+"""
+import argparse
+import inspect
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+
+import crypto
+from crypto import UserKey, generateUserKey, encryptTextToData, decryptDataToText
+from storage import StorageSession
+from benchmarks.bench_compression import markdownPage
+from benchmarks.vault_generator import generateVault
+
+RESULTS_FORMAT = 1
+NOISE_FLOOR_MS = 0.1  # medians below this never count as a regression
+TEXT_SIZES = (1024, 64 * 1024, 1024 * 1024)
+
+
+class Case:
+    """One measured operation. prepare() runs before every call and is not timed."""
+
+    def __init__(self, name: str, run: Callable[[], object], covers: List[str], repeat: int = 50,
+                 prepare: Optional[Callable[[], None]] = None):
+        self.name = name
+        self.run = run
+        self.covers = covers
+        self.repeat = repeat
+        self.prepare = prepare
+
+
+class Context:
+    """the vault and the state cases share, pages made by one case are deleted by another"""
+
+    def __init__(self, tmp: str, session: StorageSession, user_key: UserKey, summary):
+        self.tmp = tmp
+        self.session = session
+        self.user_key = user_key
+        self.summary = summary
+        self.rnd = random.Random(3)
+        self.book_ids = session.getBookIds()
+        self.page_ids = [page_id for book_id in self.book_ids for page_id in session.getPageIdsOfBook(book_id)]
+        self.created_books: List[int] = []
+        self.created_pages: List[int] = []
+        self.attachment_ids: List[int] = []
+        self.files = 0
+
+    def book(self) -> int:
+        return self.rnd.choice(self.book_ids)
+
+    def page(self) -> int:
+        return self.rnd.choice(self.page_ids)
+
+    def text(self, size: int) -> str:
+        return markdownPage(self.rnd, size)[:size]
+
+    def path(self, name: str) -> str:
+        self.files += 1
+        return os.path.join(self.tmp, f"{self.files}-{name}")
+
+    def clearCaches(self) -> None:
+        self.session.titleCache.clear()
+        self.session.textCache.clear()
+
+    # cases that delete or read what another case made also run alone (--only)
+    def ensureBook(self) -> None:
+        if not self.created_books:
+            self.created_books.append(self.session.createBook(self.user_key, "benchmark", ""))
+
+    def ensurePage(self) -> None:
+        self.ensureBook()
+        if not self.created_pages:
+            self.created_pages.append(self.session.createPage(self.user_key, self.created_books[-1],
+                                                              "benchmark page", ""))
+
+    def ensureAttachment(self, file_path: str) -> None:
+        if not self.attachment_ids:
+            self.attachment_ids.append(self.session.addAttachment(self.user_key, self.page_ids[0], file_path))
+
+
+# ***************** cases
+def storageCases(ctx: Context, repeat: int) -> List[Case]:
+    session, key = ctx.session, ctx.user_key
+    summary = ctx.summary
+    page_text = ctx.text(4096)
+    attachment_file = os.path.join(ctx.tmp, "attachment.bin")
+    with open(attachment_file, "wb") as output:
+        output.write(os.urandom(1024 * 1024))
+    edited = ctx.page_ids[:repeat + 1]
+
+    def openSession() -> None:
+        StorageSession(summary.dbfile).close()
+
+    def createDatabase() -> None:
+        other = StorageSession(ctx.path("new.data"))
+        other.createDatabase(key, summary.password, summary.kdf_params)
+        other.close()
+
+    def createPage() -> None:
+        ctx.created_pages.append(session.createPage(key, ctx.created_books[-1], "benchmark page", page_text))
+
+    def editPage() -> None:
+        page_id = edited[ctx.rnd.randrange(len(edited))]
+        session.updatePageText(key, page_id, ctx.text(4096))
+
+    def queueAndFlush() -> None:
+        session.queuePageText(key, ctx.page(), ctx.text(4096))
+        session.queueBookText(key, ctx.book(), ctx.text(1024))
+        session.flushPendingWrites()
+
+    def readAttachment() -> None:
+        info = session.getAttachment(key, ctx.attachment_ids[0])
+        start = ctx.rnd.randrange(info.size - 65536)
+        session.readAttachment(key, info, start, start + 65536)
+
+    def reencrypt() -> None:
+        # on a copy, the suite keeps using the vault under its own key
+        copy = ctx.path("rekey.data")
+        shutil.copyfile(summary.dbfile, copy)
+        other = StorageSession(copy)
+        new_key = generateUserKey("changed", summary.kdf_params)
+        if not other.reencryptVault(key, new_key, "changed", summary.kdf_params, 0):
+            raise RuntimeError("re-key failed")
+        other.close()
+
+    def withAttachment() -> None:
+        ctx.ensureAttachment(attachment_file)
+
+    cold = ctx.clearCaches
+    return [
+        Case("storage.open", openSession, ["StorageSession.__init__", "StorageSession.applyPragmas",
+                                            "StorageSession.close"], repeat),
+        Case("storage.createDatabase", createDatabase, ["StorageSession.createDatabase"], max(3, repeat // 10)),
+        Case("storage.verifyDatabasePassword", lambda: session.verifyDatabasePassword(key, summary.password),
+             ["StorageSession.verifyDatabasePassword"], repeat),
+        Case("storage.getKdfParams", session.getKdfParams, ["StorageSession.getKdfParams"], repeat),
+        Case("storage.getBookIds", session.getBookIds, ["StorageSession.getBookIds"], repeat),
+        Case("storage.getBooks.cold", lambda: session.getBooks(key), ["StorageSession.getBooks"], repeat, cold),
+        Case("storage.getBooks.warm", lambda: session.getBooks(key), ["StorageSession.getBooks"], repeat),
+        Case("storage.getBookName", lambda: session.getBookName(key, ctx.book()),
+             ["StorageSession.getBookName"], repeat, cold),
+        Case("storage.getBookText", lambda: session.getBookText(key, ctx.book()),
+             ["StorageSession.getBookText"], repeat, cold),
+        Case("storage.getPageIdsOfBook", lambda: session.getPageIdsOfBook(ctx.book()),
+             ["StorageSession.getPageIdsOfBook"], repeat),
+        Case("storage.getPagesOfBook.cold", lambda: session.getPagesOfBook(key, ctx.book()),
+             ["StorageSession.getPagesOfBook"], repeat, cold),
+        Case("storage.getTitles.cold", lambda: session.getTitles(key, "page", ctx.rnd.sample(ctx.page_ids, 50)),
+             ["StorageSession.getTitles"], repeat, cold),
+        Case("storage.getPageText.cold", lambda: session.getPageText(key, ctx.page()),
+             ["StorageSession.getPageText"], repeat, cold),
+        Case("storage.getPageText.warm", lambda: session.getPageText(key, ctx.page_ids[0]),
+             ["StorageSession.getPageText"], repeat),
+        Case("storage.prefetchPages", lambda: session.prefetchPages(key, ctx.rnd.sample(ctx.page_ids, 10)),
+             ["StorageSession.prefetchPages", "StorageSession.prefetchPage"], repeat, cold),
+        Case("storage.findPages", lambda: session.findPages(key, "budget meeting"),
+             ["StorageSession.findPages"], repeat),
+        Case("storage.findPages.prefix", lambda: session.findPages(key, "meet bud", prefix=True),
+             ["StorageSession.findPages"], repeat),
+        Case("storage.createBook", lambda: ctx.created_books.append(session.createBook(key, "benchmark", "")),
+             ["StorageSession.createBook"], repeat),
+        Case("storage.createPage", createPage, ["StorageSession.createPage"], repeat, ctx.ensureBook),
+        Case("storage.updatePageText", editPage, ["StorageSession.updatePageText"], repeat),
+        Case("storage.updatePageName", lambda: session.updatePageName(key, ctx.page(), "renamed page"),
+             ["StorageSession.updatePageName"], repeat),
+        Case("storage.updateBookText", lambda: session.updateBookText(key, ctx.book(), ctx.text(1024)),
+             ["StorageSession.updateBookText"], repeat),
+        Case("storage.updateBookName", lambda: session.updateBookName(key, ctx.book(), "renamed book"),
+             ["StorageSession.updateBookName"], repeat),
+        Case("storage.queueAndFlush", queueAndFlush, ["StorageSession.queuePageText",
+                                                      "StorageSession.queueBookText",
+                                                      "StorageSession.flushPendingWrites"], repeat),
+        Case("storage.getPageHistory", lambda: session.getPageHistory(edited[0]),
+             ["StorageSession.getPageHistory"], repeat),
+        Case("storage.getPageRevision", lambda: session.getPageRevision(key, edited[0], 1),
+             ["StorageSession.getPageRevision"], repeat),
+        Case("storage.thinHistory", lambda: session.thinHistory(key), ["StorageSession.thinHistory"],
+             max(3, repeat // 10)),
+        Case("storage.deletePage", lambda: session.deletePage(key, ctx.created_pages.pop()),
+             ["StorageSession.deletePage"], repeat, ctx.ensurePage),
+        Case("storage.addAttachment.1MB",
+             lambda: ctx.attachment_ids.append(session.addAttachment(key, ctx.page_ids[0], attachment_file)),
+             ["StorageSession.addAttachment"], max(3, repeat // 5)),
+        Case("storage.getAttachment", lambda: session.getAttachment(key, ctx.attachment_ids[0]),
+             ["StorageSession.getAttachment"], repeat, withAttachment),
+        Case("storage.getAttachmentsOfPage", lambda: session.getAttachmentsOfPage(key, ctx.page_ids[0]),
+             ["StorageSession.getAttachmentsOfPage"], repeat),
+        Case("storage.readAttachment.64KB", readAttachment, ["StorageSession.readAttachment"], repeat,
+             withAttachment),
+        Case("storage.exportAttachment.1MB",
+             lambda: session.exportAttachment(key, ctx.attachment_ids[0], ctx.path("saved.bin")),
+             ["StorageSession.exportAttachment"], max(3, repeat // 5), withAttachment),
+        Case("storage.deleteAttachment", lambda: session.deleteAttachment(ctx.attachment_ids.pop()),
+             ["StorageSession.deleteAttachment"], max(3, repeat // 5), withAttachment),
+        Case("storage.deleteBook", lambda: session.deleteBook(key, ctx.created_books.pop()),
+             ["StorageSession.deleteBook"], repeat, ctx.ensureBook),
+        Case("storage.indexMissingPages", lambda: session.indexMissingPages(key),
+             ["StorageSession.indexMissingPages"], repeat),
+        Case("storage.getFormatStatistics", session.getFormatStatistics,
+             ["StorageSession.getFormatStatistics"], max(3, repeat // 10)),
+        Case("storage.getTextCacheStatistics", session.getTextCacheStatistics,
+             ["StorageSession.getTextCacheStatistics"], repeat),
+        Case("storage.rebuildSearchIndex", lambda: session.rebuildSearchIndex(key),
+             ["StorageSession.rebuildSearchIndex"], 3),
+        Case("storage.vacuum", session.vacuum, ["StorageSession.vacuum"], 3),
+        Case("storage.reencryptVault", reencrypt, ["StorageSession.reencryptVault"], 3),
+    ]
+
+
+def cryptoCases(ctx: Context, repeat: int) -> List[Case]:
+    key = ctx.user_key
+    kdf_params = crypto.newKdfParams()
+    cases = [
+        # what opening the application costs with the settings a new vault gets
+        Case("crypto.unlock", lambda: generateUserKey("benchmark", kdf_params),
+             ["generateUserKey", "deriveKeyBytes", "newKdfParams"], 3),
+        Case("crypto.timeKdf", lambda: crypto.timeKdf(kdf_params), ["timeKdf"], 3),
+        Case("crypto.calibrateKdf", lambda: crypto.calibrateKdf(0.1), ["calibrateKdf"], 1),
+        Case("crypto.kdfParams", lambda: (crypto.renewKdfParams(kdf_params), crypto.isLegacyKdf(kdf_params),
+                                          crypto.legacyKdfParams(), crypto.availableKdfAlgorithms()),
+             ["renewKdfParams", "isLegacyKdf", "legacyKdfParams", "availableKdfAlgorithms"], repeat),
+    ]
+    for size in TEXT_SIZES:
+        text = ctx.text(size)
+        label = f"{size // 1024}KB"
+        for compress in (False, True):
+            data = encryptTextToData(text, key, compress)
+            kind = "compressed" if compress else "plain"
+            cases.append(Case(f"crypto.encryptTextToData.{kind}.{label}",
+                              lambda text=text, compress=compress: encryptTextToData(text, key, compress),
+                              ["encryptTextToData", "chooseCompression", "compressData", "UserKey.encrypt"],
+                              repeat))
+            cases.append(Case(f"crypto.decryptDataToText.{kind}.{label}",
+                              lambda data=data: decryptDataToText(data, key),
+                              ["decryptDataToText", "decompressData", "detectFormat", "UserKey.decrypt"], repeat))
+    data = os.urandom(64 * 1024)
+    for engine in sorted(crypto.CIPHER_ENGINES):
+        try:
+            engine_key = key.withEngine(engine)
+            encrypted = engine_key.encrypt(data)
+        except Exception as error:
+            print(f"cipher engine {engine} skipped: {error}", file=sys.stderr)
+            continue
+        cases.append(Case(f"crypto.encrypt.{engine}.64KB", lambda engine_key=engine_key: engine_key.encrypt(data),
+                          ["UserKey.encrypt", "UserKey.withEngine"], repeat))
+        cases.append(Case(f"crypto.decrypt.{engine}.64KB", lambda encrypted=encrypted: key.decrypt(encrypted),
+                          ["UserKey.decrypt", "UserKey.reader"], repeat))
+    cases.append(Case("crypto.subkey", lambda: key.subkey("benchmark"), ["UserKey.subkey"], repeat))
+    cases.append(Case("crypto.formatName", lambda: crypto.formatName(crypto.detectFormat(data)[0]),
+                      ["formatName", "detectFormat"], repeat))
+    return cases
+
+
+def publicApi() -> List[str]:
+    """names the suite should cover"""
+    names = [f"StorageSession.{name}" for name, _ in inspect.getmembers(StorageSession, inspect.isfunction)
+             if not name.startswith("_")]
+    names.append("StorageSession.__init__")
+    names += [name for name, function in inspect.getmembers(crypto, inspect.isfunction)
+              if function.__module__ == "crypto" and not name.startswith("_")]
+    names += [f"UserKey.{name}" for name, _ in inspect.getmembers(UserKey, inspect.isfunction)
+              if not name.startswith("_")]
+    return sorted(names)
+
+
+# ***************** running
+def measureCase(case: Case) -> dict:
+    # the first call warms caches up and gives the memory peak, it is not timed
+    if case.prepare is not None:
+        case.prepare()
+    tracemalloc.start()
+    case.run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    samples = []
+    for _ in range(case.repeat):
+        if case.prepare is not None:
+            case.prepare()
+        start = time.perf_counter()
+        case.run()
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return {
+        "samples": len(samples),
+        "medianMs": statistics.median(samples) * 1000,
+        "p95Ms": samples[max(0, int(len(samples) * 0.95) - 1)] * 1000,
+        "minMs": samples[0] * 1000,
+        "meanMs": statistics.fmean(samples) * 1000,
+        "peakKb": peak / 1024,
+        "covers": case.covers,
+    }
+
+
+def maxRssKb() -> Optional[int]:
+    try:
+        import resource
+    except ImportError:  # not on Windows
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+
+def gitCommit() -> Optional[str]:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True,
+                               text=True, check=True).stdout.strip()
+        return commit + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def runSuite(books: int, pages_per_book: int, page_size: str, repeat: int, only: Optional[str] = None,
+             seed: int = 1) -> dict:
+    results: Dict[str, dict] = {}
+    covered = set()
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        summary = generateVault(os.path.join(tmp, "suite.data"), books, pages_per_book, page_size, seed)
+        generation = time.perf_counter() - start
+        user_key = generateUserKey(summary.password, summary.kdf_params)
+        session = StorageSession(summary.dbfile)
+        try:
+            ctx = Context(tmp, session, user_key, summary)
+            for case in storageCases(ctx, repeat) + cryptoCases(ctx, repeat):
+                covered.update(case.covers)
+                if only is not None and only not in case.name:
+                    continue
+                results[case.name] = measureCase(case)
+                print(f"{case.name:<44} {results[case.name]['medianMs']:>10.3f} ms"
+                      f" {results[case.name]['peakKb']:>10.0f} KB", file=sys.stderr)
+            vault = summary.describe()
+        finally:
+            session.close()
+    return {
+        "format": RESULTS_FORMAT,
+        "meta": {
+            "commit": gitCommit(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "repeat": repeat,
+            "pageSize": page_size,
+            "seed": seed,
+            "generationSeconds": generation,
+            "maxRssKb": maxRssKb(),
+        },
+        "vault": vault,
+        "results": results,
+        "uncovered": [name for name in publicApi() if name not in covered],
+    }
+
+
+def compareResults(old: dict, new: dict, threshold: float) -> List[str]:
+    """print both medians of every case, return the names of the slower ones"""
+    regressions = []
+    print(f"{'case':<44} {'before':>10} {'after':>10} {'ratio':>7}")
+    for name, result in new["results"].items():
+        before = old["results"].get(name)
+        if before is None:
+            print(f"{name:<44} {'':>10} {result['medianMs']:>9.3f}ms    new")
+            continue
+        ratio = result["medianMs"] / before["medianMs"] if before["medianMs"] > 0 else 1.0
+        slower = ratio > threshold and result["medianMs"] > NOISE_FLOOR_MS
+        if slower:
+            regressions.append(name)
+        print(f"{name:<44} {before['medianMs']:>9.3f}ms {result['medianMs']:>9.3f}ms {ratio:>6.2f}x"
+              f"{'  SLOWER' if slower else ''}")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--books", type=int, default=10)
+    parser.add_argument("--pages-per-book", type=int, default=100)
+    parser.add_argument("--page-size", default="lognormal:2048:1.0", help="page size distribution")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=50, help="timed calls per case")
+    parser.add_argument("--only", help="run the cases whose name contains this text")
+    parser.add_argument("--output", help="write the results to this JSON file (default: standard output)")
+    parser.add_argument("--compare", metavar="BASELINE", help="results of an earlier run to compare with")
+    parser.add_argument("--threshold", type=float, default=1.25, help="slower ratio reported as a regression")
+    args = parser.parse_args()
+
+    results = runSuite(args.books, args.pages_per_book, args.page_size, args.repeat, args.only, args.seed)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump(results, output, indent=1)
+    elif not args.compare:
+        json.dump(results, sys.stdout, indent=1)
+    if results["uncovered"]:
+        print(f"not covered: {', '.join(results['uncovered'])}", file=sys.stderr)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as source:
+            baseline = json.load(source)
+        regressions = compareResults(baseline, results, args.threshold)
+        if regressions:
+            sys.exit(f"{len(regressions)} cases slower than {args.threshold}x: {', '.join(regressions)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas_v4
+
+Synthetic vaults for the benchmarks: a number of books, a number of pages per
+book and page sizes drawn from a distribution, written through the markdown
+import (the same rows, chunked pages and search index the application writes).
+Generation is seeded, the same arguments give the same vault.
+
+    python -m benchmarks.vault_generator bench.data --books 20 --pages-per-book 200 \\
+        --page-size lognormal:2048:1.2
+
+Page size distributions (sizes in characters):
+    fixed:N                    every page has N characters
+    uniform:MIN:MAX            evenly spread between MIN and MAX
+    lognormal:MEDIAN:SIGMA     most pages near MEDIAN, a long tail of big ones
+"""
+import argparse
+import math
+import os
+import random
+import tempfile
+from typing import Callable, List, Optional
+
+import markdown_import
+from crypto import UserKey, generateUserKey, newKdfParams, KDF_PBKDF2
+from storage import StorageSession
+from benchmarks.bench_compression import markdownPage
+
+DEFAULT_PASSWORD = "benchmark"
+MAX_PAGE_SIZE = 4 * 1024 * 1024  # lognormal tails are cut here
+CORPUS_SIZE = 1024 * 1024  # page texts are slices of one generated text
+
+
+def benchmarkKdfParams() -> dict:
+    """cheap key derivation, benchmarks are about the data (unlock is measured apart)"""
+    return newKdfParams(KDF_PBKDF2, iterations=1000)
+
+
+def pageSizeSampler(spec: str) -> Callable[[random.Random], int]:
+    """function drawing a page size from a distribution spec (see the module doc)"""
+    kind, _, params = spec.partition(":")
+    values = [float(value) for value in params.split(":")] if params else []
+    if kind == "fixed" and len(values) == 1:
+        return lambda rnd: int(values[0])
+    if kind == "uniform" and len(values) == 2:
+        return lambda rnd: rnd.randint(int(values[0]), int(values[1]))
+    if kind == "lognormal" and len(values) == 2:
+        mu = math.log(values[0])
+        return lambda rnd: min(MAX_PAGE_SIZE, max(1, int(rnd.lognormvariate(mu, values[1]))))
+    raise ValueError(f"unknown page size distribution {spec!r}")
+
+
+def pageText(rnd: random.Random, corpus: str, size: int) -> str:
+    """size characters of notes, a slice of the corpus (repeated for big pages)"""
+    if size > len(corpus):
+        corpus = corpus * (size // len(corpus) + 1)
+    start = rnd.randrange(len(corpus) - size + 1)
+    return corpus[start:start + size]
+
+
+class VaultSummary:
+    """what generateVault wrote"""
+
+    def __init__(self, dbfile: str, password: str, kdf_params: dict):
+        self.dbfile = dbfile
+        self.password = password
+        self.kdf_params = kdf_params
+        self.books = 0
+        self.pages = 0
+        self.page_sizes: List[int] = []
+
+    @property
+    def text_bytes(self) -> int:
+        return sum(self.page_sizes)
+
+    def describe(self) -> dict:
+        sizes = sorted(self.page_sizes) or [0]
+        return {"books": self.books, "pages": self.pages, "textBytes": self.text_bytes,
+                "pageSizeMedian": sizes[len(sizes) // 2], "pageSizeMax": sizes[-1],
+                "fileBytes": os.path.getsize(self.dbfile)}
+
+
+def generateVault(dbfile: str, books: int, pages_per_book: int, page_size: str = "lognormal:2048:1.0",
+                  seed: int = 1, user_key: Optional[UserKey] = None, password: str = DEFAULT_PASSWORD,
+                  kdf_params: Optional[dict] = None, workers: Optional[int] = None) -> VaultSummary:
+    """Create dbfile (it must not exist) with books x pages_per_book pages of
+    random sizes, return a summary of the vault"""
+    if os.path.exists(dbfile):
+        raise FileExistsError(f"{dbfile} already exists")
+    kdf_params = kdf_params or benchmarkKdfParams()
+    user_key = user_key or generateUserKey(password, kdf_params)
+    rnd = random.Random(seed)
+    corpus = markdownPage(rnd, CORPUS_SIZE)
+    sampleSize = pageSizeSampler(page_size)
+    summary = VaultSummary(dbfile, password, kdf_params)
+    with tempfile.TemporaryDirectory() as tree:
+        width = len(str(max(books, pages_per_book)))
+        for book in range(books):
+            folder = os.path.join(tree, f"Book {book:0{width}d}")
+            os.makedirs(folder)
+            with open(os.path.join(folder, markdown_import.MARKDOWN_BOOK_FILE), "w", encoding="utf-8") as output:
+                output.write(pageText(rnd, corpus, sampleSize(rnd)))
+            for page in range(pages_per_book):
+                size = sampleSize(rnd)
+                summary.page_sizes.append(size)
+                with open(os.path.join(folder, f"Page {page:0{width}d}.md"), "w", encoding="utf-8") as output:
+                    output.write(pageText(rnd, corpus, size))
+        session = StorageSession(dbfile)
+        try:
+            if not session.createDatabase(user_key, password, kdf_params):
+                raise RuntimeError(f"{dbfile} could not be created")
+            counts = markdown_import.importMarkdown(session, user_key, tree, workers)
+        finally:
+            session.close()
+    summary.books, summary.pages = counts["books"], counts["pages"]
+    return summary
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("database", help="vault file to create")
+    parser.add_argument("--books", type=int, default=20)
+    parser.add_argument("--pages-per-book", type=int, default=200)
+    parser.add_argument("--page-size", default="lognormal:2048:1.0", help="page size distribution")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--password", default=DEFAULT_PASSWORD)
+    parser.add_argument("--workers", type=int, help="worker processes, 0 works in this process")
+    args = parser.parse_args()
+    summary = generateVault(args.database, args.books, args.pages_per_book, args.page_size, args.seed,
+                            password=args.password, workers=args.workers)
+    for name, value in summary.describe().items():
+        print(f"{name:<16} {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,36 +5,367 @@ https://github.com/maitelab/maitenotas_v4
 
 Functions related to encrypt / decrypt data """
 import base64
+import lzma
+import os
+import time
+import zlib
+from typing import Optional
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
 from cryptography.fernet import Fernet
+import instrumentation
+try:
+    from cryptography.hazmat.primitives.kdf.argon2 import Argon2id
+except ImportError:  # cryptography older than 44
+    Argon2id = None
 
+# ***************** key derivation
+# Databases created before the KDF settings were stored use PBKDF2 with
+# 100000 iterations and the password itself as salt.
+KDF_PBKDF2 = "pbkdf2-sha256"
+KDF_SCRYPT = "scrypt"
+KDF_ARGON2ID = "argon2id"
+LEGACY_KDF_ITERATIONS = 100000
+KDF_SALT_SIZE = 16
+KDF_TARGET_SECONDS = 0.5  # unlock time aimed at by calibrateKdf
+SCRYPT_MAX_N = 2 ** 20
+ARGON2_MEMORY_COST = 64 * 1024  # KiB
+ARGON2_LANES = 4
 
-def generateUserKey(userPassword: str) -> Fernet:
-    """Create a key for encryption/decryption purposes"""
-    password_provided_bytes = bytes(userPassword, 'utf-8')
+
+def availableKdfAlgorithms() -> list:
+    """key derivation functions usable with the installed cryptography library"""
+    algorithms = [KDF_PBKDF2, KDF_SCRYPT]
+    if Argon2id is not None:
+        algorithms.append(KDF_ARGON2ID)
+    return algorithms
+
+
+def legacyKdfParams() -> dict:
+    """settings of databases that do not store their own"""
+    return {"algorithm": KDF_PBKDF2, "salt": None, "iterations": LEGACY_KDF_ITERATIONS}
+
+
+def isLegacyKdf(kdf_params: dict) -> bool:
+    return kdf_params.get("salt") is None
+
+
+def newKdfParams(algorithm: Optional[str] = None, **cost) -> dict:
+    """settings for a new database: random salt and the given (or default) cost"""
+    if algorithm is None:
+        algorithm = KDF_ARGON2ID if Argon2id is not None else KDF_SCRYPT
+    params = {"algorithm": algorithm, "salt": os.urandom(KDF_SALT_SIZE)}
+    if algorithm == KDF_PBKDF2:
+        params["iterations"] = cost.get("iterations", 600000)
+    elif algorithm == KDF_SCRYPT:
+        params.update(n=cost.get("n", 2 ** 15), r=cost.get("r", 8), p=cost.get("p", 1))
+    elif algorithm == KDF_ARGON2ID:
+        if Argon2id is None:
+            raise ValueError("argon2id needs cryptography 44 or newer")
+        params.update(iterations=cost.get("iterations", 3),
+                      lanes=cost.get("lanes", ARGON2_LANES),
+                      memory_cost=cost.get("memory_cost", ARGON2_MEMORY_COST))
+    else:
+        raise ValueError(f"unknown key derivation function: {algorithm}")
+    return params
+
+
+def renewKdfParams(kdf_params: dict) -> dict:
+    """settings for a new password: same algorithm and cost with a new random salt
+    (legacy settings get the defaults of newKdfParams)"""
+    if isLegacyKdf(kdf_params):
+        return newKdfParams()
+    cost = {k: v for k, v in kdf_params.items() if k not in ("algorithm", "salt")}
+    return newKdfParams(kdf_params["algorithm"], **cost)
+
+
+@instrumentation.timed("crypto.deriveKey", "crypto")
+def deriveKeyBytes(userPassword: str, kdf_params: dict) -> bytes:
+    """Run the key derivation function, return 32 bytes"""
     password = userPassword.encode()  # Convert to type bytes
-    kdf = PBKDF2HMAC(
-        algorithm=hashes.SHA256(),
-        length=32,
-        salt=password_provided_bytes,
-        iterations=100000,
-        backend=default_backend()
-    )
-    key = base64.urlsafe_b64encode(kdf.derive(password))  # Can only use kdf once
-    fernet_key = Fernet(key)
-    return fernet_key
-
-
-def encryptTextToData(input_text: str, user_key: Fernet) -> bytes:
-    """Encrypt text"""
+    salt = kdf_params.get("salt")
+    if salt is None:
+        salt = password
+    algorithm = kdf_params["algorithm"]
+    if algorithm == KDF_PBKDF2:
+        kdf = PBKDF2HMAC(
+            algorithm=hashes.SHA256(),
+            length=32,
+            salt=salt,
+            iterations=kdf_params["iterations"],
+            backend=default_backend()
+        )
+    elif algorithm == KDF_SCRYPT:
+        kdf = Scrypt(salt=salt, length=32, n=kdf_params["n"], r=kdf_params["r"],
+                     p=kdf_params["p"], backend=default_backend())
+    elif algorithm == KDF_ARGON2ID and Argon2id is not None:
+        kdf = Argon2id(salt=salt, length=32, iterations=kdf_params["iterations"],
+                       lanes=kdf_params["lanes"], memory_cost=kdf_params["memory_cost"])
+    else:
+        raise ValueError(f"unsupported key derivation function: {algorithm}")
+    return kdf.derive(password)  # Can only use kdf once
+
+
+def generateUserKey(userPassword: str, kdf_params: Optional[dict] = None,
+                    engine: Optional[str] = None) -> "UserKey":
+    """Create a key for encryption/decryption purposes"""
+    if kdf_params is None:
+        kdf_params = legacyKdfParams()
+    return UserKey(deriveKeyBytes(userPassword, kdf_params), engine)
+
+
+def timeKdf(kdf_params: dict) -> float:
+    """seconds needed to derive a key with these settings"""
+    start = time.perf_counter()
+    deriveKeyBytes("calibration password", kdf_params)
+    return time.perf_counter() - start
+
+
+def calibrateKdf(target_seconds: float = KDF_TARGET_SECONDS, algorithm: Optional[str] = None) -> dict:
+    """Settings with a fresh salt whose cost takes about target_seconds on this machine"""
+    params = newKdfParams(algorithm)
+    algorithm = params["algorithm"]
+    if algorithm == KDF_SCRYPT:
+        # memory and time grow with n, which must be a power of two
+        params["n"] = 2 ** 14
+        while params["n"] < SCRYPT_MAX_N and timeKdf(params) * 2 <= target_seconds:
+            params["n"] *= 2
+        return params
+    # PBKDF2 and Argon2 time grows linearly with iterations
+    params["iterations"] = 100000 if algorithm == KDF_PBKDF2 else 1
+    elapsed = timeKdf(params)
+    scaled = int(params["iterations"] * target_seconds / max(elapsed, 1e-6))
+    params["iterations"] = max(scaled, 100000 if algorithm == KDF_PBKDF2 else 1)
+    return params
+
+
+# ***************** cipher engines
+# Every encrypted value starts with a byte telling its format. Fernet tokens are
+# base64 text and always start with "g" (version byte 0x80), the raw AEAD formats
+# use small numbers that can never be the first byte of a Fernet token:
+#   format byte | 12 byte nonce | ciphertext and 16 byte tag
+# The low 4 bits of an AEAD format byte name the engine, the high 4 bits the
+# compression applied before encryption (the byte is authenticated as well).
+FORMAT_FERNET = 0x67  # ord("g")
+FORMAT_AESGCM = 0x01
+FORMAT_CHACHA20 = 0x02
+
+COMPRESSION_NONE = 0
+COMPRESSION_ZLIB = 1
+COMPRESSION_LZMA = 2
+COMPRESSION_NAMES = {COMPRESSION_NONE: "", COMPRESSION_ZLIB: "zlib", COMPRESSION_LZMA: "lzma"}
+COMPRESS_MIN_SIZE = 512  # smaller values are not worth compressing
+LZMA_MIN_SIZE = 1024 * 1024  # from this size the better ratio of lzma pays for its speed
+ZLIB_LEVEL = 6
+LZMA_PRESET = 1
+
+ENGINE_FERNET = "fernet"
+ENGINE_AESGCM = "aes-gcm"
+ENGINE_CHACHA20 = "chacha20-poly1305"
+DEFAULT_CIPHER_ENGINE = ENGINE_AESGCM
+AEAD_NONCE_SIZE = 12
+
+
+class CipherEngine:
+    """Encrypts and decrypts bytes in one storage format"""
+    name = ""
+    format_id = 0
+
+    def encrypt(self, data: bytes, compression: int = COMPRESSION_NONE, associated_data: bytes = b"") -> bytes:
+        """associated_data is not stored, decrypting needs the same bytes"""
+        raise NotImplementedError
+
+    def decrypt(self, data: bytes, associated_data: bytes = b"") -> bytes:
+        raise NotImplementedError
+
+
+class FernetEngine(CipherEngine):
+    """The format of every row written before the AEAD engines existed"""
+    name = ENGINE_FERNET
+    format_id = FORMAT_FERNET
+
+    def __init__(self, key_bytes: bytes):
+        self.fernet = Fernet(base64.urlsafe_b64encode(key_bytes))
+
+    def encrypt(self, data: bytes, compression: int = COMPRESSION_NONE, associated_data: bytes = b"") -> bytes:
+        if compression != COMPRESSION_NONE:
+            raise ValueError("the Fernet format has no room for a compression flag")
+        # Fernet authenticates no extra data, it is encrypted in front of the data
+        return self.fernet.encrypt(associated_data + data)
+
+    def decrypt(self, data: bytes, associated_data: bytes = b"") -> bytes:
+        data = self.fernet.decrypt(data)
+        if not data.startswith(associated_data):
+            raise ValueError("encrypted data does not belong here")
+        return data[len(associated_data):]
+
+
+class AeadEngine(CipherEngine):
+    """Raw bytes AEAD format, no base64, no padding and no separate HMAC pass"""
+    aead_class = None
+
+    def __init__(self, key_bytes: bytes):
+        # never use the same key bytes for two algorithms
+        hkdf = HKDF(algorithm=hashes.SHA256(), length=32, salt=None,
+                    info=b"maitenotas " + self.name.encode(), backend=default_backend())
+        self.aead = self.aead_class(hkdf.derive(key_bytes))
+
+    def encrypt(self, data: bytes, compression: int = COMPRESSION_NONE, associated_data: bytes = b"") -> bytes:
+        header = bytes([self.format_id | compression << 4])
+        nonce = os.urandom(AEAD_NONCE_SIZE)
+        return header + nonce + self.aead.encrypt(nonce, data, header + associated_data)
+
+    def decrypt(self, data: bytes, associated_data: bytes = b"") -> bytes:
+        nonce = data[1:1 + AEAD_NONCE_SIZE]
+        return self.aead.decrypt(nonce, data[1 + AEAD_NONCE_SIZE:], data[:1] + associated_data)
+
+
+class AesGcmEngine(AeadEngine):
+    name = ENGINE_AESGCM
+    format_id = FORMAT_AESGCM
+    aead_class = AESGCM
+
+
+class ChaCha20Engine(AeadEngine):
+    name = ENGINE_CHACHA20
+    format_id = FORMAT_CHACHA20
+    aead_class = ChaCha20Poly1305
+
+
+CIPHER_ENGINES = {engine.name: engine for engine in (FernetEngine, AesGcmEngine, ChaCha20Engine)}
+
+
+def detectFormat(data: bytes) -> tuple:
+    """(engine format, compression) of an encrypted value"""
+    if len(data) == 0:
+        raise ValueError("empty encrypted data")
+    if data[0] == FORMAT_FERNET:
+        return FORMAT_FERNET, COMPRESSION_NONE
+    return data[0] & 0x0F, data[0] >> 4
+
+
+def formatName(format_byte: int) -> str:
+    """readable name of a format byte, for example aes-gcm+zlib"""
+    if format_byte == FORMAT_FERNET:
+        engine_id, compression = FORMAT_FERNET, COMPRESSION_NONE
+    else:
+        engine_id, compression = format_byte & 0x0F, format_byte >> 4
+    names = [engine.name for engine in CIPHER_ENGINES.values() if engine.format_id == engine_id]
+    name = names[0] if names else f"unknown {format_byte:#04x}"
+    if COMPRESSION_NAMES.get(compression):
+        name += "+" + COMPRESSION_NAMES[compression]
+    return name
+
+
+def chooseCompression(size: int) -> int:
+    """compression for a value of this many bytes"""
+    if size < COMPRESS_MIN_SIZE:
+        return COMPRESSION_NONE
+    if size < LZMA_MIN_SIZE:
+        return COMPRESSION_ZLIB
+    return COMPRESSION_LZMA
+
+
+def compressData(data: bytes, compression: int) -> bytes:
+    if compression == COMPRESSION_ZLIB:
+        return zlib.compress(data, ZLIB_LEVEL)
+    if compression == COMPRESSION_LZMA:
+        return lzma.compress(data, preset=LZMA_PRESET)
+    return data
+
+
+def decompressData(data: bytes, compression: int) -> bytes:
+    if compression == COMPRESSION_ZLIB:
+        return zlib.decompress(data)
+    if compression == COMPRESSION_LZMA:
+        return lzma.decompress(data)
+    if compression != COMPRESSION_NONE:
+        raise ValueError(f"unknown compression: {compression}")
+    return data
+
+
+class UserKey:
+    """Key of an unlocked vault.
+
+    New data is encrypted with one engine (AES-GCM unless told otherwise) and
+    data of any known format can be decrypted, so vaults holding rows written
+    by older versions keep working."""
+
+    def __init__(self, key_bytes: bytes, engine: Optional[str] = None):
+        if engine is None:
+            engine = DEFAULT_CIPHER_ENGINE
+        if engine not in CIPHER_ENGINES:
+            raise ValueError(f"unknown cipher engine: {engine}")
+        self.key_bytes = key_bytes
+        self.engine_name = engine
+        self.readers = {}
+        self.subkeys = {}
+        self.writer = self.reader(CIPHER_ENGINES[engine].format_id)
+
+    def __reduce__(self):
+        # lets worker processes rebuild the key
+        return (UserKey, (self.key_bytes, self.engine_name))
+
+    def withEngine(self, engine: str) -> "UserKey":
+        """same key, writing with another engine"""
+        return UserKey(self.key_bytes, engine)
+
+    def subkey(self, purpose: str) -> bytes:
+        """key for another use than encryption (keyed hashes), derived with HKDF"""
+        key = self.subkeys.get(purpose)
+        if key is None:
+            hkdf = HKDF(algorithm=hashes.SHA256(), length=32, salt=None,
+                        info=b"maitenotas " + purpose.encode(), backend=default_backend())
+            key = hkdf.derive(self.key_bytes)
+            self.subkeys[purpose] = key
+        return key
+
+    def reader(self, format_id: int) -> CipherEngine:
+        engine = self.readers.get(format_id)
+        if engine is None:
+            for engine_class in CIPHER_ENGINES.values():
+                if engine_class.format_id == format_id:
+                    engine = engine_class(self.key_bytes)
+                    break
+            else:
+                raise ValueError(f"unknown encrypted data format: {format_id:#04x}")
+            self.readers[format_id] = engine
+        return engine
+
+    @instrumentation.timed("crypto.encrypt", "crypto")
+    def encrypt(self, data: bytes, compression: int = COMPRESSION_NONE, associated_data: bytes = b"") -> bytes:
+        """encrypt, compressing first when asked and when it makes the value smaller.
+        associated_data (where the value is stored, for example) is authenticated but
+        not stored: decrypt fails unless it gets the same bytes."""
+        instrumentation.count("crypto.encryptedBytes", len(data), "crypto")
+        if compression != COMPRESSION_NONE and self.writer.format_id != FORMAT_FERNET:
+            compressed = compressData(data, compression)
+            if len(compressed) < len(data):
+                return self.writer.encrypt(compressed, compression, associated_data)
+        return self.writer.encrypt(data, COMPRESSION_NONE, associated_data)
+
+    @instrumentation.timed("crypto.decrypt", "crypto")
+    def decrypt(self, data: bytes, associated_data: bytes = b"") -> bytes:
+        instrumentation.count("crypto.decryptedBytes", len(data), "crypto")
+        engine_id, compression = detectFormat(data)
+        return decompressData(self.reader(engine_id).decrypt(data, associated_data), compression)
+
+
+# ***************** encryption
+def encryptTextToData(input_text: str, user_key: UserKey, compress: bool = False) -> bytes:
+    """Encrypt text, with compress=True large texts are compressed first"""
     message_data = input_text.encode(encoding='UTF-8')
+    if compress:
+        return user_key.encrypt(message_data, chooseCompression(len(message_data)))
     encrypted_data = user_key.encrypt(message_data)
     return encrypted_data
 
 
-def decryptDataToText(input_data: bytes, user_key: Fernet) -> str:
+def decryptDataToText(input_data: bytes, user_key: UserKey) -> str:
     """Decrypt data to clear text"""
     decrypted_data = user_key.decrypt(input_data)
     clear_text = decrypted_data.decode(encoding='UTF-8')
@@ -0,0 +1,153 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas_v4
+
+Python side copy of the text shown in the editor, kept up to date with the change
+deltas sent by codemirror_ui.html (no Qt needed) """
+import hashlib
+import re
+from typing import Callable, Dict, Hashable, List, Optional
+
+LINE_BREAK = re.compile(r"\r\n?|\n")  # the line breaks CodeMirror splits on
+
+
+def splitLines(text: str) -> List[str]:
+    return LINE_BREAK.split(text)
+
+
+def utf16Index(line: str, units: int) -> int:
+    """index in line of a CodeMirror column, CodeMirror counts UTF-16 code units"""
+    if units <= 0 or line.isascii():
+        return units
+    encoded = line.encode("utf-16-le", "surrogatepass")
+    return len(encoded[:units * 2].decode("utf-16-le", "surrogatepass"))
+
+
+class SaveWaiter:
+    """callback(text) waiting for the buffer to reach a revision, the revision is
+    None until the editor reports it (TextBuffer.flushed)"""
+
+    def __init__(self, callback: Callable[[str], None]):
+        self.callback = callback
+        self.revision: Optional[int] = None
+
+
+class TextBuffer:
+    """Text of one document as a list of lines.
+
+    The editor numbers its changes: revision is the number of changes applied
+    since the document was loaded. A batch of changes is only applied on top of
+    the revision it was made from, anything else means the two copies diverged
+    and the editor has to send the full text.
+    """
+
+    def __init__(self, text: str = ""):
+        self.lines = splitLines(text)
+        self.revision = 0
+        self.resyncPending = False
+        self.waiters: List[SaveWaiter] = []
+        self.changesApplied = 0
+
+    def getText(self) -> str:
+        return "\n".join(self.lines)
+
+    def reset(self, text: str, revision: int) -> None:
+        """replace the whole text (full resync)"""
+        self.lines = splitLines(text)
+        self.revision = revision
+        self.resyncPending = False
+        self.fireWaiters()
+
+    def applyChange(self, from_line: int, from_ch: int, to_line: int, to_ch: int, text: str) -> None:
+        """replace the range from..to (CodeMirror positions before the change) with text"""
+        if not 0 <= from_line <= to_line < len(self.lines):
+            raise ValueError(f"change outside of the document: lines {from_line}..{to_line}")
+        first = self.lines[from_line]
+        last = self.lines[to_line]
+        inserted = text.split("\n")
+        inserted[0] = first[:utf16Index(first, from_ch)] + inserted[0]
+        inserted[-1] = inserted[-1] + last[utf16Index(last, to_ch):]
+        self.lines[from_line:to_line + 1] = inserted
+
+    def applyChanges(self, base_revision: int, changes: list) -> bool:
+        """apply a batch of [from_line, from_ch, to_line, to_ch, text] changes made on
+        top of base_revision, return False if the batch does not fit this buffer"""
+        if base_revision != self.revision or self.resyncPending:
+            return False
+        saved = list(self.lines)
+        try:
+            for change in changes:
+                self.applyChange(*change)
+        except (ValueError, TypeError):
+            self.lines = saved
+            return False
+        self.revision += len(changes)
+        self.changesApplied += len(changes)
+        self.fireWaiters()
+        return True
+
+    # ***************** saves waiting for edits still on their way
+    def addWaiter(self, callback: Callable[[str], None]) -> SaveWaiter:
+        waiter = SaveWaiter(callback)
+        self.waiters.append(waiter)
+        return waiter
+
+    def flushed(self, revision: int) -> None:
+        """the editor sent every edit up to revision, a negative revision means the
+        editor no longer shows this document and has nothing more to send"""
+        for waiter in self.waiters:
+            if waiter.revision is None:
+                waiter.revision = revision if revision >= 0 else self.revision
+        self.fireWaiters()
+
+    def finishWaiter(self, waiter: SaveWaiter) -> None:
+        """call the waiter now with the text as it is"""
+        if waiter in self.waiters:
+            self.waiters.remove(waiter)
+            waiter.callback(self.getText())
+
+    def fireWaiters(self) -> None:
+        ready = [w for w in self.waiters if w.revision is not None and w.revision <= self.revision]
+        for waiter in ready:
+            self.finishWaiter(waiter)
+
+
+def normalizeLineBreaks(text: str) -> str:
+    """text with its line breaks as the editor gives them back ("\n")"""
+    return "\n".join(splitLines(text)) if "\r" in text else text
+
+
+def textDigest(text: str) -> bytes:
+    """digest of text, line breaks normalized: a stored "\r\n" text the editor gives
+    back with "\n" is the same text"""
+    text = normalizeLineBreaks(text)
+    return hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+
+
+class DirtyTracker:
+    """Digest of the text each document had when it was loaded or last saved.
+
+    Saving a text equal to that one is skipped, so clicking through pages does
+    not encrypt and write them again."""
+
+    def __init__(self):
+        self.digests: Dict[Hashable, bytes] = {}
+        self.savesWritten = 0
+        self.savesSkipped = 0
+
+    def loaded(self, document: Hashable, text: str) -> None:
+        self.digests[document] = textDigest(text)
+
+    def forget(self, document: Hashable) -> None:
+        self.digests.pop(document, None)
+
+    def needsSave(self, document: Hashable, text: str) -> bool:
+        """True (and text recorded as saved) when text differs from the known one"""
+        digest = textDigest(text)
+        if self.digests.get(document) == digest:
+            self.savesSkipped += 1
+            return False
+        self.digests[document] = digest
+        self.savesWritten += 1
+        return True
@@ -0,0 +1,257 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas_v4
+
+Timing spans and counters on the hot paths: storage calls, key derivation and
+encryption, texts sent to and edits received from the editor, the wait of a call
+for the storage thread. The System menu shows them (performance_panel.py) and
+exportTrace writes them as a trace file that chrome://tracing and Perfetto open.
+
+Recording is off unless the MAITENOTAS_TRACE environment variable is set or
+setEnabled(True) is called. Off, a span costs a function call and one test;
+wrappers on the hottest calls test the enabled flag themselves and skip even that.
+
+    with instrumentation.span("storage.getPageText", "storage"):
+        ...
+
+    @instrumentation.timed("crypto.deriveKey", "crypto")
+    def deriveKeyBytes(...):
+
+Spans nest per thread: the self time of a span is its time minus the time of the
+spans inside it, so a storage call shows how much of it was not encryption.
+"""
+import collections
+import functools
+import json
+import os
+import threading
+import time
+from typing import Callable, Deque, Dict, List, Optional
+
+enabled = bool(os.environ.get("MAITENOTAS_TRACE"))  # read it, change it with setEnabled
+ROLLING_SAMPLES = 512  # recent durations kept per span name for percentiles
+TRACE_EVENTS = 200000  # spans and counter values kept for the trace file
+
+
+def now() -> int:
+    """timestamp for recordSpan, in nanoseconds"""
+    return time.perf_counter_ns()
+
+
+class SpanStatistics:
+    """totals of one span name since the last reset, and its recent durations"""
+    __slots__ = ("category", "count", "total", "self_total", "max", "recent")
+
+    def __init__(self, category: str):
+        self.category = category
+        self.count = 0
+        self.total = 0
+        self.self_total = 0
+        self.max = 0
+        self.recent: Deque[int] = collections.deque(maxlen=ROLLING_SAMPLES)
+
+
+class Recorder:
+    """collects spans and counters of every thread of the process"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.reset()
+
+    def reset(self) -> None:
+        with self.lock:
+            self.origin = now()
+            self.spans: Dict[str, SpanStatistics] = {}
+            self.counters: Dict[str, List[int]] = {}  # name -> [events, total]
+            # ("X", name, category, start, duration, thread, args) or ("C", name, category, time, total, thread, None)
+            self.events: Deque[tuple] = collections.deque(maxlen=TRACE_EVENTS)
+            self.threads: Dict[int, str] = {}
+
+    def stack(self) -> list:
+        stack = getattr(self.local, "stack", None)
+        if stack is None:
+            stack = self.local.stack = []
+        return stack
+
+    def record(self, name: str, category: str, start: int, end: int, children: int,
+               args: Optional[dict]) -> None:
+        duration = end - start
+        thread = threading.get_ident()
+        with self.lock:
+            statistics = self.spans.get(name)
+            if statistics is None:
+                statistics = self.spans[name] = SpanStatistics(category)
+            statistics.count += 1
+            statistics.total += duration
+            statistics.self_total += duration - children
+            statistics.max = max(statistics.max, duration)
+            statistics.recent.append(duration)
+            if thread not in self.threads:
+                self.threads[thread] = threading.current_thread().name
+            self.events.append(("X", name, category, start, duration, thread, args))
+
+    def addCount(self, name: str, value: int, category: str) -> None:
+        thread = threading.get_ident()
+        with self.lock:
+            counter = self.counters.get(name)
+            if counter is None:
+                counter = self.counters[name] = [0, 0]
+            counter[0] += 1
+            counter[1] += value
+            if thread not in self.threads:
+                self.threads[thread] = threading.current_thread().name
+            self.events.append(("C", name, category, now(), counter[1], thread, None))
+
+
+_recorder = Recorder()
+
+
+def isEnabled() -> bool:
+    return enabled
+
+
+def setEnabled(value: bool) -> None:
+    global enabled
+    enabled = bool(value)
+
+
+def reset() -> None:
+    """forget every span and counter recorded so far"""
+    _recorder.reset()
+
+
+# ***************** spans and counters
+class Span:
+    __slots__ = ("name", "category", "args", "start", "children")
+
+    def __init__(self, name: str, category: str, args: Optional[dict]):
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self) -> "Span":
+        _recorder.stack().append(self)
+        self.children = 0
+        self.start = now()
+        return self
+
+    def __exit__(self, *exc) -> bool:
+        end = now()
+        stack = _recorder.stack()
+        stack.pop()
+        if stack:
+            stack[-1].children += end - self.start
+        _recorder.record(self.name, self.category, self.start, end, self.children, self.args)
+        return False
+
+
+class NoSpan:
+    """what span() returns while recording is off"""
+
+    def __enter__(self) -> "NoSpan":
+        return self
+
+    def __exit__(self, *exc) -> bool:
+        return False
+
+
+NO_SPAN = NoSpan()
+
+
+def span(name: str, category: str = "app", args: Optional[dict] = None):
+    """context manager timing its block as a span called name"""
+    if not enabled:
+        return NO_SPAN
+    return Span(name, category, args)
+
+
+def timed(name: Optional[str] = None, category: str = "app") -> Callable:
+    """decorator timing every call of a function as a span (its qualified name by default)"""
+    def decorate(function: Callable) -> Callable:
+        label = name or function.__qualname__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+            with Span(label, category, None):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def recordSpan(name: str, category: str, start: int, end: Optional[int] = None,
+               args: Optional[dict] = None) -> None:
+    """record a span measured apart, for waits that start and end in different
+    places (start and end come from now())"""
+    if enabled:
+        _recorder.record(name, category, start, now() if end is None else end, 0, args)
+
+
+def count(name: str, value: int = 1, category: str = "app") -> None:
+    """add value to a counter (bytes, items...)"""
+    if enabled:
+        _recorder.addCount(name, value, category)
+
+
+# ***************** reading the data
+def percentile(samples: List[int], p: int) -> int:
+    return samples[min(len(samples) - 1, len(samples) * p // 100)] if samples else 0
+
+
+def spanStatistics() -> List[dict]:
+    """one row per span name, times in milliseconds, the biggest total first.
+    Percentiles are of the last ROLLING_SAMPLES calls."""
+    with _recorder.lock:
+        rows = []
+        for name, statistics in _recorder.spans.items():
+            recent = sorted(statistics.recent)
+            rows.append({
+                "name": name,
+                "category": statistics.category,
+                "count": statistics.count,
+                "totalMs": statistics.total / 1e6,
+                "selfMs": statistics.self_total / 1e6,
+                "meanMs": statistics.total / statistics.count / 1e6,
+                "p50Ms": percentile(recent, 50) / 1e6,
+                "p95Ms": percentile(recent, 95) / 1e6,
+                "maxMs": statistics.max / 1e6,
+            })
+    rows.sort(key=lambda row: row["totalMs"], reverse=True)
+    return rows
+
+
+def counterStatistics() -> List[dict]:
+    with _recorder.lock:
+        return [{"name": name, "events": events, "total": total}
+                for name, (events, total) in sorted(_recorder.counters.items())]
+
+
+def exportTrace(file_path: str) -> int:
+    """Write the recorded spans and counters in the Chrome trace event format,
+    return the number of events written. The oldest events are gone once more
+    than TRACE_EVENTS were recorded."""
+    pid = os.getpid()
+    with _recorder.lock:
+        events = list(_recorder.events)
+        threads = dict(_recorder.threads)
+        origin = _recorder.origin
+    trace = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": thread, "args": {"name": name}}
+             for thread, name in threads.items()]
+    for kind, name, category, start, value, thread, args in events:
+        event = {"name": name, "cat": category, "ph": kind, "pid": pid, "tid": thread,
+                 "ts": (start - origin) / 1000}
+        if kind == "X":
+            event["dur"] = value / 1000
+            if args:
+                event["args"] = args
+        else:
+            event["args"] = {name: value}
+        trace.append(event)
+    partial = file_path + ".partial"
+    with open(partial, "w", encoding="utf-8") as output:
+        json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, output)
+    os.replace(partial, file_path)
+    return len(events)
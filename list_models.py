@@ -0,0 +1,161 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas_v4
+
+List model for the book and page lists: ids are loaded up front, names are
+decrypted in batches when the view scrolls to them """
+from typing import Callable, Dict, List, Optional
+
+from PySide2.QtCore import QAbstractListModel, QModelIndex, QObject, Qt, Signal
+from PySide2.QtWidgets import QAbstractItemView, QListView
+
+FETCH_BATCH = 500  # names decrypted per fetchMore
+ITEM_ID_ROLE = Qt.UserRole
+
+
+class ItemListModel(QAbstractListModel):
+    """Books or pages of the vault, shown by name.
+
+    Reading the ids needs no decryption, so reset() is cheap whatever the number
+    of rows. Rows become visible FETCH_BATCH at a time: fetchMore asks
+    loadTitles(ids, callback) for their names, and callback([(id, name), ...])
+    inserts them. Rows are in the order of the ids until every name is known,
+    then sorted by name, so a list shorter than one batch is sorted right away.
+    """
+
+    firstBatchLoaded = Signal()
+
+    def __init__(self, loadTitles: Callable[[List[int], Callable], None], parent: Optional[QObject] = None):
+        super().__init__(parent)
+        self.loadTitles = loadTitles
+        self.ids: List[int] = []
+        self.names: Dict[int, str] = {}
+        self.fetched = 0  # rows visible to the view, always the first ones of ids
+        self.loading = False
+        self.sorted = True
+        self.generation = 0  # titles of an older reset are dropped
+
+    def reset(self, ids: Optional[List[int]]) -> None:
+        """show these ids instead of the current rows"""
+        self.beginResetModel()
+        self.ids = list(ids or [])
+        self.names = {}
+        self.fetched = 0
+        self.loading = False
+        self.sorted = not self.ids
+        self.generation += 1
+        self.endResetModel()
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else self.fetched
+
+    def data(self, index: QModelIndex, role: int = Qt.DisplayRole):
+        if not index.isValid() or index.row() >= self.fetched:
+            return None
+        itemId = self.ids[index.row()]
+        if role == Qt.DisplayRole:
+            return self.names.get(itemId, "")
+        if role == ITEM_ID_ROLE:
+            return itemId
+        return None
+
+    def itemId(self, row: int) -> int:
+        return self.ids[row]
+
+    def rowOf(self, itemId: int) -> int:
+        """row of an id, -1 if it is not in the list"""
+        try:
+            return self.ids.index(itemId)
+        except ValueError:
+            return -1
+
+    # ***************** lazy loading
+    def canFetchMore(self, parent: QModelIndex = QModelIndex()) -> bool:
+        return not parent.isValid() and not self.loading and self.fetched < len(self.ids)
+
+    def fetchMore(self, parent: QModelIndex = QModelIndex()) -> None:
+        if not self.canFetchMore(parent):
+            return
+        self.loading = True
+        generation = self.generation
+        batch = self.ids[self.fetched:self.fetched + FETCH_BATCH]
+        self.loadTitles(batch, lambda titles: self.titlesLoaded(generation, batch, titles))
+
+    def titlesLoaded(self, generation: int, batch: List[int], titles: Optional[list]) -> None:
+        if generation != self.generation:
+            return
+        self.loading = False
+        first = self.fetched == 0
+        self.names.update(titles or [])
+        # ids that got no name were deleted meanwhile, they are not visible yet
+        missing = {itemId for itemId in batch if itemId not in self.names}
+        if missing:
+            self.ids = self.ids[:self.fetched] + [i for i in self.ids[self.fetched:] if i not in missing]
+        end = self.fetched
+        while end < len(self.ids) and self.ids[end] in self.names:
+            end += 1
+        if end > self.fetched:
+            self.beginInsertRows(QModelIndex(), self.fetched, end - 1)
+            self.fetched = end
+            self.endInsertRows()
+        if self.fetched == len(self.ids):
+            self.sortByName()
+        if first:
+            self.firstBatchLoaded.emit()
+
+    def sortByName(self) -> None:
+        """sort every row by name, the selection stays on the same items"""
+        if self.sorted:
+            return
+        self.sorted = True
+        self.layoutAboutToBeChanged.emit()
+        persistent = self.persistentIndexList()
+        persistentIds = [self.ids[index.row()] for index in persistent]
+        # stable sort, equal names keep the order of their ids
+        self.ids.sort(key=lambda itemId: self.names[itemId])
+        rows = {itemId: row for row, itemId in enumerate(self.ids)}
+        self.changePersistentIndexList(persistent, [self.index(rows[itemId]) for itemId in persistentIds])
+        self.layoutChanged.emit()
+
+    # ***************** changes made by the application
+    def insertItem(self, itemId: int, name: str) -> None:
+        """add a new row, at its place by name once the list is sorted"""
+        self.names[itemId] = name
+        if not self.sorted:
+            # becomes visible with the batch it falls in
+            self.ids.append(itemId)
+            return
+        row = len(self.ids)
+        for index, other in enumerate(self.ids):
+            if self.names[other] > name:
+                row = index
+                break
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.ids.insert(row, itemId)
+        self.fetched += 1
+        self.endInsertRows()
+
+    def removeItem(self, itemId: int) -> None:
+        row = self.rowOf(itemId)
+        if row < 0:
+            return
+        if row < self.fetched:
+            self.beginRemoveRows(QModelIndex(), row, row)
+            del self.ids[row]
+            self.fetched -= 1
+            self.endRemoveRows()
+        else:
+            del self.ids[row]
+        self.names.pop(itemId, None)
+
+
+def createListView(model: ItemListModel) -> QListView:
+    """list view of an ItemListModel, rows all have the same height so long lists
+    are laid out without measuring every row"""
+    listView = QListView()
+    listView.setModel(model)
+    listView.setUniformItemSizes(True)
+    listView.setSelectionMode(QAbstractItemView.SingleSelection)
+    listView.setEditTriggers(QAbstractItemView.NoEditTriggers)
+    return listView
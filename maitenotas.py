@@ -6,77 +6,202 @@ https://github.com/maitelab/maitenotas_v4
 Main launcher of the application
 """
 from os import path
+import itertools
+import json
 import os
 import sys
-from PySide2.QtWidgets import QApplication, QMainWindow, QAction, QMessageBox,  QWidget, QHBoxLayout, QInputDialog, QLineEdit, QListWidgetItem,\
-    QListWidget, QVBoxLayout
-from PySide2.QtGui import QIcon
+from PySide2.QtWidgets import QApplication, QMainWindow, QAction, QMessageBox,  QWidget, QHBoxLayout, QInputDialog, QLineEdit, \
+    QVBoxLayout, QFileDialog
+from PySide2.QtGui import QIcon, QCursor
 
 from PySide2.QtWebEngineWidgets import QWebEngineView
-from PySide2.QtCore import QUrl
-from PySide2.QtCore import QObject, Slot
+from PySide2.QtCore import QUrl, QTimer, Qt, QEventLoop
+from PySide2.QtCore import QObject, Slot, Signal
 from PySide2.QtWebChannel import QWebChannel
 import text_labels
-from crypto import generateUserKey
-from storage import verifyDatabasePassword, createDatabase, createBook,   getBooks, createPage,\
-    getPagesOfBook, getBookText, getPageText, updatePageText, updateBookText, deleteBook, deletePage
-
+import instrumentation
+from crypto import generateUserKey, calibrateKdf, isLegacyKdf, renewKdfParams
+from storage import StorageSession, getDefaultSession, closeDefaultSession
+from async_storage import AsyncStorage
+from editor_buffer import TextBuffer, DirtyTracker
+from list_models import ItemListModel, createListView
+from attachments import guessMimeType
+from performance_panel import PerformancePanel
+from attachment_scheme import ATTACHMENT_SCHEME, AttachmentSchemeHandler, attachmentLink, registerAttachmentScheme
+
+# queued saves are written to the database at most this often
+SAVE_FLUSH_INTERVAL_MS = 3000
+# a save waits at most this long for edits still on their way from the editor
+SAVE_SYNC_TIMEOUT_MS = 2000
+# texts are sent to the editor in pieces of this many characters
+TEXT_CHUNK_CHARS = 256 * 1024
+# pages read ahead into the session cache: the first ones of a selected book and
+# the ones next to a clicked page (0 turns it off)
+PREFETCH_FIRST_PAGES = 10
+PREFETCH_NEIGHBOURS = 2
 
 class Handler(QObject):
-    """Handler for JS-Python communication"""
+    """Handler for JS-Python communication
+
+    Everything goes through the web channel, so messages keep their order in both
+    directions. Texts are sent to the editor in chunks that it joins once. The
+    editor sends its edits as batches of change deltas, they are applied to a
+    TextBuffer per document. Buffers of documents no longer shown are kept until
+    their pending save got its text."""
+
+    textChunkReady = Signal(int, int, int, str)  # document id, chunk index, chunk count, text
+    flushRequested = Signal(int)  # document id, the editor answers with changesFlushed
+    resyncRequested = Signal(int)  # document id, the editor answers with receiveFullText
+    documentShown = Signal(int)  # document id, emitted when the editor displays the text
+    textInsertRequested = Signal(int, str)  # document id, text typed at the cursor of the editor
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.text = "hello world"
-
-    @Slot(str)
-    def receiveTextFromWebGUI(self, inputText):
-        """Receive data from Javascript"""
-        self.text = inputText
+        self.documentIds = itertools.count(1)
+        self.currentDocId = 0  # 0 is the welcome text of the page, it is never saved
+        self.buffers = {}
+        self.resyncs = 0
+        self.sentAt = {}  # document id -> when its text was sent, for the editor.load span
+        self.flushAskedAt = {}  # document id -> when its edits were asked, for the editor.flush span
+
+    def newDocument(self, text):
+        """start a buffer for a text about to be shown, return its document id"""
+        docId = next(self.documentIds)
+        self.buffers = {i: b for i, b in self.buffers.items() if b.waiters}
+        # documents replaced before the editor answered are not timed
+        self.sentAt.clear()
+        self.flushAskedAt = {i: t for i, t in self.flushAskedAt.items() if i in self.buffers}
+        self.buffers[docId] = TextBuffer(text)
+        self.currentDocId = docId
+        return docId
+
+    def sendDocument(self, docId, text):
+        """send a text to the editor, it is displayed once the last chunk arrived"""
+        count = max(1, -(-len(text) // TEXT_CHUNK_CHARS))
+        instrumentation.count("editor.sentChars", len(text), "editor")
+        self.sentAt[docId] = instrumentation.now()
+        with instrumentation.span("editor.send", "editor", {"chars": len(text), "chunks": count}):
+            for index in range(count):
+                start = index * TEXT_CHUNK_CHARS
+                self.textChunkReady.emit(docId, index, count, text[start:start + TEXT_CHUNK_CHARS])
+
+    @Slot(int)
+    def documentLoaded(self, docId):
+        """Javascript displays the text of a document"""
+        sentAt = self.sentAt.pop(docId, None)
+        if sentAt is not None:
+            instrumentation.recordSpan("editor.load", "editor", sentAt)
+        self.documentShown.emit(docId)
+
+    @Slot(int, int, str)
+    def receiveChanges(self, docId, baseRevision, changesJson):
+        """Receive a batch of edits from Javascript"""
+        instrumentation.count("editor.receivedChangeChars", len(changesJson), "editor")
+        buffer = self.buffers.get(docId)
+        if buffer is None:
+            return
+        with instrumentation.span("editor.applyChanges", "editor"):
+            applied = buffer.applyChanges(baseRevision, json.loads(changesJson))
+        if not applied and not buffer.resyncPending:
+            # the two copies diverged, the editor is asked for its full text
+            buffer.resyncPending = True
+            self.resyncs += 1
+            instrumentation.count("editor.resyncs", 1, "editor")
+            self.resyncRequested.emit(docId)
+        self.releaseDocument(docId)
+
+    @Slot(int, int, str)
+    def receiveFullText(self, docId, revision, inputText):
+        """Receive the whole text from Javascript"""
+        instrumentation.count("editor.receivedFullTextChars", len(inputText), "editor")
+        buffer = self.buffers.get(docId)
+        if buffer is not None:
+            buffer.reset(inputText, revision)
+            self.releaseDocument(docId)
+
+    def releaseDocument(self, docId):
+        buffer = self.buffers.get(docId)
+        if buffer is not None and docId != self.currentDocId and not buffer.waiters:
+            del self.buffers[docId]
+
+    def whenSaved(self, docId, callback):
+        """call callback(text) once every edit of the document reached its buffer,
+        return the waiter (None for an unknown document)"""
+        buffer = self.buffers.get(docId)
+        if buffer is None:
+            return None
+        waiter = buffer.addWaiter(callback)
+        # the editor sends its pending edits, then answers with changesFlushed
+        self.flushAskedAt.setdefault(docId, instrumentation.now())
+        self.flushRequested.emit(docId)
+        return waiter
+
+    @Slot(int, int)
+    def changesFlushed(self, docId, revision):
+        """Javascript sent every edit of the document up to revision"""
+        askedAt = self.flushAskedAt.pop(docId, None)
+        if askedAt is not None:
+            instrumentation.recordSpan("editor.flush", "editor", askedAt)
+        buffer = self.buffers.get(docId)
+        if buffer is not None:
+            buffer.flushed(revision)
+            self.releaseDocument(docId)
+
+    def finishWaiter(self, docId, waiter):
+        """give up waiting, the waiter gets the text as it is"""
+        buffer = self.buffers.get(docId)
+        if buffer is not None:
+            buffer.finishWaiter(waiter)
+            self.releaseDocument(docId)
 
     def getCurrentText(self):
         """Return current value of text"""
-        return self.text
-
-
-class MaiteListItem(QListWidgetItem):
-    
-    def __init__(self, itemId=0, itemText=''):
-        super().__init__()
-        self.itemId = itemId
-        self.setText(itemText)
+        buffer = self.buffers.get(self.currentDocId)
+        return buffer.getText() if buffer is not None else ""
 
 
 class MaiteBody(QWidget):
     """Main display body"""
 
-    def __init__(self, userKey):
+    def __init__(self, userKey, session: StorageSession):
         super().__init__(None)
         self.userKey = userKey
+        self.session = session
+        # every storage call runs on a worker thread, results come back to the slots below
+        self.storage = AsyncStorage(session, self)
       
-        # get list of books
-        listBooks = getBooks(self.userKey)
-        listBooksWidget = QListWidget()
+        # get list of books, names are decrypted as the list is scrolled
+        self.booksModel = ItemListModel(
+            lambda ids, callback: self.storage.getTitles(self.userKey, "book", ids, callback), self)
+        listBooksWidget = createListView(self.booksModel)
         listBooksWidget.setWindowTitle(text_labels.LIST_BOOKS_TITLE)
-                
-        for lbook in listBooks:
-            bookId = lbook[0]
-            bookName = lbook[1]
-            listBooksWidget.addItem(MaiteListItem(bookId, bookName))
+        # books created by a schema upgrade get their name before books are listed
+        self.storage.call(self.session.nameRecoveredBooks, (self.userKey,))
+        self.storage.getBookIds(self.booksModel.reset)
+        # pages saved before the search index existed are indexed in the background
+        self.storage.call(self.session.indexMissingPages, (self.userKey,))
 
         self.selectedBookId = -1 # no book selected yet
         self.selectedPageId = -1 # none selected at the beginning
+        # ("book"|"page", id) of the text shown in the editor, None while loading
+        self.editorDocument = None
+        # texts that did not change since they were loaded are not saved again
+        self.dirtyTracker = DirtyTracker()
 
         self.listBooksWidget = listBooksWidget
         
         # get list of pages of the first book
-        listPagesWidget = QListWidget()
+        self.pagesModel = ItemListModel(
+            lambda ids, callback: self.storage.getTitles(self.userKey, "page", ids, callback), self)
+        # the first pages of a selected book are likely to be opened next
+        self.pagesModel.firstBatchLoaded.connect(lambda: self.prefetchPages(range(PREFETCH_FIRST_PAGES)))
+        listPagesWidget = createListView(self.pagesModel)
         listPagesWidget.setWindowTitle(text_labels.LIST_BOOKS_TITLE)
                       
         self.listPagesWidget = listPagesWidget
         
-        self.listPagesWidget.itemClicked.connect(self.listPagesClicked)
-        self.listBooksWidget.itemClicked.connect(self.listBooksClicked)
+        self.listPagesWidget.clicked.connect(self.listPagesClicked)
+        self.listBooksWidget.clicked.connect(self.listBooksClicked)
         
         # left view has both lists
         self.vlay = QVBoxLayout()
@@ -105,99 +230,219 @@ class MaiteBody(QWidget):
 
         self.webPage.setWebChannel(self.channel)
 
+        # attachments are shown by the editor from maite-attachment:ID urls
+        self.attachmentHandler = AttachmentSchemeHandler(self.storage, lambda: self.userKey, self)
+        self.webPage.profile().installUrlSchemeHandler(ATTACHMENT_SCHEME, self.attachmentHandler)
+
         self.webEngineView.load(url)
         self.webEngineView.show()
         hlay.addWidget(self.webEngineView, 75)
 
         self.setLayout(hlay)
 
+        # saves are queued in the session and written in groups
+        self.flushTimer = QTimer(self)
+        self.flushTimer.setInterval(SAVE_FLUSH_INTERVAL_MS)
+        self.flushTimer.timeout.connect(self.storage.flushPendingWrites)
+        self.flushTimer.start()
+
+    def shutdown(self):
+        """stop background work, every submitted save is handed to the session"""
+        self.flushTimer.stop()
+        self.storage.shutdown()
+
+    def showTextInEditor(self, document, text):
+        self.editorDocument = document
+        self.dirtyTracker.loaded(document, text)
+        docId = self.handler.newDocument(text)
+        self.handler.sendDocument(docId, text)
+
     def loadBookAndChildren(self):
         self.selectedPageId = -1 # no page selected
-        bookText = getBookText(self.userKey, self.selectedBookId)
-        newText = bookText.replace("\n", "\\n").replace("\'","\\'")
-        js = f"setText('{newText}');"      
-        self.webPage.runJavaScript(js)        
+        bookId = self.selectedBookId
+        self.editorDocument = None
+        self.storage.getBookText(self.userKey, bookId,
+                                 lambda text: self.showTextInEditor(("book", bookId), text))
         
         # reload pages list
-        listPages = getPagesOfBook(self.userKey, self.selectedBookId)
-        self.listPagesWidget.clear()
-               
-        for lp in listPages:
-            pageId = lp[0]
-            pageName = lp[1]
-            self.listPagesWidget.addItem(MaiteListItem(pageId, pageName))
+        self.pagesModel.reset([])
+        self.storage.getPageIdsOfBook(self.selectedBookId, self.pagesModel.reset)
+
+    def prefetchPages(self, rows):
+        """read the pages at these rows of the page list into the session cache"""
+        pageIds = [self.pagesModel.itemId(row) for row in rows
+                   if 0 <= row < self.pagesModel.rowCount()]
+        if pageIds:
+            self.storage.prefetchPages(self.userKey, pageIds)
 
-    def listBooksClicked(self, mitem):
+    def listBooksClicked(self, index):
         self.saveCurrentTextOnScreen()
         # load book text
-        self.selectedBookId = mitem.itemId
+        self.selectedBookId = self.booksModel.itemId(index.row())
         print(f"clicked book id = {self.selectedBookId}")
         self.loadBookAndChildren()
 
     def displayTextInEditor(self):
-        pageText = getPageText(self.userKey, self.selectedPageId)
-        newText = pageText.replace("\n", "\\n").replace("\'","\\'")
-        js = f"setText('{newText}');"      
-        self.webPage.runJavaScript(js)
+        pageId = self.selectedPageId
+        self.editorDocument = None
+        self.storage.getPageText(self.userKey, pageId,
+                                 lambda text: self.showTextInEditor(("page", pageId), text))
                 
-    def listPagesClicked(self, mitem):
+    def listPagesClicked(self, index):
         self.saveCurrentTextOnScreen()
-        self.selectedPageId = mitem.itemId
+        self.selectedPageId = self.pagesModel.itemId(index.row())
         self.displayTextInEditor()
+        # paging through a book opens the pages next to this one
+        row = index.row()
+        self.prefetchPages([row + offset for offset in range(1, PREFETCH_NEIGHBOURS + 1)] +
+                           [row - offset for offset in range(1, PREFETCH_NEIGHBOURS + 1)])
         
-    def saveCurrentTextOnScreen(self):
-        # invoke javascript function to read text from web ui component
-        currentTextOnScreen = self.handler.getCurrentText()
-        # update the text in database
-        if self.selectedPageId >= 1:
-            # text belongs to a page
-            updatePageText(self.userKey, self.selectedPageId, currentTextOnScreen)
-        else:
-            if self.selectedBookId >= 1:
-                # text belongs to a book
-                updateBookText(self.userKey, self.selectedBookId, currentTextOnScreen)
+    def saveCurrentTextOnScreen(self, wait=False):
+        """Queue the text on screen for saving once the editor sent its last edits.
+        With wait=True return only after the save was queued."""
+        # update the text in database, unless the editor is still waiting for its text
+        if self.editorDocument is None:
+            return
+        document = self.editorDocument
+        kind, documentId = document
+        docId = self.handler.currentDocId
+        loop = QEventLoop() if wait else None
+        queued = []
+
+        def queueSave(currentTextOnScreen):
+            queued.append(True)
+            # nothing is written when the text is the one loaded (or saved) before
+            if not self.dirtyTracker.needsSave(document, currentTextOnScreen):
+                instrumentation.count("editor.savesSkipped", 1, "editor")
+            else:
+                instrumentation.count("editor.savesQueued", 1, "editor")
+                if kind == "page":
+                    # text belongs to a page
+                    self.storage.queuePageText(self.userKey, documentId, currentTextOnScreen)
+                else:
+                    # text belongs to a book
+                    self.storage.queueBookText(self.userKey, documentId, currentTextOnScreen)
+            if loop is not None:
+                loop.quit()
+
+        # the web ui component is asked to send its pending edits first
+        waiter = self.handler.whenSaved(docId, queueSave)
+        if waiter is None:
+            return
+        QTimer.singleShot(SAVE_SYNC_TIMEOUT_MS, lambda: self.handler.finishWaiter(docId, waiter))
+        if loop is not None and not queued:
+            loop.exec_()
                 
     def deleteBook(self):
         if self.selectedBookId >= 1:
-            selectedBooks = self.listBooksWidget.selectedItems()
-            bookIdToDelete = selectedBooks[0].itemId
-            deleteBook(bookIdToDelete)
-            rowId = self.listBooksWidget.row(selectedBooks[0]) 
-            self.listBooksWidget.takeItem(rowId)
-            selectedBooks = self.listBooksWidget.selectedItems()
-            self.selectedBookId = selectedBooks[0].itemId 
+            bookIdToDelete = self.selectedBookId
+            self.storage.call(self.session.deleteBook, (self.userKey, bookIdToDelete))
+            self.dirtyTracker.forget(("book", bookIdToDelete))
+            self.booksModel.removeItem(bookIdToDelete)
+            # the view moved its current row to a neighbour of the deleted one
+            index = self.listBooksWidget.currentIndex()
+            if not index.isValid():
+                self.selectedBookId = -1
+                self.editorDocument = None
+                self.pagesModel.reset([])
+                return
+            self.listBooksWidget.setCurrentIndex(index)
+            self.selectedBookId = self.booksModel.itemId(index.row())
             self.loadBookAndChildren()
 
     def addBook(self):
         text1, okPressed1 = QInputDialog.getText(self, text_labels.MESSAGE_BOX_TITLE,text_labels.NEW_BOOK_NAME, QLineEdit.Normal, "")
         if okPressed1 and len(text1) > 0:
             # add new book to database
-            newBookId = createBook(self.userKey,text1,text_labels.SAMPLE_BOOK_TEXT)
-            createPage(self.userKey, newBookId, text_labels.SAMPLE_PAGE_NAME, text_labels.SAMPLE_PAGE_TEXT)
-            
-            # add new book to UI
-            self.listBooksWidget.addItem(MaiteListItem(newBookId, text1))
+            def createBookWithPage():
+                newBookId = self.session.createBook(self.userKey,text1,text_labels.SAMPLE_BOOK_TEXT)
+                # createBook returns 0 when it failed
+                if newBookId:
+                    self.session.createPage(self.userKey, newBookId, text_labels.SAMPLE_PAGE_NAME, text_labels.SAMPLE_PAGE_TEXT)
+                return newBookId
+
+            # add new book to UI once it is stored
+            def showNewBook(newBookId):
+                if not newBookId:
+                    QMessageBox.about(self, text_labels.ERROR_READING_DATA, text_labels.ADD_BOOK_FAILED)
+                    return
+                self.booksModel.insertItem(newBookId, text1)
+
+            self.storage.call(createBookWithPage, (), showNewBook)
             
     def deletePage(self):
         if self.selectedPageId >= 1:
-            selectedPages = self.listPagesWidget.selectedItems()
-            pageIdToDelete = selectedPages[0].itemId
-            deletePage(pageIdToDelete)
-            rowId = self.listPagesWidget.row(selectedPages[0]) 
-            self.listPagesWidget.takeItem(rowId)
+            pageIdToDelete = self.selectedPageId
+            self.storage.call(self.session.deletePage, (self.userKey, pageIdToDelete))
+            self.dirtyTracker.forget(("page", pageIdToDelete))
+            self.pagesModel.removeItem(pageIdToDelete)
             # redraw text editor because a new page got automatically selected in UI
-            selectedPages = self.listPagesWidget.selectedItems()
-            self.selectedPageId = selectedPages[0].itemId 
+            index = self.listPagesWidget.currentIndex()
+            if not index.isValid():
+                self.loadBookAndChildren()
+                return
+            self.listPagesWidget.setCurrentIndex(index)
+            self.selectedPageId = self.pagesModel.itemId(index.row())
             self.displayTextInEditor()
 
     def addPage(self):
         if self.selectedBookId >= 1:
             text1, okPressed1 = QInputDialog.getText(self, text_labels.MESSAGE_BOX_TITLE,text_labels.NEW_PAGE_NAME, QLineEdit.Normal, "")
             if okPressed1 and len(text1) > 0:
-                # add new page to database
-                newPageId = createPage(self.userKey, self.selectedBookId, text1, text_labels.SAMPLE_PAGE_TEXT)
-                # add new book to UI
-                self.listPagesWidget.addItem(MaiteListItem(newPageId, text1))
+                # add new page to database, then to UI if its book is still shown
+                bookId = self.selectedBookId
+
+                def showNewPage(newPageId):
+                    if newPageId and self.selectedBookId == bookId:
+                        self.pagesModel.insertItem(newPageId, text1)
+
+                self.storage.call(self.session.createPage,
+                                  (self.userKey, bookId, text1, text_labels.SAMPLE_PAGE_TEXT), showNewPage)
+
+    def attachFile(self):
+        if self.selectedPageId < 1:
+            return
+        filePath, _ = QFileDialog.getOpenFileName(self, text_labels.MENU_TEXT_ATTACH_FILE)
+        if not filePath:
+            return
+        pageId = self.selectedPageId
+        docId = self.handler.currentDocId
+
+        def insertLink(attachmentId):
+            if not attachmentId:
+                QMessageBox.about(self, text_labels.ERROR_READING_DATA, text_labels.ATTACH_FILE_FAILED)
+                return
+            # the link goes to the page only if it is still the one in the editor
+            if self.editorDocument == ("page", pageId):
+                fileName = os.path.basename(filePath)
+                self.handler.textInsertRequested.emit(docId, attachmentLink(attachmentId, fileName,
+                                                                            guessMimeType(fileName)))
+
+        # the file is encrypted a frame at a time on the storage thread
+        self.storage.call(self.session.addAttachment, (self.userKey, pageId, filePath), insertLink)
+
+    def saveAttachment(self):
+        if self.selectedPageId < 1:
+            return
+        files = self.storage.callAndWait(self.session.getAttachmentsOfPage, (self.userKey, self.selectedPageId))
+        if not files:
+            QMessageBox.about(self, text_labels.MESSAGE_BOX_TITLE, text_labels.NO_ATTACHMENTS)
+            return
+        names = [f"{attachmentId}: {fileName} ({size // 1024} KB)" for attachmentId, fileName, _, size, _ in files]
+        name, okPressed = QInputDialog.getItem(self, text_labels.MENU_TEXT_SAVE_ATTACHMENT,
+                                               text_labels.CHOOSE_ATTACHMENT, names, 0, False)
+        if not okPressed:
+            return
+        attachmentId, fileName = files[names.index(name)][:2]
+        destination, _ = QFileDialog.getSaveFileName(self, text_labels.MENU_TEXT_SAVE_ATTACHMENT, fileName)
+        if not destination:
+            return
+
+        def saved(done):
+            if not done:
+                QMessageBox.about(self, text_labels.ERROR_READING_DATA, text_labels.SAVE_ATTACHMENT_FAILED)
+
+        self.storage.call(self.session.exportAttachment, (self.userKey, attachmentId, destination), saved)
             
 class Notepad(QMainWindow):
     """Main Window to hold all other widgets and menu"""
@@ -212,9 +457,13 @@ class Notepad(QMainWindow):
             # ask for diary password
             text1, okPressed1 = QInputDialog.getText(self, text_labels.OPENING_DIARY,text_labels.ENTER_PASSWORD, QLineEdit.Password, "")
             if okPressed1 and len(text1) > 0:
-                # verify password
-                self.userKey = generateUserKey(text1)
-                databaseAccess = verifyDatabasePassword(self.userKey, text1)
+                # one session (connection) is shared by the whole application
+                self.session = getDefaultSession()
+                # verify password, key derivation settings are stored in the database
+                QApplication.setOverrideCursor(QCursor(Qt.WaitCursor))
+                self.userKey = generateUserKey(text1, self.session.getKdfParams())
+                QApplication.restoreOverrideCursor()
+                databaseAccess = self.session.verifyDatabasePassword(self.userKey, text1)
                 if databaseAccess == False:
                     QMessageBox.about(
                         self,
@@ -236,9 +485,13 @@ class Notepad(QMainWindow):
                             text_labels.PASSWORDS_DO_NOT_MATCH)                        
                         quit()
                     else:
-                        # create new database
-                        self.userKey = generateUserKey(text1)
-                        databaseAccess = createDatabase(self.userKey, text1)
+                        # create new database, with key derivation tuned for this machine
+                        QApplication.setOverrideCursor(QCursor(Qt.WaitCursor))
+                        kdfParams = calibrateKdf()
+                        self.userKey = generateUserKey(text1, kdfParams)
+                        QApplication.restoreOverrideCursor()
+                        self.session = getDefaultSession()
+                        databaseAccess = self.session.createDatabase(self.userKey, text1, kdfParams)
                         if databaseAccess == False:
                             QMessageBox.about(
                                 self,
@@ -251,39 +504,40 @@ class Notepad(QMainWindow):
                         # create sample book 1
                         book1Name=text_labels.SAMPLE_BOOK_NAME+" 1"
                         book1Text=text_labels.SAMPLE_BOOK_TEXT+" (" + book1Name +")"
-                        bookId1 = createBook(self.userKey, book1Name, book1Text)      
+                        bookId1 = self.session.createBook(self.userKey, book1Name, book1Text)      
                         # create sample page 1 for book 1
                         p1Name = text_labels.SAMPLE_PAGE_NAME+" 1"
                         p1Text = text_labels.SAMPLE_PAGE_TEXT +" (" + p1Name +")"
-                        createPage(self.userKey, bookId1, p1Name, p1Text)
+                        self.session.createPage(self.userKey, bookId1, p1Name, p1Text)
                         # create sample page 2 for book 1
                         p2Name = text_labels.SAMPLE_PAGE_NAME+" 2"
                         p2Text = text_labels.SAMPLE_PAGE_TEXT +" (" + p2Name +")"
-                        createPage(self.userKey, bookId1, p2Name, p2Text)
+                        self.session.createPage(self.userKey, bookId1, p2Name, p2Text)
 
                         # create sample book 2
                         book2Name=text_labels.SAMPLE_BOOK_NAME+" 2"
                         book2Text=text_labels.SAMPLE_BOOK_TEXT+" (" + book2Name +")"
-                        bookId2 = createBook(self.userKey, book2Name, book2Text)      
+                        bookId2 = self.session.createBook(self.userKey, book2Name, book2Text)      
                         # create sample page 1 for book 2
                         p1Name = text_labels.SAMPLE_PAGE_NAME+" 1"
                         p1Text = text_labels.SAMPLE_PAGE_TEXT +" (" + p1Name +")"
-                        createPage(self.userKey, bookId2, p1Name, p1Text)
+                        self.session.createPage(self.userKey, bookId2, p1Name, p1Text)
                         # create sample page 2 for book 2
                         p2Name = text_labels.SAMPLE_PAGE_NAME+" 2"
                         p2Text = text_labels.SAMPLE_PAGE_TEXT +" (" + p2Name +")"
-                        createPage(self.userKey, bookId2, p2Name, p2Text)
+                        self.session.createPage(self.userKey, bookId2, p2Name, p2Text)
                         # create sample page 3 for book 2
                         p3Name = text_labels.SAMPLE_PAGE_NAME+" 3"
                         p3Text = text_labels.SAMPLE_PAGE_TEXT +" (" + p3Name +")"
-                        createPage(self.userKey, bookId2, p3Name, p3Text)                                                                        
+                        self.session.createPage(self.userKey, bookId2, p3Name, p3Text)                                                                        
                 else:
                     quit()
             else:
                 quit()    
 
         # main view
-        self.mainBody = MaiteBody(self.userKey)
+        self.mainBody = MaiteBody(self.userKey, self.session)
+        self.performancePanel = None
         self.setCentralWidget(self.mainBody)
 
         self.setApplicationMenu()
@@ -326,19 +580,43 @@ class Notepad(QMainWindow):
         menuItem_deletePage.setShortcut('Ctrl+H')
         menuItem_deletePage.triggered.connect(self.deletePage)
                
+        menuItem_attachFile = QAction(QIcon('dot.png'), text_labels.MENU_TEXT_ATTACH_FILE, self)
+        menuItem_attachFile.setShortcut('Ctrl+J')
+        menuItem_attachFile.triggered.connect(self.attachFile)
+
+        menuItem_saveAttachment = QAction(QIcon('dot.png'), text_labels.MENU_TEXT_SAVE_ATTACHMENT, self)
+        menuItem_saveAttachment.triggered.connect(self.saveAttachment)
+
         menuPage = menu_bar.addMenu(text_labels.MENU_TEXT_PAGE)
         menuPage.addAction(menuItem_addPage)
         menuPage.addAction(menuItem_deletePage)
+        menuPage.addAction(menuItem_attachFile)
+        menuPage.addAction(menuItem_saveAttachment)
         
         # menu help
         about_act = QAction(text_labels.MENU_TEXT_ABOUT, self)
         about_act.triggered.connect(self.aboutDialog)
 
+        upgradeKdf_act = QAction(text_labels.MENU_TEXT_UPGRADE_KDF, self)
+        upgradeKdf_act.triggered.connect(self.upgradeKdf)
+
+        changePassword_act = QAction(text_labels.MENU_TEXT_CHANGE_PASSWORD, self)
+        changePassword_act.triggered.connect(self.changePassword)
+
+        performance_act = QAction(text_labels.MENU_TEXT_PERFORMANCE, self)
+        performance_act.triggered.connect(self.showPerformance)
+
         menuSystem = menu_bar.addMenu(text_labels.MENU_TEXT_SYSTEM)
+        menuSystem.addAction(changePassword_act)
+        menuSystem.addAction(upgradeKdf_act)
+        menuSystem.addAction(performance_act)
         menuSystem.addAction(about_act)
 
     def saveCurrentTextOnScreen(self):
-        self.mainBody.saveCurrentTextOnScreen()
+        self.mainBody.saveCurrentTextOnScreen(wait=True)
+        self.mainBody.shutdown()
+        # closing the session writes every queued save durably
+        closeDefaultSession()
         quit()
         
     def addBook(self):
@@ -352,7 +630,80 @@ class Notepad(QMainWindow):
     
     def deletePage(self):
         self.mainBody.deletePage()
+
+    def attachFile(self):
+        self.mainBody.attachFile()
+
+    def saveAttachment(self):
+        self.mainBody.saveAttachment()
+
+    def showPerformance(self):
+        """non modal window with the timings of the hot paths, kept while the application runs"""
+        if self.performancePanel is None:
+            self.performancePanel = PerformancePanel(self)
+        self.performancePanel.show()
+        self.performancePanel.raise_()
                
+    def upgradeKdf(self):
+        """
+        Move a vault using the original key derivation to stored, calibrated settings
+        """
+        storage = self.mainBody.storage
+        if not isLegacyKdf(storage.callAndWait(self.session.getKdfParams)):
+            QMessageBox.about(self, text_labels.MESSAGE_BOX_TITLE, text_labels.KDF_ALREADY_CURRENT)
+            return
+        text1, okPressed1 = QInputDialog.getText(self, text_labels.MENU_TEXT_UPGRADE_KDF,text_labels.ENTER_PASSWORD, QLineEdit.Password, "")
+        if not okPressed1 or len(text1) == 0:
+            return
+        if not storage.callAndWait(self.session.verifyDatabasePassword, (self.userKey, text1)):
+            QMessageBox.about(self, text_labels.ERROR_READING_DATA, text_labels.INVALID_PASSWORD)
+            return
+        self.mainBody.saveCurrentTextOnScreen(wait=True)
+        QApplication.setOverrideCursor(QCursor(Qt.WaitCursor))
+        kdfParams = calibrateKdf()
+        newKey = generateUserKey(text1, kdfParams)
+        upgraded = storage.callAndWait(self.session.reencryptVault, (self.userKey, newKey, text1, kdfParams))
+        QApplication.restoreOverrideCursor()
+        if upgraded:
+            self.userKey = newKey
+            self.mainBody.userKey = newKey
+            QMessageBox.about(self, text_labels.MESSAGE_BOX_TITLE, text_labels.KDF_UPGRADE_DONE)
+        else:
+            QMessageBox.about(self, text_labels.ERROR_READING_DATA, text_labels.KDF_UPGRADE_FAILED)
+
+    def changePassword(self):
+        """
+        Encrypt the whole vault again under a new password, in one transaction
+        """
+        storage = self.mainBody.storage
+        text1, okPressed1 = QInputDialog.getText(self, text_labels.MENU_TEXT_CHANGE_PASSWORD,text_labels.ENTER_PASSWORD, QLineEdit.Password, "")
+        if not okPressed1 or len(text1) == 0:
+            return
+        if not storage.callAndWait(self.session.verifyDatabasePassword, (self.userKey, text1)):
+            QMessageBox.about(self, text_labels.ERROR_READING_DATA, text_labels.INVALID_PASSWORD)
+            return
+        text2, okPressed2 = QInputDialog.getText(self, text_labels.MENU_TEXT_CHANGE_PASSWORD,text_labels.DEFINE_PASSWORD, QLineEdit.Password, "")
+        if not okPressed2 or len(text2) == 0:
+            return
+        text3, okPressed3 = QInputDialog.getText(self, text_labels.MENU_TEXT_CHANGE_PASSWORD,text_labels.CONFIRM_PASSWORD, QLineEdit.Password, "")
+        if not okPressed3:
+            return
+        if text2 != text3:
+            QMessageBox.about(self, text_labels.ERROR_READING_DATA, text_labels.PASSWORDS_DO_NOT_MATCH)
+            return
+        self.mainBody.saveCurrentTextOnScreen(wait=True)
+        QApplication.setOverrideCursor(QCursor(Qt.WaitCursor))
+        kdfParams = renewKdfParams(storage.callAndWait(self.session.getKdfParams))
+        newKey = generateUserKey(text2, kdfParams)
+        changed = storage.callAndWait(self.session.reencryptVault, (self.userKey, newKey, text2, kdfParams))
+        QApplication.restoreOverrideCursor()
+        if changed:
+            self.userKey = newKey
+            self.mainBody.userKey = newKey
+            QMessageBox.about(self, text_labels.MESSAGE_BOX_TITLE, text_labels.PASSWORD_CHANGE_DONE)
+        else:
+            QMessageBox.about(self, text_labels.ERROR_READING_DATA, text_labels.PASSWORD_CHANGE_FAILED)
+
     def aboutDialog(self):
         """
         Display information about program dialog box
@@ -368,13 +719,18 @@ class Notepad(QMainWindow):
 
         if reply == QMessageBox.Yes:
             event.accept()
-            self.mainBody.saveCurrentTextOnScreen()
+            self.mainBody.saveCurrentTextOnScreen(wait=True)
+            self.mainBody.shutdown()
+            # closing the session writes every queued save durably
+            closeDefaultSession()
             print('Window closed')
         else:
             event.ignore()
 
 # Run program
 if __name__ == "__main__":
+    # custom url schemes are known to the web engine only if registered first
+    registerAttachmentScheme()
     app = QApplication(sys.argv)
     window = Notepad()
     sys.exit(app.exec_())
@@ -0,0 +1,399 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas_v4
+
+Command line maintenance tools, they do not need the GUI (PySide2)
+
+    python maitenotas_cli.py kdf-info
+    python maitenotas_cli.py upgrade-kdf --target-seconds 0.5
+    python maitenotas_cli.py convert --engine aes-gcm
+    python maitenotas_cli.py change-password
+    python maitenotas_cli.py search --ignore-case "some words"
+    python maitenotas_cli.py search --index --prefix "some wor"
+    python maitenotas_cli.py rebuild-index
+    python maitenotas_cli.py history 12 --show 3
+    python maitenotas_cli.py thin-history
+    python maitenotas_cli.py backup copy.data
+    python maitenotas_cli.py export vault.mbk --mode reencrypted
+    python maitenotas_cli.py export notes --mode markdown
+    python maitenotas_cli.py --database restored.data restore vault.mbk
+    python maitenotas_cli.py import notes
+    python maitenotas_cli.py attachments 12 --add photo.jpg
+    python maitenotas_cli.py attachments 12 --save 3 photo.jpg
+    python maitenotas_cli.py --trace search.json search --index "some words"
+"""
+import argparse
+import getpass
+import sys
+import time
+from os import path
+
+import backup
+import instrumentation
+import markdown_import
+from crypto import (generateUserKey, newKdfParams, renewKdfParams, decryptDataToText, calibrateKdf, isLegacyKdf,
+                    timeKdf, availableKdfAlgorithms, CIPHER_ENGINES, DEFAULT_CIPHER_ENGINE, formatName)
+from storage import StorageSession, DATABASE_NAME
+from search import searchVault, SEARCH_SUBSTRING, SEARCH_REGEX
+from page_history import REVISION_SNAPSHOT
+
+
+def openSession(database: str) -> StorageSession:
+    if not path.exists(database):
+        sys.exit(f"database {database} does not exist")
+    return StorageSession(database)
+
+
+def openVault(database: str):
+    """open the session and ask for the password, return (session, key, password)"""
+    session = openSession(database)
+    password = getpass.getpass("Password: ")
+    user_key = generateUserKey(password, session.getKdfParams())
+    if not session.verifyDatabasePassword(user_key, password):
+        session.close()
+        sys.exit("invalid password")
+    session.nameRecoveredBooks(user_key)
+    return session, user_key, password
+
+
+def describeKdf(kdf_params: dict) -> str:
+    cost = ", ".join(f"{k}={v}" for k, v in sorted(kdf_params.items())
+                     if k not in ("algorithm", "salt"))
+    salt = "password as salt (legacy)" if isLegacyKdf(kdf_params) else "random salt"
+    return f"{kdf_params['algorithm']} ({cost}), {salt}"
+
+
+def commandKdfInfo(args) -> None:
+    session = openSession(args.database)
+    kdf_params = session.getKdfParams()
+    session.close()
+    print(f"key derivation: {describeKdf(kdf_params)}")
+    print(f"unlock time on this machine: {timeKdf(kdf_params):.3f} s")
+
+
+def commandUpgradeKdf(args) -> None:
+    session, user_key, password = openVault(args.database)
+    current = session.getKdfParams()
+    if not isLegacyKdf(current) and not args.force:
+        session.close()
+        print(f"already using {describeKdf(current)}, use --force to change it")
+        return
+    kdf_params = calibrateKdf(args.target_seconds, args.algorithm)
+    print(f"new key derivation: {describeKdf(kdf_params)}")
+    new_key = generateUserKey(password, kdf_params)
+    upgraded = session.reencryptVault(user_key, new_key, password, kdf_params, args.workers)
+    session.close()
+    if not upgraded:
+        sys.exit("upgrade failed, the database was not changed")
+    print("done")
+
+
+def commandChangePassword(args) -> None:
+    session, user_key, _ = openVault(args.database)
+    new_password = askNewPassword("New password")
+    kdf_params = renewKdfParams(session.getKdfParams())
+    new_key = generateUserKey(new_password, kdf_params)
+    start = time.perf_counter()
+
+    def progress(done: int, total: int) -> None:
+        print(f"\r{done}/{total} rows", end="", flush=True)
+
+    changed = session.reencryptVault(user_key, new_key, new_password, kdf_params, args.workers, progress)
+    session.close()
+    print()
+    if not changed:
+        sys.exit("password change failed, the database was not changed")
+    print(f"password changed in {time.perf_counter() - start:.2f} s")
+
+
+def printFormats(session: StorageSession) -> None:
+    for format_byte, (rows, size) in sorted(session.getFormatStatistics().items()):
+        print(f"  {formatName(format_byte):<25} {rows:>8} values {size:>12} bytes")
+
+
+def commandConvert(args) -> None:
+    session, user_key, password = openVault(args.database)
+    print("before:")
+    printFormats(session)
+    converted = session.reencryptVault(user_key, user_key.withEngine(args.engine), password,
+                                       workers=args.workers)
+    if converted:
+        session.vacuum()
+        print("after:")
+        printFormats(session)
+    session.close()
+    if not converted:
+        sys.exit("conversion failed, the database was not changed")
+
+
+def commandSearch(args) -> None:
+    session, user_key, _ = openVault(args.database)
+    start = time.perf_counter()
+    if args.index:
+        found = session.findPages(user_key, args.query, args.prefix)
+        session.close()
+        for book_id, page_id, page_name in found:
+            print(f"book {book_id} page {page_id}: {page_name}")
+        print(f"{len(found)} pages found in {(time.perf_counter() - start) * 1000:.1f} ms",
+              file=sys.stderr)
+        return
+    hits = 0
+    mode = SEARCH_REGEX if args.regex else SEARCH_SUBSTRING
+    for book_id, page_id, snippet in searchVault(session, user_key, args.query, mode,
+                                                 args.ignore_case, args.workers):
+        hits += 1
+        print(f"book {book_id} page {page_id}: {snippet}", flush=True)
+    session.close()
+    print(f"{hits} pages found in {time.perf_counter() - start:.2f} s", file=sys.stderr)
+
+
+def commandRebuildIndex(args) -> None:
+    session, user_key, _ = openVault(args.database)
+    start = time.perf_counter()
+    count = session.rebuildSearchIndex(user_key)
+    session.close()
+    if count < 0:
+        sys.exit("rebuild failed, the index was not changed")
+    print(f"{count} pages indexed in {time.perf_counter() - start:.2f} s")
+
+
+def commandHistory(args) -> None:
+    session, user_key, _ = openVault(args.database)
+    if args.show is not None:
+        text = session.getPageRevision(user_key, args.page_id, args.show)
+        session.close()
+        if text is None:
+            sys.exit(f"page {args.page_id} has no revision {args.show}")
+        sys.stdout.write(text)
+        return
+    history = session.getPageHistory(args.page_id)
+    session.close()
+    for revision, replaced_at, kind, size in history:
+        stored = "snapshot" if kind == REVISION_SNAPSHOT else "delta"
+        print(f"revision {revision:>5}  replaced {time.strftime('%Y-%m-%d %H:%M', time.localtime(replaced_at))}"
+              f"  {stored:<8} {size:>10} bytes")
+    print(f"{len(history)} revisions", file=sys.stderr)
+
+
+def commandThinHistory(args) -> None:
+    session, user_key, _ = openVault(args.database)
+    dropped = session.thinHistory(user_key)
+    if dropped > 0:
+        session.vacuum()
+    session.close()
+    if dropped < 0:
+        sys.exit("thinning failed, the history was not changed")
+    print(f"{dropped} revisions dropped")
+
+
+def askNewPassword(prompt: str) -> str:
+    password = getpass.getpass(f"{prompt}: ")
+    if not password or password != getpass.getpass(f"{prompt} again: "):
+        sys.exit("passwords are empty or do not match")
+    return password
+
+
+def commandBackup(args) -> None:
+    session = openSession(args.database)
+    start = time.perf_counter()
+    backup.hotBackup(session, args.destination)
+    session.close()
+    print(f"copied to {args.destination} in {time.perf_counter() - start:.2f} s")
+
+
+def commandExport(args) -> None:
+    start = time.perf_counter()
+    if args.mode == backup.MODE_RAW:
+        session = openSession(args.database)
+        counts = backup.exportArchive(session, args.destination, workers=args.workers)
+    elif args.mode == backup.MODE_REENCRYPTED:
+        session, user_key, _ = openVault(args.database)
+        backup_password = askNewPassword("Backup password")
+        backup_kdf = newKdfParams()
+        backup_key = generateUserKey(backup_password, backup_kdf)
+        counts = backup.exportArchive(session, args.destination, args.mode, user_key, backup_key,
+                                      backup_password, backup_kdf, args.workers)
+    else:
+        session, user_key, _ = openVault(args.database)
+        counts = backup.exportMarkdown(session, user_key, args.destination, args.workers)
+    session.close()
+    print(f"{counts['books']} books and {counts['pages']} pages exported in "
+          f"{time.perf_counter() - start:.2f} s")
+
+
+def commandRestore(args) -> None:
+    header = backup.readArchiveHeader(args.archive)
+    if header["mode"] == backup.MODE_RAW:
+        # the vault comes back as it was, with its password and key derivation
+        password = getpass.getpass("Password of the backed up vault: ")
+        archive_key = generateUserKey(password, header["kdf"])
+        vault_key, vault_password, kdf_params = archive_key, password, header["kdf"]
+    else:
+        password = getpass.getpass("Backup password: ")
+        archive_key = generateUserKey(password, header["kdf"])
+        vault_password = askNewPassword("Password of the restored vault")
+        kdf_params = newKdfParams()
+        vault_key = generateUserKey(vault_password, kdf_params)
+    try:
+        if decryptDataToText(header["verifier"], archive_key) != password:
+            raise ValueError
+    except Exception:
+        sys.exit("invalid password")
+    start = time.perf_counter()
+    try:
+        counts = backup.restoreArchive(args.archive, args.database, archive_key, vault_key,
+                                       vault_password, kdf_params, args.workers)
+    except (ValueError, FileExistsError) as error:
+        sys.exit(f"restore failed: {error}")
+    print(f"{counts['books']} books and {counts['pages']} pages restored to {args.database} in "
+          f"{time.perf_counter() - start:.2f} s")
+
+
+def commandImport(args) -> None:
+    session, user_key, _ = openVault(args.database)
+    start = time.perf_counter()
+
+    def progress(done: int, total: int) -> None:
+        elapsed = time.perf_counter() - start
+        rate = done / elapsed if elapsed > 0 else 0
+        print(f"\r{done}/{total} pages, {rate:.0f} pages/s", end="", flush=True)
+
+    try:
+        counts = markdown_import.importMarkdown(session, user_key, args.directory, args.workers, progress)
+    except (OSError, ValueError) as error:
+        session.close()
+        sys.exit(f"\nimport failed: {error}")
+    session.close()
+    elapsed = time.perf_counter() - start
+    print(f"\n{counts['books']} books and {counts['pages']} pages imported in {elapsed:.2f} s")
+
+
+def commandAttachments(args) -> None:
+    session, user_key, _ = openVault(args.database)
+    if args.add is not None:
+        attachment_id = session.addAttachment(user_key, args.page_id, args.add)
+        session.close()
+        if not attachment_id:
+            sys.exit(f"{args.add} could not be attached to page {args.page_id}")
+        print(f"attachment {attachment_id} added")
+        return
+    if args.save is not None:
+        attachment_id, destination = args.save
+        saved = session.exportAttachment(user_key, int(attachment_id), destination)
+        session.close()
+        if not saved:
+            sys.exit(f"attachment {attachment_id} could not be saved")
+        return
+    if args.delete is not None:
+        deleted = session.deleteAttachment(args.delete)
+        session.close()
+        if not deleted:
+            sys.exit(f"attachment {args.delete} could not be deleted")
+        return
+    files = session.getAttachmentsOfPage(user_key, args.page_id)
+    session.close()
+    for attachment_id, file_name, mime_type, size, added_at in files:
+        print(f"{attachment_id:>6}  {time.strftime('%Y-%m-%d %H:%M', time.localtime(added_at))}"
+              f"  {size:>12} bytes  {mime_type:<24} {file_name}")
+    print(f"{len(files)} attachments", file=sys.stderr)
+
+
+def buildParser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Maitenotas maintenance tools")
+    parser.add_argument("--database", default=DATABASE_NAME, help="vault file")
+    parser.add_argument("--trace", metavar="FILE",
+                        help="time storage and crypto calls, write them to FILE (chrome://tracing, Perfetto)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    kdf_info = commands.add_parser("kdf-info", help="show key derivation settings and unlock time")
+    kdf_info.set_defaults(run=commandKdfInfo)
+
+    upgrade = commands.add_parser("upgrade-kdf",
+                                  help="encrypt the vault again with calibrated key derivation")
+    upgrade.add_argument("--algorithm", choices=availableKdfAlgorithms())
+    upgrade.add_argument("--target-seconds", type=float, default=0.5,
+                         help="unlock time to aim for on this machine")
+    upgrade.add_argument("--force", action="store_true",
+                         help="recalibrate even if the vault is not using legacy settings")
+    upgrade.add_argument("--workers", type=int, help="worker processes, 0 works in this process")
+    upgrade.set_defaults(run=commandUpgradeKdf)
+
+    convert = commands.add_parser("convert", help="encrypt every row again with one cipher engine")
+    convert.add_argument("--engine", choices=sorted(CIPHER_ENGINES), default=DEFAULT_CIPHER_ENGINE)
+    convert.add_argument("--workers", type=int, help="worker processes, 0 works in this process")
+    convert.set_defaults(run=commandConvert)
+
+    change = commands.add_parser("change-password", help="encrypt every row again under a new password")
+    change.add_argument("--workers", type=int, help="worker processes, 0 works in this process")
+    change.set_defaults(run=commandChangePassword)
+
+    search = commands.add_parser("search", help="search the text of every page")
+    search.add_argument("query")
+    search.add_argument("--regex", action="store_true", help="query is a regular expression")
+    search.add_argument("--ignore-case", action="store_true")
+    search.add_argument("--workers", type=int, help="worker processes, 0 searches in this process")
+    search.add_argument("--index", action="store_true",
+                        help="look up whole words in the search index instead of reading every page")
+    search.add_argument("--prefix", action="store_true",
+                        help="with --index, words also match longer words they start")
+    search.set_defaults(run=commandSearch)
+
+    rebuild = commands.add_parser("rebuild-index", help="build the search index again from every page")
+    rebuild.set_defaults(run=commandRebuildIndex)
+
+    history = commands.add_parser("history", help="list the older versions of a page")
+    history.add_argument("page_id", type=int)
+    history.add_argument("--show", type=int, metavar="REVISION", help="print the text of a revision")
+    history.set_defaults(run=commandHistory)
+
+    thin = commands.add_parser("thin-history", help="drop old revisions the retention policy does not keep")
+    thin.set_defaults(run=commandThinHistory)
+
+    hot = commands.add_parser("backup", help="copy the vault file, also while the application is open")
+    hot.add_argument("destination")
+    hot.set_defaults(run=commandBackup)
+
+    export = commands.add_parser("export", help="write the vault as an archive or a markdown tree")
+    export.add_argument("destination", help="archive file, or folder with --mode markdown")
+    export.add_argument("--mode", choices=[*backup.ARCHIVE_MODES, "markdown"], default=backup.MODE_RAW,
+                        help="raw: rows as stored (vault password), reencrypted: under a backup "
+                             "password, markdown: decrypted files")
+    export.add_argument("--workers", type=int, help="worker processes, 0 works in this process")
+    export.set_defaults(run=commandExport)
+
+    restore = commands.add_parser("restore", help="create the --database vault from an archive")
+    restore.add_argument("archive")
+    restore.add_argument("--workers", type=int, help="worker processes, 0 works in this process")
+    restore.set_defaults(run=commandRestore)
+
+    importing = commands.add_parser("import", help="add a folder of markdown files as books and pages")
+    importing.add_argument("directory", help="one folder per book, one .md file per page")
+    importing.add_argument("--workers", type=int, help="worker processes, 0 works in this process")
+    importing.set_defaults(run=commandImport)
+
+    attached = commands.add_parser("attachments", help="list, add, save or delete the files of a page")
+    attached.add_argument("page_id", type=int)
+    actions = attached.add_mutually_exclusive_group()
+    actions.add_argument("--add", metavar="FILE", help="attach a file to the page")
+    actions.add_argument("--save", nargs=2, metavar=("ID", "DESTINATION"), help="write an attachment to a file")
+    actions.add_argument("--delete", type=int, metavar="ID", help="delete an attachment")
+    attached.set_defaults(run=commandAttachments)
+    return parser
+
+
+def main(argv=None) -> None:
+    args = buildParser().parse_args(argv)
+    if not args.trace:
+        args.run(args)
+        return
+    instrumentation.setEnabled(True)
+    try:
+        args.run(args)
+    finally:
+        events = instrumentation.exportTrace(args.trace)
+        print(f"{events} trace events written to {args.trace}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas_v4
+
+Bulk import of a directory of markdown files, the layout written by
+backup.exportMarkdown:
+
+  directory/Book name/_book.md      text of the book (optional)
+  directory/Book name/Page name.md  one page per file, files in sub folders
+                                    become pages named "sub folder/Page name"
+  directory/Page name.md            pages of a book named after the directory
+
+Files are read and encrypted in worker processes, a batch at a time, and pages
+are written with executemany, IMPORT_COMMIT_ROWS per transaction. A failed
+import keeps the pages of the transactions committed before the failure.
+"""
+import os
+from typing import Callable, Iterator, List, Optional, Tuple
+
+from backup import MARKDOWN_BOOK_FILE, SQL_RESTORE_PAGE
+from crypto import UserKey, encryptTextToData
+import page_chunks
+from search_index import tokenize
+import storage
+from storage import StorageSession, SQL_INSERT_BOOK
+from worker_pool import batched, mapBatches
+
+MARKDOWN_EXTENSIONS = (".md", ".markdown", ".txt")
+IMPORT_BATCH_SIZE = 128  # files sent to a worker at once
+IMPORT_COMMIT_ROWS = 5000  # pages written per transaction
+PARALLEL_MIN_FILES = 500  # fewer files are imported in this process
+
+# ids of deleted pages are never reused, postings of the search index may still
+# name them. Rows inserted with these ids move sqlite_sequence past them.
+SQL_NEXT_PAGE_ID = """
+select max(coalesce((select max(id) from page), 0),
+           coalesce((select seq from sqlite_sequence where name='page'), 0)) + 1"""
+
+
+# ***************** reading the directory
+def isMarkdownFile(name: str) -> bool:
+    return name.lower().endswith(MARKDOWN_EXTENSIONS) and not name.startswith(".")
+
+
+def pageName(relative_path: str) -> str:
+    """page name of a file path relative to its book folder"""
+    name = os.path.splitext(relative_path)[0]
+    return name.replace(os.sep, "/")
+
+
+def bookPages(folder: str) -> List[Tuple[str, str]]:
+    """(page name, path) of every markdown file under a book folder, sorted by name"""
+    pages = []
+    for root, directories, files in os.walk(folder):
+        directories[:] = sorted(d for d in directories if not d.startswith("."))
+        for file_name in files:
+            if not isMarkdownFile(file_name):
+                continue
+            if root == folder and file_name == MARKDOWN_BOOK_FILE:
+                continue
+            path = os.path.join(root, file_name)
+            pages.append((pageName(os.path.relpath(path, folder)), path))
+    pages.sort()
+    return pages
+
+
+def scanDirectory(directory: str) -> List[Tuple[str, Optional[str], List[Tuple[str, str]]]]:
+    """(book name, path of the book text or None, pages) of every book to import"""
+    directory = os.path.abspath(directory)
+    if not os.path.isdir(directory):
+        raise NotADirectoryError(f"{directory} is not a directory")
+    books = []
+    loose_pages = []
+    for entry in sorted(os.scandir(directory), key=lambda e: e.name):
+        if entry.name.startswith("."):
+            continue
+        if entry.is_dir():
+            book_file = os.path.join(entry.path, MARKDOWN_BOOK_FILE)
+            books.append((entry.name, book_file if os.path.isfile(book_file) else None, bookPages(entry.path)))
+        elif entry.is_file() and isMarkdownFile(entry.name):
+            loose_pages.append((pageName(entry.name), entry.path))
+    if loose_pages:
+        books.insert(0, (os.path.basename(directory), None, loose_pages))
+    return books
+
+
+def readMarkdownFile(path: str) -> str:
+    with open(path, "r", encoding="utf-8", errors="replace") as source:
+        return source.read()
+
+
+# state of a worker process, set once by initImportWorker
+_workerKey: Optional[UserKey] = None
+_workerChunkedSize: Optional[int] = None
+_workerCompress = True
+
+def initImportWorker(user_key: UserKey, chunked_size: Optional[int], compress: bool) -> None:
+    global _workerKey, _workerChunkedSize, _workerCompress
+    _workerKey = user_key
+    _workerChunkedSize = chunked_size
+    _workerCompress = compress
+
+
+def importBatch(rows: list) -> list:
+    """(page_id, book_id, name, path) rows read and encrypted:
+    (page_id, book_id, name, text, plain, tokens) where text is None and plain the
+    file text for a page big enough to be stored in chunks (plain is None otherwise)"""
+    imported = []
+    for page_id, book_id, name, path in rows:
+        text = readMarkdownFile(path)
+        encrypted_name = encryptTextToData(name, _workerKey)
+        tokens = tokenize(text)
+        if _workerChunkedSize is not None and len(text) >= _workerChunkedSize:
+            imported.append((page_id, book_id, encrypted_name, None, text, tokens))
+        else:
+            imported.append((page_id, book_id, encrypted_name,
+                             encryptTextToData(text, _workerKey, _workerCompress), None, tokens))
+    return imported
+
+
+# ***************** import
+def importMarkdown(session: StorageSession, user_key: UserKey, directory: str,
+                   workers: Optional[int] = None,
+                   progress: Optional[Callable[[int, int], None]] = None) -> dict:
+    """Add the books and pages of a markdown directory to the vault, return the
+    counts of books and pages. progress(pages done, pages total) is called after
+    every batch."""
+    books = scanDirectory(directory)
+    total = sum(len(pages) for _, _, pages in books)
+    if workers is None:
+        workers = os.cpu_count() or 1
+        if workers < 2 or total < PARALLEL_MIN_FILES:
+            workers = 0
+    counts = {"books": 0, "pages": 0}
+    session.flushPendingWrites()
+    with session.lock:
+        conn = session.conn
+        try:
+            book_ids = []
+            for name, book_file, _ in books:
+                text = readMarkdownFile(book_file) if book_file else ""
+                cur = conn.execute(SQL_INSERT_BOOK, (encryptTextToData(name, user_key),
+                                                     encryptTextToData(text, user_key, session.compress_bodies)))
+                book_ids.append(cur.lastrowid)
+                counts["books"] += 1
+            # pages get their ids here, so executemany can write them and the index can use them
+            next_page_id = conn.execute(SQL_NEXT_PAGE_ID).fetchone()[0]
+
+            def pageRows() -> Iterator[tuple]:
+                page_id = next_page_id
+                for book_id, (_, _, pages) in zip(book_ids, books):
+                    for name, path in pages:
+                        yield page_id, book_id, name, path
+                        page_id += 1
+
+            batches = mapBatches(batched(pageRows(), IMPORT_BATCH_SIZE), importBatch, workers, initImportWorker,
+                                 (user_key, session.chunked_page_size, session.compress_bodies))
+            # indexed once per transaction, every touched posting list is written once
+            unindexed = []
+            for batch in batches:
+                conn.executemany(SQL_RESTORE_PAGE, [(page_id, book_id, name, text if text is not None else b"")
+                                                    for page_id, book_id, name, text, _, _ in batch])
+                for page_id, _, _, _, plain, _ in batch:
+                    if plain is not None:
+                        session.chunksWritten += page_chunks.writeChunkedText(conn, user_key, page_id, plain,
+                                                                              session.compress_bodies)
+                        conn.execute(storage.SQL_SET_PAGE_CHUNKED, (page_id,))
+                unindexed.extend((row[0], row[5]) for row in batch)
+                counts["pages"] += len(batch)
+                if len(unindexed) >= IMPORT_COMMIT_ROWS:
+                    session.searchIndex.indexTokenizedPages(conn, user_key, unindexed)
+                    unindexed.clear()
+                    conn.commit()
+                if progress is not None:
+                    progress(counts["pages"], total)
+            session.searchIndex.indexTokenizedPages(conn, user_key, unindexed)
+            conn.commit()
+        except:
+            conn.rollback()
+            session.searchIndex.clear()
+            raise
+        finally:
+            # listings and names cached before the import miss the new rows
+            session.titleCache.clear()
+    return counts
+
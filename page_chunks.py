@@ -0,0 +1,150 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas_v4
+
+Chunked storage of big page texts: the text is cut in content defined chunks that
+are encrypted one by one and stored once, a page keeps the ordered list of its
+chunk ids. Editing a page writes only the chunks that changed.
+
+Tables (created by the storage schema migrations):
+  chunk       keyed HMAC of the chunk text -> encrypted chunk text
+  page_chunk  page id, position -> chunk id
+
+page.page_layout tells how page_text is stored (PAGE_LAYOUT_*). The functions
+here run inside the caller's transaction and never commit.
+"""
+import hashlib
+import hmac
+import sqlite3
+import zlib
+from typing import Iterable, List, Set
+
+from crypto import UserKey, encryptTextToData, decryptDataToText
+
+PAGE_LAYOUT_INLINE = 0  # page_text holds the encrypted text
+PAGE_LAYOUT_CHUNKED = 1  # page_text is empty, the text is in page_chunk/chunk
+
+CHUNK_MIN_CHARS = 4 * 1024
+CHUNK_MAX_CHARS = 64 * 1024
+CHUNK_BOUNDARY_MASK = 0xFF  # a line ends a chunk when its CRC has these bits clear
+
+SQL_ADD_PAGE_LAYOUT = "ALTER TABLE page ADD COLUMN page_layout integer NOT NULL DEFAULT 0"
+
+SQL_CREATE_CHUNK_TABLE = """
+CREATE TABLE IF NOT EXISTS chunk (
+    id blob PRIMARY KEY,
+    data blob NOT NULL
+) WITHOUT ROWID; """
+
+SQL_CREATE_PAGE_CHUNK_TABLE = """
+CREATE TABLE IF NOT EXISTS page_chunk (
+    page_id integer NOT NULL REFERENCES page(id) ON DELETE CASCADE,
+    seq integer NOT NULL,
+    chunk_id blob NOT NULL REFERENCES chunk(id) ON UPDATE CASCADE,
+    PRIMARY KEY (page_id, seq)
+) WITHOUT ROWID; """
+
+SQL_CREATE_PAGE_CHUNK_INDEX = "CREATE INDEX IF NOT EXISTS page_chunk_chunk_id ON page_chunk(chunk_id)"
+
+SQL_READ_CHUNKS_OF_PAGE = """
+select chunk.data from page_chunk join chunk on chunk.id = page_chunk.chunk_id
+where page_chunk.page_id = ? order by page_chunk.seq"""
+SQL_READ_MANIFEST = "select chunk_id from page_chunk where page_id=? order by seq"
+SQL_CHUNK_EXISTS = "select 1 from chunk where id=?"
+SQL_INSERT_CHUNK = "insert or ignore into chunk(id, data) values(?,?)"
+SQL_INSERT_MANIFEST = "insert into page_chunk(page_id, seq, chunk_id) values(?,?,?)"
+SQL_UPDATE_MANIFEST = "update page_chunk set chunk_id=? where page_id=? and seq=?"
+SQL_TRIM_MANIFEST = "delete from page_chunk where page_id=? and seq>=?"
+SQL_DELETE_UNUSED_CHUNK = """
+delete from chunk where id=? and not exists (select 1 from page_chunk where chunk_id=?)"""
+SQL_CHUNKS_OF_BOOK = """
+select distinct chunk_id from page_chunk
+where page_id in (select id from page where book_id=?)"""
+SQL_DELETE_ALL_UNUSED_CHUNKS = """
+delete from chunk where not exists (select 1 from page_chunk where chunk_id=chunk.id)"""
+
+
+def chunkText(text: str) -> List[str]:
+    """Cut text in chunks at line ends chosen by the content of the lines, so an
+    edit only changes the chunk it falls in (and the chunks around it stay equal).
+    Chunks are CHUNK_MIN_CHARS..CHUNK_MAX_CHARS long, except the last one."""
+    chunks = []
+    current = []
+    size = 0
+    for line in text.splitlines(keepends=True):
+        while len(line) > CHUNK_MAX_CHARS - size:
+            # a very long line is cut at the size limit
+            cut = CHUNK_MAX_CHARS - size
+            current.append(line[:cut])
+            chunks.append("".join(current))
+            current = []
+            size = 0
+            line = line[cut:]
+        current.append(line)
+        size += len(line)
+        if size >= CHUNK_MIN_CHARS and zlib.crc32(line.encode("utf-8", "surrogatepass")) & CHUNK_BOUNDARY_MASK == 0:
+            chunks.append("".join(current))
+            current = []
+            size = 0
+    if current or not chunks:
+        chunks.append("".join(current))
+    return chunks
+
+
+def chunkId(user_key: UserKey, chunk: str) -> bytes:
+    """content address of a chunk, keyed so equal chunks can be found but not guessed"""
+    return hmac.new(user_key.subkey("chunk id"), chunk.encode("utf-8", "surrogatepass"),
+                    hashlib.sha256).digest()
+
+
+def readManifest(conn: sqlite3.Connection, page_id: int) -> List[bytes]:
+    return [row[0] for row in conn.execute(SQL_READ_MANIFEST, (page_id,))]
+
+
+def readChunkedText(conn: sqlite3.Connection, user_key: UserKey, page_id: int) -> str:
+    return "".join(decryptDataToText(row[0], user_key)
+                   for row in conn.execute(SQL_READ_CHUNKS_OF_PAGE, (page_id,)))
+
+
+def writeChunkedText(conn: sqlite3.Connection, user_key: UserKey, page_id: int, text: str,
+                     compress: bool = False) -> int:
+    """store text as the chunks of a page, return the number of chunks encrypted.
+    Chunks already stored (by this page or another one) are reused, chunks the
+    page stops using are deleted unless another page uses them."""
+    chunks = chunkText(text)
+    new_ids = [chunkId(user_key, chunk) for chunk in chunks]
+    old_ids = readManifest(conn, page_id)
+    written = 0
+    for chunk_id, chunk in zip(new_ids, chunks):
+        if conn.execute(SQL_CHUNK_EXISTS, (chunk_id,)).fetchone() is None:
+            conn.execute(SQL_INSERT_CHUNK, (chunk_id, encryptTextToData(chunk, user_key, compress)))
+            written += 1
+    # only positions that changed are written, chunks after an edit keep their place
+    conn.executemany(SQL_UPDATE_MANIFEST,
+                     [(new_id, page_id, seq) for seq, (old_id, new_id) in enumerate(zip(old_ids, new_ids))
+                      if old_id != new_id])
+    if len(new_ids) > len(old_ids):
+        conn.executemany(SQL_INSERT_MANIFEST, [(page_id, seq, new_ids[seq])
+                                               for seq in range(len(old_ids), len(new_ids))])
+    elif len(new_ids) < len(old_ids):
+        conn.execute(SQL_TRIM_MANIFEST, (page_id, len(new_ids)))
+    deleteUnusedChunks(conn, set(old_ids).difference(new_ids))
+    return written
+
+
+def removeChunkedText(conn: sqlite3.Connection, page_id: int) -> None:
+    """drop the chunks of a page that is now stored inline"""
+    old_ids = readManifest(conn, page_id)
+    if old_ids:
+        conn.execute(SQL_TRIM_MANIFEST, (page_id, 0))
+        deleteUnusedChunks(conn, old_ids)
+
+
+def deleteUnusedChunks(conn: sqlite3.Connection, chunk_ids: Iterable[bytes]) -> None:
+    """delete the given chunks if no page refers to them any more"""
+    conn.executemany(SQL_DELETE_UNUSED_CHUNK, [(chunk_id, chunk_id) for chunk_id in set(chunk_ids)])
+
+
+def chunksOfBook(conn: sqlite3.Connection, book_id: int) -> Set[bytes]:
+    return {row[0] for row in conn.execute(SQL_CHUNKS_OF_BOOK, (book_id,))}
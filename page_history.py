@@ -0,0 +1,232 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas_v4
+
+Revision history of page texts. The current text stays in the page table; every
+older version is a row of page_revision holding either an encrypted full text
+(snapshot) or an encrypted line delta that rebuilds it from the next newer
+version (the current text for the newest revision). Deltas point to newer
+versions, so adding a revision never touches older ones, and a snapshot every
+HISTORY_MAX_CHAIN revisions bounds the work to rebuild any version.
+
+The functions here run inside the caller's transaction and never commit.
+"""
+import difflib
+import json
+import sqlite3
+from typing import Callable, List, Optional, Set, Tuple
+
+from crypto import UserKey, encryptTextToData, decryptDataToText
+
+REVISION_SNAPSHOT = 0
+REVISION_DELTA = 1
+
+HISTORY_MAX_CHAIN = 32  # at most this many deltas are applied to rebuild a version
+HISTORY_COALESCE_SECONDS = 300  # a version replaced sooner than this after the previous one is not kept
+HISTORY_THIN_EVERY = 32  # retention is applied to a page every this many revisions
+HISTORY_KEEP_ALL_SECONDS = 2 * 86400  # every revision of the last two days is kept
+HISTORY_KEEP_DAILY_DAYS = 90  # then one per day, older ones are dropped
+HISTORY_MAX_REVISIONS = 500  # per page
+DIFF_MAX_LINES = 20000  # bigger changed regions are stored as inserted text without diffing
+
+SQL_CREATE_REVISION_TABLE = """
+CREATE TABLE IF NOT EXISTS page_revision (
+    page_id integer NOT NULL REFERENCES page(id) ON DELETE CASCADE,
+    revision integer NOT NULL,
+    replaced_at real NOT NULL,
+    kind integer NOT NULL,
+    data blob NOT NULL,
+    PRIMARY KEY (page_id, revision)
+) WITHOUT ROWID; """
+
+SQL_READ_NEWEST = """
+select revision, replaced_at, kind, data from page_revision
+where page_id=? order by revision desc limit 1"""
+SQL_READ_TOP_RUN = """
+select kind, length(data) from page_revision
+where page_id=? order by revision desc limit ?"""
+SQL_INSERT_REVISION = """
+insert into page_revision(page_id, revision, replaced_at, kind, data) values(?,?,?,?,?)"""
+SQL_UPDATE_REVISION = "update page_revision set kind=?, data=? where page_id=? and revision=?"
+SQL_DELETE_REVISION = "delete from page_revision where page_id=? and revision=?"
+SQL_LIST_REVISIONS = """
+select revision, replaced_at, kind, length(data) from page_revision
+where page_id=? order by revision"""
+SQL_READ_FROM_REVISION = """
+select revision, kind, data from page_revision
+where page_id=? and revision>=? order by revision"""
+SQL_READ_ALL_DESC = """
+select revision, replaced_at, kind, data from page_revision
+where page_id=? order by revision desc"""
+
+
+# ***************** line deltas
+def lineDelta(base: str, target: str) -> list:
+    """Operations rebuilding target from base: [start, end] copies lines of base,
+    a string is inserted as it is."""
+    a = base.splitlines(keepends=True)
+    b = target.splitlines(keepends=True)
+    # most edits touch a small part of a page, the common ends are not diffed
+    limit = min(len(a), len(b))
+    prefix = 0
+    while prefix < limit and a[prefix] == b[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < limit - prefix and a[len(a) - 1 - suffix] == b[len(b) - 1 - suffix]:
+        suffix += 1
+    middle_a = a[prefix:len(a) - suffix]
+    middle_b = b[prefix:len(b) - suffix]
+    ops = []
+    if prefix:
+        ops.append([0, prefix])
+    if max(len(middle_a), len(middle_b)) > DIFF_MAX_LINES:
+        if middle_b:
+            ops.append("".join(middle_b))
+    else:
+        matcher = difflib.SequenceMatcher(None, middle_a, middle_b, autojunk=False)
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == "equal":
+                ops.append([prefix + i1, prefix + i2])
+            elif j2 > j1:
+                ops.append("".join(middle_b[j1:j2]))
+    if suffix:
+        ops.append([len(a) - suffix, len(a)])
+    return ops
+
+
+def applyDelta(base: str, ops: list) -> str:
+    lines = base.splitlines(keepends=True)
+    parts = []
+    for op in ops:
+        if isinstance(op, list):
+            parts.extend(lines[op[0]:op[1]])
+        else:
+            parts.append(op)
+    return "".join(parts)
+
+
+def encodeDelta(base: str, target: str) -> str:
+    return json.dumps(lineDelta(base, target), ensure_ascii=False, separators=(",", ":"))
+
+
+def revisionText(user_key: UserKey, kind: int, data: bytes, newer_text: Optional[str]) -> str:
+    """text of a stored revision, newer_text is the text of the next newer version"""
+    stored = decryptDataToText(data, user_key)
+    if kind == REVISION_SNAPSHOT:
+        return stored
+    return applyDelta(newer_text, json.loads(stored))
+
+
+# ***************** recording
+def recordRevision(conn: sqlite3.Connection, user_key: UserKey, page_id: int, old_text: str,
+                   new_text: str, now: float, compress: bool = False) -> Optional[int]:
+    """Keep old_text, the text new_text replaces, as a revision of the page. Return
+    the revision number, None when the old text was merged into the newest
+    revision instead (it lived less than HISTORY_COALESCE_SECONDS)."""
+    newest = conn.execute(SQL_READ_NEWEST, (page_id,)).fetchone()
+    if newest is not None and now - newest[1] < HISTORY_COALESCE_SECONDS:
+        revision, _, kind, data = newest
+        if kind == REVISION_DELTA:
+            # its delta was made against old_text, it now has to start from new_text
+            text = revisionText(user_key, kind, data, old_text)
+            conn.execute(SQL_UPDATE_REVISION,
+                         (REVISION_DELTA, encryptTextToData(encodeDelta(new_text, text), user_key, compress),
+                          page_id, revision))
+        return None
+    revision = newest[0] + 1 if newest is not None else 1
+    # deltas on top of the newest snapshot make every older delta's chain longer
+    run = 0
+    run_bytes = 0
+    for kind, size in conn.execute(SQL_READ_TOP_RUN, (page_id, HISTORY_MAX_CHAIN)):
+        if kind == REVISION_SNAPSHOT:
+            break
+        run += 1
+        run_bytes += size
+    delta = encodeDelta(new_text, old_text)
+    if newest is None or run + 1 >= HISTORY_MAX_CHAIN or run_bytes + len(delta) >= len(old_text):
+        kind, stored = REVISION_SNAPSHOT, old_text
+    else:
+        kind, stored = REVISION_DELTA, delta
+    conn.execute(SQL_INSERT_REVISION, (page_id, revision, now, kind,
+                                       encryptTextToData(stored, user_key, compress)))
+    if revision % HISTORY_THIN_EVERY == 0:
+        thinRevisions(conn, user_key, page_id, new_text, now, compress)
+    return revision
+
+
+# ***************** reading
+def listRevisions(conn: sqlite3.Connection, page_id: int) -> List[Tuple[int, float, int, int]]:
+    """(revision, replaced_at, kind, stored bytes) of every revision, oldest first"""
+    return conn.execute(SQL_LIST_REVISIONS, (page_id,)).fetchall()
+
+
+def readRevision(conn: sqlite3.Connection, user_key: UserKey, page_id: int, revision: int,
+                 readCurrent: Callable[[], str]) -> Optional[str]:
+    """text of a revision, rebuilt from the nearest newer snapshot (or from the
+    current text, read with readCurrent, when there is none)"""
+    chain = []
+    for row in conn.execute(SQL_READ_FROM_REVISION, (page_id, revision)):
+        if not chain and row[0] != revision:
+            return None
+        chain.append(row)
+        if row[1] == REVISION_SNAPSHOT:
+            break
+    if not chain:
+        return None
+    text = None if chain[-1][1] == REVISION_SNAPSHOT else readCurrent()
+    for _, kind, data in reversed(chain):
+        text = revisionText(user_key, kind, data, text)
+    return text
+
+
+# ***************** retention
+def revisionsToKeep(revisions: List[Tuple[int, float]], now: float) -> Set[int]:
+    """revisions of the last HISTORY_KEEP_ALL_SECONDS, then the newest one of each
+    day up to HISTORY_KEEP_DAILY_DAYS, at most HISTORY_MAX_REVISIONS"""
+    keep = []
+    days = set()
+    for revision, replaced_at in sorted(revisions, reverse=True):
+        age = now - replaced_at
+        if age <= HISTORY_KEEP_ALL_SECONDS:
+            keep.append(revision)
+        elif age <= HISTORY_KEEP_DAILY_DAYS * 86400:
+            day = int(replaced_at // 86400)
+            if day not in days:
+                days.add(day)
+                keep.append(revision)
+    return set(keep[:HISTORY_MAX_REVISIONS])
+
+
+def thinRevisions(conn: sqlite3.Connection, user_key: UserKey, page_id: int, current_text: str,
+                  now: float, compress: bool = False) -> int:
+    """drop revisions the retention policy does not keep, return how many.
+    Kept deltas whose newer neighbour is dropped are made again against the next
+    kept version."""
+    rows = conn.execute(SQL_READ_ALL_DESC, (page_id,)).fetchall()
+    keep = revisionsToKeep([(row[0], row[1]) for row in rows], now)
+    if len(keep) == len(rows):
+        return 0
+    newer_text = current_text  # text of the next newer stored version
+    kept_text = current_text  # text of the next newer kept version
+    base_changed = False
+    run = 0
+    for revision, _, kind, data in rows:
+        text = revisionText(user_key, kind, data, newer_text)
+        if revision not in keep:
+            conn.execute(SQL_DELETE_REVISION, (page_id, revision))
+            base_changed = True
+        else:
+            run = 0 if kind == REVISION_SNAPSHOT else run + 1
+            if kind == REVISION_DELTA and run >= HISTORY_MAX_CHAIN:
+                conn.execute(SQL_UPDATE_REVISION, (REVISION_SNAPSHOT, encryptTextToData(text, user_key, compress),
+                                                   page_id, revision))
+                run = 0
+            elif kind == REVISION_DELTA and base_changed:
+                conn.execute(SQL_UPDATE_REVISION,
+                             (REVISION_DELTA, encryptTextToData(encodeDelta(kept_text, text), user_key, compress),
+                              page_id, revision))
+            kept_text = text
+            base_changed = False
+        newer_text = text
+    return len(rows) - len(keep)
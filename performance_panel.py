@@ -0,0 +1,103 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas_v4
+
+Window of the System menu showing the spans and counters recorded by
+instrumentation, refreshed every second. Opening it starts the recording. """
+from PySide2.QtCore import QTimer
+from PySide2.QtWidgets import QCheckBox, QDialog, QFileDialog, QHBoxLayout, QLabel, QMessageBox, QPushButton, \
+    QTableWidget, QTableWidgetItem, QVBoxLayout, QHeaderView
+
+import instrumentation
+import text_labels
+
+REFRESH_MS = 1000
+SPAN_COLUMNS = [("name", "Span"), ("count", "Calls"), ("totalMs", "Total ms"), ("selfMs", "Self ms"),
+                ("meanMs", "Mean ms"), ("p50Ms", "p50 ms"), ("p95Ms", "p95 ms"), ("maxMs", "Max ms")]
+COUNTER_COLUMNS = [("name", "Counter"), ("events", "Events"), ("total", "Total")]
+
+
+def fillTable(table: QTableWidget, columns: list, rows: list) -> None:
+    table.setRowCount(len(rows))
+    for row, values in enumerate(rows):
+        for column, (key, _) in enumerate(columns):
+            value = values[key]
+            table.setItem(row, column, QTableWidgetItem(f"{value:.2f}" if isinstance(value, float) else str(value)))
+
+
+def createTable(columns: list) -> QTableWidget:
+    table = QTableWidget(0, len(columns))
+    table.setHorizontalHeaderLabels([title for _, title in columns])
+    table.setEditTriggers(QTableWidget.NoEditTriggers)
+    table.verticalHeader().setVisible(False)
+    table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+    return table
+
+
+class PerformancePanel(QDialog):
+    """Rolling statistics of the hot paths, non modal"""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle(text_labels.MENU_TEXT_PERFORMANCE)
+        self.resize(900, 600)
+
+        self.recordBox = QCheckBox(text_labels.PERFORMANCE_RECORD)
+        self.recordBox.setChecked(True)
+        self.recordBox.toggled.connect(instrumentation.setEnabled)
+        resetButton = QPushButton(text_labels.PERFORMANCE_RESET)
+        resetButton.clicked.connect(self.reset)
+        exportButton = QPushButton(text_labels.PERFORMANCE_EXPORT_TRACE)
+        exportButton.clicked.connect(self.exportTrace)
+        buttons = QHBoxLayout()
+        buttons.addWidget(self.recordBox)
+        buttons.addStretch()
+        buttons.addWidget(resetButton)
+        buttons.addWidget(exportButton)
+
+        self.spansTable = createTable(SPAN_COLUMNS)
+        self.countersTable = createTable(COUNTER_COLUMNS)
+        layout = QVBoxLayout(self)
+        layout.addLayout(buttons)
+        layout.addWidget(QLabel(text_labels.PERFORMANCE_SPANS))
+        layout.addWidget(self.spansTable, 3)
+        layout.addWidget(QLabel(text_labels.PERFORMANCE_COUNTERS))
+        layout.addWidget(self.countersTable, 1)
+
+        self.timer = QTimer(self)
+        self.timer.setInterval(REFRESH_MS)
+        self.timer.timeout.connect(self.refresh)
+        self.enabledBefore = instrumentation.isEnabled()
+
+    def refresh(self) -> None:
+        fillTable(self.spansTable, SPAN_COLUMNS, instrumentation.spanStatistics())
+        fillTable(self.countersTable, COUNTER_COLUMNS, instrumentation.counterStatistics())
+
+    def reset(self) -> None:
+        instrumentation.reset()
+        self.refresh()
+
+    def exportTrace(self) -> None:
+        filePath, _ = QFileDialog.getSaveFileName(self, text_labels.PERFORMANCE_EXPORT_TRACE,
+                                                  "maitenotas-trace.json", "Trace (*.json)")
+        if not filePath:
+            return
+        try:
+            instrumentation.exportTrace(filePath)
+        except OSError:
+            QMessageBox.about(self, text_labels.MESSAGE_BOX_TITLE, text_labels.PERFORMANCE_EXPORT_FAILED)
+
+    def showEvent(self, event) -> None:
+        self.enabledBefore = instrumentation.isEnabled()
+        instrumentation.setEnabled(self.recordBox.isChecked())
+        self.timer.start()
+        self.refresh()
+        super().showEvent(event)
+
+    def hideEvent(self, event) -> None:
+        """closing the panel puts the recording back as it was (on with MAITENOTAS_TRACE),
+        what was recorded stays"""
+        self.timer.stop()
+        instrumentation.setEnabled(self.enabledBefore)
+        super().hideEvent(event)
@@ -0,0 +1,248 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas_v4
+
+Encrypt every row of a vault again with a new key (password change, new key
+derivation settings, other cipher engine).
+
+Rows are read a batch at a time, decrypted and encrypted again in worker
+processes and written back with executemany, so memory use does not depend on
+the size of the vault. Everything runs inside the caller's transaction and
+nothing is committed here: if anything fails the caller rolls back and the vault
+keeps its old key.
+
+Chunk ids and index terms are keyed hashes of the vault key, chunks get new ids
+and the search index is built again from the word lists of its documents (no
+page text is read or tokenized again). The frames of an attachment are written
+to new attachment_blob rows, which replace the old ones once its last frame is
+written.
+"""
+import os
+import sqlite3
+from typing import Callable, Iterator, List, Optional, Tuple
+
+import attachments
+from crypto import UserKey, encryptTextToData, decryptDataToText
+from page_chunks import chunkId
+from search_index import SearchIndex, decodeTokens
+from worker_pool import mapBatches
+
+REKEY_BATCH_SIZE = 64  # rows sent to a worker at once
+PARALLEL_MIN_ROWS = 500  # fewer rows are processed in this process
+INDEX_GROUP_PAGES = 5000  # documents merged in memory before their postings are written
+FRAMES_PER_BATCH = 4  # attachment frames sent to a worker at once
+
+# table -> key columns, encrypted columns, columns compressed when bodies are
+REKEY_TABLES = {
+    "book": (("id",), ("book_name", "book_text"), ("book_text",)),
+    "page": (("id",), ("page_name", "page_text"), ("page_text",)),
+    "page_revision": (("page_id", "revision"), ("data",), ("data",)),
+    "attachment": (("id",), ("file_name", "mime_type"), ()),
+}
+KIND_CHUNK = "chunk"
+KIND_DOCUMENT = "search_document"
+KIND_FRAME = "attachment frame"
+
+SQL_COUNT_REKEY_ROWS = ("select (select count(*) from book) + (select count(*) from page)"
+                        " + (select count(*) from page_revision) + (select count(*) from chunk)"
+                        " + (select count(*) from search_document) + (select count(*) from attachment)")
+SQL_READ_CHUNK_IDS = "select id from chunk"
+SQL_UPDATE_CHUNK = "update chunk set id=?, data=? where id=?"
+SQL_READ_DOCUMENTS = "select page_id, tokens from search_document where page_id > ? order by page_id limit ?"
+SQL_READ_ATTACHMENT_LAYOUTS = """
+select id, size, frame_size, segment_frames, stored_frame_size, blob_id, bound_frames from attachment"""
+
+
+# ***************** reading rows
+def tableBatches(conn: sqlite3.Connection, table: str) -> Iterator[Tuple[str, list]]:
+    """(table, rows) of key values and encrypted values, in key order. Each batch is
+    a query of its own that starts after the last key read, so rows already
+    written back are never read again."""
+    keys, columns, _ = REKEY_TABLES[table]
+    key_list = ", ".join(keys)
+    select = f"select {key_list}, {', '.join(columns)} from {table}"
+    after = f"where ({key_list}) > ({', '.join('?' * len(keys))})"
+    last = None
+    while True:
+        if last is None:
+            rows = conn.execute(f"{select} order by {key_list} limit ?", (REKEY_BATCH_SIZE,)).fetchall()
+        else:
+            rows = conn.execute(f"{select} {after} order by {key_list} limit ?",
+                                (*last, REKEY_BATCH_SIZE)).fetchall()
+        if not rows:
+            return
+        yield table, rows
+        last = rows[-1][:len(keys)]
+
+
+def chunkBatches(conn: sqlite3.Connection) -> Iterator[Tuple[str, list]]:
+    """(KIND_CHUNK, rows of id and data). Chunk ids change with the key, so the ids
+    to convert are listed before the first one is written back."""
+    chunk_ids = [row[0] for row in conn.execute(SQL_READ_CHUNK_IDS)]
+    for start in range(0, len(chunk_ids), REKEY_BATCH_SIZE):
+        batch = chunk_ids[start:start + REKEY_BATCH_SIZE]
+        rows = conn.execute(f"select id, data from chunk where id in ({', '.join('?' * len(batch))})",
+                            batch).fetchall()
+        yield KIND_CHUNK, rows
+
+
+def documentBatches(conn: sqlite3.Connection) -> Iterator[Tuple[str, list]]:
+    last = 0
+    while True:
+        rows = conn.execute(SQL_READ_DOCUMENTS, (last, REKEY_BATCH_SIZE)).fetchall()
+        if not rows:
+            return
+        yield KIND_DOCUMENT, rows
+        last = rows[-1][0]
+
+
+def frameBatches(conn: sqlite3.Connection, layouts: list) -> Iterator[Tuple[str, list]]:
+    """(KIND_FRAME, rows of attachment id, frame index, stored frame, bound), frames
+    of one attachment in order"""
+    for attachment_id, size, frame_size, segment_frames, stored_frame_size, blob_id, bound in layouts:
+        frames = -(-size // frame_size)
+        for first in range(0, frames, FRAMES_PER_BATCH):
+            rows = []
+            for index in range(first, min(frames, first + FRAMES_PER_BATCH)):
+                row, offset = attachments.frameLocation(blob_id, segment_frames, stored_frame_size, index)
+                with conn.blobopen("attachment_blob", "data", row, readonly=True) as blob:
+                    blob.seek(offset)
+                    rows.append((attachment_id, index, blob.read(stored_frame_size), bound))
+            yield KIND_FRAME, rows
+
+
+# ***************** worker side
+_workerOldKey: Optional[UserKey] = None
+_workerNewKey: Optional[UserKey] = None
+_workerCompress = False
+
+def initRekeyWorker(old_key: UserKey, new_key: UserKey, compress: bool) -> None:
+    global _workerOldKey, _workerNewKey, _workerCompress
+    _workerOldKey = old_key
+    _workerNewKey = new_key
+    _workerCompress = compress
+
+
+def rekeyValue(data, compress: bool):
+    # the verifier book stores an empty, not encrypted, text; chunked pages an empty page_text
+    if isinstance(data, bytes) and len(data) > 0:
+        return encryptTextToData(decryptDataToText(data, _workerOldKey), _workerNewKey, compress)
+    return data
+
+
+def rekeyBatch(batch: Tuple[str, list]) -> Tuple[str, list]:
+    """rows of one kind converted to the new key:
+    table rows become (new values..., key values...) for the update statement,
+    chunks (new id, new data, old id), documents (page id, words),
+    frames (attachment id, frame index, new frame)"""
+    kind, rows = batch
+    if kind == KIND_CHUNK:
+        converted = []
+        for chunk_id, data in rows:
+            chunk = decryptDataToText(data, _workerOldKey)
+            converted.append((chunkId(_workerNewKey, chunk),
+                              encryptTextToData(chunk, _workerNewKey, _workerCompress), chunk_id))
+        return kind, converted
+    if kind == KIND_DOCUMENT:
+        return kind, [(page_id, decodeTokens(_workerOldKey.decrypt(tokens))) for page_id, tokens in rows]
+    if kind == KIND_FRAME:
+        converted = []
+        for attachment_id, index, frame, bound in rows:
+            # frames of older attachments were not bound to their place, they are now
+            associated_data = attachments.frameData(attachment_id, index)
+            frame = _workerOldKey.decrypt(frame, associated_data if bound else b"")
+            converted.append((attachment_id, index, _workerNewKey.encrypt(frame, associated_data=associated_data)))
+        return kind, converted
+    keys, columns, compressed = REKEY_TABLES[kind]
+    converted = []
+    for row in rows:
+        values = [rekeyValue(data, _workerCompress and column in compressed)
+                  for column, data in zip(columns, row[len(keys):])]
+        converted.append((*values, *row[:len(keys)]))
+    return kind, converted
+
+
+# ***************** re-key
+def updateStatement(table: str) -> str:
+    keys, columns, _ = REKEY_TABLES[table]
+    assignments = ", ".join(f"{column}=?" for column in columns)
+    return f"update {table} set {assignments} where {' and '.join(f'{key}=?' for key in keys)}"
+
+
+class FrameWriter:
+    """Writes converted attachment frames to new rows. The rows of an attachment
+    are created with its first frame and replace the old ones after its last."""
+
+    def __init__(self, conn: sqlite3.Connection, new_key: UserKey, layouts: list):
+        self.conn = conn
+        self.new_key = new_key
+        self.layouts = {row[0]: row[1:] for row in layouts}
+        self.targets = {}  # attachment id -> (new blob id, new stored frame size)
+
+    def write(self, rows: list) -> None:
+        for attachment_id, index, frame in rows:
+            size, frame_size, segment_frames, _, old_blob_id, _ = self.layouts[attachment_id]
+            target = self.targets.get(attachment_id)
+            if target is None:
+                stored_frame, sizes = attachments.segmentSizes(self.new_key, size, frame_size, segment_frames)
+                target = (attachments.allocateSegments(self.conn, sizes), stored_frame, len(sizes))
+                self.targets[attachment_id] = target
+            blob_id, stored_frame, segments = target
+            row, offset = attachments.frameLocation(blob_id, segment_frames, stored_frame, index)
+            with self.conn.blobopen("attachment_blob", "data", row) as blob:
+                blob.seek(offset)
+                blob.write(frame)
+            if index == -(-size // frame_size) - 1:
+                self.conn.execute(attachments.SQL_REPLACE_BLOB, (stored_frame, blob_id, attachment_id))
+                self.conn.execute(attachments.SQL_DELETE_BLOB, (old_blob_id, old_blob_id + segments))
+                del self.targets[attachment_id]
+
+
+def rekeyRows(conn: sqlite3.Connection, search_index: SearchIndex, old_key: UserKey, new_key: UserKey,
+              compress: bool, workers: Optional[int] = None,
+              progress: Optional[Callable[[int, int], None]] = None) -> int:
+    """Encrypt every encrypted value again with new_key, in the current transaction,
+    and return the number of rows converted. progress(rows done, rows total) is
+    called after every batch. The verifier keeps the old password, the caller
+    writes it again when the password changes."""
+    layouts = conn.execute(SQL_READ_ATTACHMENT_LAYOUTS).fetchall()
+    total = conn.execute(SQL_COUNT_REKEY_ROWS).fetchone()[0]
+    total += sum(-(-size // frame_size) for _, size, frame_size, *_ in layouts)
+    if workers is None:
+        workers = os.cpu_count() or 1
+        if workers < 2 or total < PARALLEL_MIN_ROWS:
+            workers = 0
+
+    def batches() -> Iterator[Tuple[str, list]]:
+        for table in REKEY_TABLES:
+            yield from tableBatches(conn, table)
+        yield from chunkBatches(conn)
+        yield from documentBatches(conn)
+        yield from frameBatches(conn, layouts)
+
+    # the postings are written again under the new key from the documents' word lists
+    conn.execute("delete from search_term")
+    conn.execute("delete from search_vocabulary")
+    conn.execute("delete from search_vocabulary_shard")
+    search_index.clear()
+    documents: List[Tuple[int, List[str]]] = []
+    frames = FrameWriter(conn, new_key, layouts)
+    done = 0
+    for kind, rows in mapBatches(batches(), rekeyBatch, workers, initRekeyWorker, (old_key, new_key, compress)):
+        if kind == KIND_CHUNK:
+            conn.executemany(SQL_UPDATE_CHUNK, rows)
+        elif kind == KIND_FRAME:
+            frames.write(rows)
+        elif kind == KIND_DOCUMENT:
+            documents.extend(rows)
+            if len(documents) >= INDEX_GROUP_PAGES:
+                search_index.indexTokenizedPages(conn, new_key, documents)
+                documents = []
+        else:
+            conn.executemany(updateStatement(kind), rows)
+        done += len(rows)
+        if progress is not None:
+            progress(done, total)
+    search_index.indexTokenizedPages(conn, new_key, documents)
+    return done
@@ -0,0 +1,151 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas_v4
+
+Full vault search: decrypts every page and matches it, in parallel worker processes """
+import os
+import re
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import Iterator, Optional, Tuple
+
+from crypto import UserKey, decryptDataToText
+from storage import StorageSession
+from page_chunks import PAGE_LAYOUT_CHUNKED, SQL_READ_CHUNKS_OF_PAGE
+
+SEARCH_SUBSTRING = "substring"
+SEARCH_REGEX = "regex"
+SEARCH_MODES = (SEARCH_SUBSTRING, SEARCH_REGEX)
+
+SEARCH_BATCH_SIZE = 256  # pages sent to a worker at once
+PARALLEL_MIN_PAGES = 500  # smaller vaults are searched in this process
+SNIPPET_CHARS = 40  # characters shown on each side of a match
+
+SQL_COUNT_PAGES = "select count(*) from page"
+SQL_READ_PAGES_FOR_SEARCH = "select book_id, id, page_text, page_layout from page order by id"
+
+
+class PageMatcher:
+    """Finds the first match of a query in a page text and cuts a snippet around it"""
+
+    def __init__(self, query: str, mode: str = SEARCH_SUBSTRING, ignore_case: bool = False,
+                 snippet_chars: int = SNIPPET_CHARS):
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"unknown search mode: {mode}")
+        self.query = query
+        self.snippet_chars = snippet_chars
+        self.pattern = None
+        if mode == SEARCH_REGEX or ignore_case:
+            expression = query if mode == SEARCH_REGEX else re.escape(query)
+            self.pattern = re.compile(expression, re.IGNORECASE if ignore_case else 0)
+
+    def find(self, text: str) -> Optional[Tuple[int, int]]:
+        """(start, end) of the first match or None"""
+        if self.pattern is not None:
+            match = self.pattern.search(text)
+            return match.span() if match else None
+        start = text.find(self.query)
+        return (start, start + len(self.query)) if start >= 0 else None
+
+    def snippet(self, text: str, span: Tuple[int, int]) -> str:
+        start = max(0, span[0] - self.snippet_chars)
+        end = min(len(text), span[1] + self.snippet_chars)
+        snippet = text[start:end].replace("\n", " ")
+        return ("..." if start > 0 else "") + snippet + ("..." if end < len(text) else "")
+
+    def matchRows(self, user_key: UserKey, rows: list) -> list:
+        """decrypt and match (book_id, page_id, data) rows, return the hits. data is
+        the encrypted text or the list of encrypted chunks of a chunked page."""
+        hits = []
+        for book_id, page_id, data in rows:
+            if isinstance(data, list):
+                text = "".join(decryptDataToText(chunk, user_key) for chunk in data)
+            else:
+                text = decryptDataToText(data, user_key)
+            span = self.find(text)
+            if span is not None:
+                hits.append((book_id, page_id, self.snippet(text, span)))
+        return hits
+
+
+# state of a worker process, set once by initWorker
+_workerKey: Optional[UserKey] = None
+_workerMatcher: Optional[PageMatcher] = None
+
+def initWorker(user_key: UserKey, query: str, mode: str, ignore_case: bool, snippet_chars: int) -> None:
+    global _workerKey, _workerMatcher
+    _workerKey = user_key
+    _workerMatcher = PageMatcher(query, mode, ignore_case, snippet_chars)
+
+def matchBatch(rows: list) -> list:
+    return _workerMatcher.matchRows(_workerKey, rows)
+
+
+def openReader(dbfile: str) -> sqlite3.Connection:
+    """read only connection, WAL lets it read while the session keeps writing"""
+    return sqlite3.connect(f"file:{dbfile}?mode=ro", uri=True, check_same_thread=False)
+
+
+def readBatch(conn: sqlite3.Connection, cur: sqlite3.Cursor, batch_size: int) -> list:
+    """next (book_id, page_id, data) rows, chunked pages come with their chunks"""
+    rows = []
+    for book_id, page_id, data, layout in cur.fetchmany(batch_size):
+        if layout == PAGE_LAYOUT_CHUNKED:
+            data = [row[0] for row in conn.execute(SQL_READ_CHUNKS_OF_PAGE, (page_id,))]
+        rows.append((book_id, page_id, data))
+    return rows
+
+
+def searchVault(session: StorageSession, user_key: UserKey, query: str,
+                mode: str = SEARCH_SUBSTRING, ignore_case: bool = False,
+                workers: Optional[int] = None, batch_size: int = SEARCH_BATCH_SIZE,
+                snippet_chars: int = SNIPPET_CHARS) -> Iterator[Tuple[int, int, str]]:
+    """Search the text of every page, yield (book_id, page_id, snippet) as hits are found.
+
+    Pages are read in batches and decrypted and matched by a pool of worker
+    processes, so the first hits arrive long before the whole vault is read.
+    Hits come in the order workers finish, not in page order. workers=0
+    searches in this process."""
+    matcher = PageMatcher(query, mode, ignore_case, snippet_chars)  # validates the query
+    # queued saves must be visible to the search
+    session.flushPendingWrites()
+    conn = openReader(session.dbfile)
+    try:
+        if workers is None:
+            pages = conn.execute(SQL_COUNT_PAGES).fetchone()[0]
+            workers = os.cpu_count() or 1
+            if pages < PARALLEL_MIN_PAGES or workers < 2:
+                workers = 0
+        cur = conn.execute(SQL_READ_PAGES_FOR_SEARCH)
+        if workers == 0:
+            while True:
+                rows = readBatch(conn, cur, batch_size)
+                if not rows:
+                    return
+                yield from matcher.matchRows(user_key, rows)
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=initWorker,
+                                 initargs=(user_key, query, mode, ignore_case, snippet_chars)) as pool:
+            running = set()
+            exhausted = False
+            try:
+                while running or not exhausted:
+                    # keep every worker busy with one batch waiting behind it
+                    while not exhausted and len(running) < workers * 2:
+                        rows = readBatch(conn, cur, batch_size)
+                        if not rows:
+                            exhausted = True
+                            break
+                        running.add(pool.submit(matchBatch, rows))
+                    if not running:
+                        break
+                    done, running = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield from future.result()
+            finally:
+                # the caller may stop reading hits early
+                for future in running:
+                    future.cancel()
+    finally:
+        conn.close()
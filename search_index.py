@@ -0,0 +1,328 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas_v4
+
+Encrypted inverted index of page words, answers keyword and prefix queries without
+decrypting page texts.
+
+Tables (created by the storage schema migrations):
+  search_term        keyed HMAC of a word, bucket -> encrypted list of the page ids containing it
+                     (page ids are split in buckets so a save rewrites short lists only)
+  search_document    page id -> encrypted list of the words indexed for that page
+  search_vocabulary_shard  keyed HMAC of the first two letters of words -> encrypted sorted
+                     list of the indexed words starting with them (for prefix queries, a
+                     save rewrites only the shards of the words that appeared or disappeared)
+  search_vocabulary  one row, the whole vocabulary as versions before the shards stored
+                     it, moved to shards the first time it is read with the key
+
+The functions here run inside the caller's transaction and never commit.
+"""
+import bisect
+import hashlib
+import hmac
+import itertools
+import operator
+import re
+import sqlite3
+from array import array
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from crypto import UserKey, COMPRESSION_ZLIB
+
+TOKEN_PATTERN = re.compile(r"\w{2,40}")
+TERM_HASH_SIZE = 16
+BUCKET_BITS = 10  # 1024 page ids per posting list
+SHARD_PREFIX = 2  # words are sharded by their first letters, query words have at least that many
+
+SQL_CREATE_TERM_TABLE = """
+CREATE TABLE IF NOT EXISTS search_term (
+    term blob NOT NULL,
+    bucket integer NOT NULL,
+    postings blob NOT NULL,
+    PRIMARY KEY (term, bucket)
+) WITHOUT ROWID; """
+
+SQL_CREATE_DOCUMENT_TABLE = """
+CREATE TABLE IF NOT EXISTS search_document (
+    page_id integer PRIMARY KEY REFERENCES page(id) ON DELETE CASCADE,
+    tokens blob NOT NULL
+); """
+
+SQL_CREATE_VOCABULARY_TABLE = """
+CREATE TABLE IF NOT EXISTS search_vocabulary (
+    id integer PRIMARY KEY CHECK (id = 1),
+    tokens blob NOT NULL
+); """
+
+SQL_CREATE_VOCABULARY_SHARD_TABLE = """
+CREATE TABLE IF NOT EXISTS search_vocabulary_shard (
+    shard blob PRIMARY KEY,
+    tokens blob NOT NULL
+) WITHOUT ROWID; """
+
+SQL_READ_POSTINGS = "select postings from search_term where term=? and bucket=?"
+SQL_READ_ALL_POSTINGS = "select postings from search_term where term=?"
+SQL_WRITE_POSTINGS = "insert or replace into search_term(term, bucket, postings) values(?,?,?)"
+SQL_DELETE_POSTINGS = "delete from search_term where term=? and bucket=?"
+SQL_TERM_EXISTS = "select 1 from search_term where term=? limit 1"
+SQL_READ_DOCUMENT = "select tokens from search_document where page_id=?"
+SQL_WRITE_DOCUMENT = "insert or replace into search_document(page_id, tokens) values(?,?)"
+SQL_DELETE_DOCUMENT = "delete from search_document where page_id=?"
+SQL_READ_VOCABULARY = "select tokens from search_vocabulary where id=1"
+SQL_DELETE_VOCABULARY = "delete from search_vocabulary"
+SQL_READ_SHARD = "select tokens from search_vocabulary_shard where shard=?"
+SQL_WRITE_SHARD = "insert or replace into search_vocabulary_shard(shard, tokens) values(?,?)"
+SQL_DELETE_SHARD = "delete from search_vocabulary_shard where shard=?"
+SQL_UNINDEXED_PAGES = "select id from page where id not in (select page_id from search_document)"
+
+
+def tokenize(text: str) -> Set[str]:
+    """distinct lower case words of a text"""
+    return set(TOKEN_PATTERN.findall(text.lower()))
+
+
+def encodeIds(ids: Iterable[int]) -> bytes:
+    """sorted ids as 32 bit deltas, they compress well"""
+    ordered = sorted(ids)
+    deltas = array("I", map(operator.sub, ordered, itertools.chain((0,), ordered)))
+    return deltas.tobytes()
+
+
+def decodeIds(data: bytes) -> List[int]:
+    deltas = array("I")
+    deltas.frombytes(data)
+    return list(itertools.accumulate(deltas))
+
+
+def encodeTokens(tokens: Iterable[str]) -> bytes:
+    return "\n".join(sorted(tokens)).encode("utf-8")
+
+
+def decodeTokens(data: bytes) -> List[str]:
+    text = data.decode("utf-8")
+    return text.split("\n") if text else []
+
+
+class SearchIndex:
+    """Keeps the index tables of one database up to date"""
+
+    def __init__(self):
+        self.shards: Dict[bytes, List[str]] = {}  # decrypted, sorted, loaded when used
+        self.vocabularyKey: Optional[bytes] = None
+
+    def clear(self) -> None:
+        """forget decrypted state, for example after the vault key changed"""
+        self.shards = {}
+        self.vocabularyKey = None
+
+    def termHash(self, user_key: UserKey, token: str) -> bytes:
+        """keyed hash of a word, the key is derived from the vault key"""
+        return hmac.new(user_key.subkey("search index"), token.encode("utf-8"),
+                        hashlib.sha256).digest()[:TERM_HASH_SIZE]
+
+    # ***************** encrypted values
+    def readIds(self, conn: sqlite3.Connection, user_key: UserKey, term: bytes,
+                bucket: int) -> List[int]:
+        row = conn.execute(SQL_READ_POSTINGS, (term, bucket)).fetchone()
+        return decodeIds(user_key.decrypt(row[0])) if row else []
+
+    def readAllIds(self, conn: sqlite3.Connection, user_key: UserKey, term: bytes) -> List[int]:
+        ids = []
+        for row in conn.execute(SQL_READ_ALL_POSTINGS, (term,)):
+            ids.extend(decodeIds(user_key.decrypt(row[0])))
+        return ids
+
+    def writeIds(self, conn: sqlite3.Connection, user_key: UserKey, term: bytes, bucket: int,
+                 ids) -> None:
+        if ids:
+            conn.execute(SQL_WRITE_POSTINGS,
+                         (term, bucket, user_key.encrypt(encodeIds(ids), COMPRESSION_ZLIB)))
+        else:
+            conn.execute(SQL_DELETE_POSTINGS, (term, bucket))
+
+    def readDocument(self, conn: sqlite3.Connection, user_key: UserKey, page_id: int) -> List[str]:
+        row = conn.execute(SQL_READ_DOCUMENT, (page_id,)).fetchone()
+        return decodeTokens(user_key.decrypt(row[0])) if row else []
+
+    # ***************** vocabulary shards
+    def shardOf(self, user_key: UserKey, token: str) -> bytes:
+        """keyed hash of the first letters of a word, the shard holding it"""
+        return hmac.new(user_key.subkey("search vocabulary"), token[:SHARD_PREFIX].encode("utf-8"),
+                        hashlib.sha256).digest()[:TERM_HASH_SIZE]
+
+    def loadShard(self, conn: sqlite3.Connection, user_key: UserKey, shard: bytes) -> List[str]:
+        if self.vocabularyKey != user_key.key_bytes:
+            self.shards = {}
+            self.vocabularyKey = user_key.key_bytes
+            self.convertVocabulary(conn, user_key)
+        words = self.shards.get(shard)
+        if words is None:
+            row = conn.execute(SQL_READ_SHARD, (shard,)).fetchone()
+            words = self.shards[shard] = decodeTokens(user_key.decrypt(row[0])) if row else []
+        return words
+
+    def writeShards(self, conn: sqlite3.Connection, user_key: UserKey, shards: Iterable[bytes]) -> None:
+        for shard in shards:
+            words = self.shards[shard]
+            if words:
+                conn.execute(SQL_WRITE_SHARD, (shard, user_key.encrypt(encodeTokens(words), COMPRESSION_ZLIB)))
+            else:
+                conn.execute(SQL_DELETE_SHARD, (shard,))
+
+    def convertVocabulary(self, conn: sqlite3.Connection, user_key: UserKey) -> None:
+        """move a vocabulary stored in one row by older versions to shards"""
+        row = conn.execute(SQL_READ_VOCABULARY).fetchone()
+        if row is None:
+            return
+        shards: Dict[bytes, List[str]] = {}
+        for token in decodeTokens(user_key.decrypt(row[0])):
+            shards.setdefault(self.shardOf(user_key, token), []).append(token)
+        self.shards = shards
+        self.writeShards(conn, user_key, shards)
+        conn.execute(SQL_DELETE_VOCABULARY)
+
+    def addWords(self, conn: sqlite3.Connection, user_key: UserKey, tokens: Iterable[str],
+                 dirty: Set[bytes]) -> None:
+        """add words to the vocabulary, dirty collects the shards changed"""
+        for token in tokens:
+            shard = self.shardOf(user_key, token)
+            words = self.loadShard(conn, user_key, shard)
+            index = bisect.bisect_left(words, token)
+            if index == len(words) or words[index] != token:
+                words.insert(index, token)
+                dirty.add(shard)
+
+    def dropUnusedWords(self, conn: sqlite3.Connection, user_key: UserKey, tokens: Iterable[str],
+                        dirty: Set[bytes]) -> None:
+        """remove the words no page contains any more from the vocabulary"""
+        for token in tokens:
+            if conn.execute(SQL_TERM_EXISTS, (self.termHash(user_key, token),)).fetchone() is not None:
+                continue
+            shard = self.shardOf(user_key, token)
+            words = self.loadShard(conn, user_key, shard)
+            index = bisect.bisect_left(words, token)
+            if index < len(words) and words[index] == token:
+                del words[index]
+                dirty.add(shard)
+
+    # ***************** updates
+    def updatePage(self, conn: sqlite3.Connection, user_key: UserKey, page_id: int, text: str) -> None:
+        """index the new text of a page, only words that appeared or disappeared are touched"""
+        new_tokens = tokenize(text)
+        old_tokens = set(self.readDocument(conn, user_key, page_id))
+        added = new_tokens - old_tokens
+        removed = old_tokens - new_tokens
+        if not added and not removed and old_tokens:
+            return
+        bucket = page_id >> BUCKET_BITS
+        for token in added:
+            term = self.termHash(user_key, token)
+            ids = self.readIds(conn, user_key, term, bucket)
+            if page_id not in ids:
+                ids.append(page_id)
+                self.writeIds(conn, user_key, term, bucket, ids)
+        for token in removed:
+            term = self.termHash(user_key, token)
+            ids = [i for i in self.readIds(conn, user_key, term, bucket) if i != page_id]
+            self.writeIds(conn, user_key, term, bucket, ids)
+        dirty: Set[bytes] = set()
+        self.addWords(conn, user_key, added, dirty)
+        self.dropUnusedWords(conn, user_key, removed, dirty)
+        conn.execute(SQL_WRITE_DOCUMENT,
+                     (page_id, user_key.encrypt(encodeTokens(new_tokens), COMPRESSION_ZLIB)))
+        self.writeShards(conn, user_key, dirty)
+
+    def removePages(self, conn: sqlite3.Connection, user_key: UserKey, page_ids: Iterable[int]) -> None:
+        """take pages about to be deleted out of the postings, the vocabulary and the
+        documents; every touched posting list is written once"""
+        postings: Dict[Tuple[str, int], Set[int]] = {}
+        for page_id in page_ids:
+            bucket = page_id >> BUCKET_BITS
+            for token in self.readDocument(conn, user_key, page_id):
+                postings.setdefault((token, bucket), set()).add(page_id)
+            conn.execute(SQL_DELETE_DOCUMENT, (page_id,))
+        for (token, bucket), removed in postings.items():
+            term = self.termHash(user_key, token)
+            ids = [i for i in self.readIds(conn, user_key, term, bucket) if i not in removed]
+            self.writeIds(conn, user_key, term, bucket, ids)
+        dirty: Set[bytes] = set()
+        self.dropUnusedWords(conn, user_key, {token for token, _ in postings}, dirty)
+        self.writeShards(conn, user_key, dirty)
+
+    def rebuild(self, conn: sqlite3.Connection, user_key: UserKey, readText) -> int:
+        """index every page from scratch, return the number of pages indexed.
+        readText(page_id) returns the text of a page."""
+        conn.execute("delete from search_term")
+        conn.execute("delete from search_document")
+        conn.execute("delete from search_vocabulary")
+        conn.execute("delete from search_vocabulary_shard")
+        self.clear()
+        page_ids = [row[0] for row in conn.execute("select id from page")]
+        return self.indexPages(conn, user_key, page_ids, readText)
+
+    def indexMissingPages(self, conn: sqlite3.Connection, user_key: UserKey, readText) -> int:
+        """index pages that have no index entry yet (pages of vaults made before the index)"""
+        page_ids = [row[0] for row in conn.execute(SQL_UNINDEXED_PAGES)]
+        return self.indexPages(conn, user_key, page_ids, readText)
+
+    def indexPages(self, conn: sqlite3.Connection, user_key: UserKey, page_ids, readText) -> int:
+        """index pages not indexed yet, readText(page_id) returns the text of a page"""
+        return self.indexTokenizedPages(conn, user_key,
+                                        ((page_id, tokenize(readText(page_id))) for page_id in page_ids))
+
+    def indexTokenizedPages(self, conn: sqlite3.Connection, user_key: UserKey,
+                            pages: Iterable[Tuple[int, Set[str]]]) -> int:
+        """index (page id, tokenize(text)) pairs of pages not indexed yet, postings
+        are merged in memory and every touched term is written once"""
+        postings: Dict[Tuple[str, int], List[int]] = {}
+        documents = []
+        for page_id, tokens in pages:
+            documents.append((page_id, user_key.encrypt(encodeTokens(tokens), COMPRESSION_ZLIB)))
+            bucket = page_id >> BUCKET_BITS
+            for token in tokens:
+                postings.setdefault((token, bucket), []).append(page_id)
+        if not documents:
+            return 0
+        for (token, bucket), page_ids in postings.items():
+            term = self.termHash(user_key, token)
+            ids = set(self.readIds(conn, user_key, term, bucket)).union(page_ids)
+            self.writeIds(conn, user_key, term, bucket, ids)
+        dirty: Set[bytes] = set()
+        self.addWords(conn, user_key, {token for token, _ in postings}, dirty)
+        conn.executemany(SQL_WRITE_DOCUMENT, documents)
+        self.writeShards(conn, user_key, dirty)
+        return len(documents)
+
+    # ***************** queries
+    def expandPrefix(self, conn: sqlite3.Connection, user_key: UserKey, prefix: str) -> List[str]:
+        """indexed words starting with prefix (of at least SHARD_PREFIX letters)"""
+        vocabulary = self.loadShard(conn, user_key, self.shardOf(user_key, prefix))
+        start = bisect.bisect_left(vocabulary, prefix)
+        end = bisect.bisect_left(vocabulary, prefix + "\U0010ffff")
+        return vocabulary[start:end]
+
+    def query(self, conn: sqlite3.Connection, user_key: UserKey, text: str,
+              prefix: bool = False) -> List[int]:
+        """ids of pages containing every word of text (or a word starting with it)"""
+        words = TOKEN_PATTERN.findall(text.lower())
+        if not words:
+            return []
+        result: Optional[Set[int]] = None
+        for word in words:
+            tokens = self.expandPrefix(conn, user_key, word) if prefix else [word]
+            ids: Set[int] = set()
+            for token in tokens:
+                ids.update(self.readAllIds(conn, user_key, self.termHash(user_key, token)))
+            result = ids if result is None else result & ids
+            if not result:
+                return []
+        # postings may still name pages deleted since they were written
+        existing = set()
+        ordered = sorted(result)
+        for start in range(0, len(ordered), 500):
+            chunk = ordered[start:start + 500]
+            marks = ",".join("?" * len(chunk))
+            existing.update(row[0] for row in
+                            conn.execute(f"select id from page where id in ({marks})", chunk))
+        return [page_id for page_id in ordered if page_id in existing]
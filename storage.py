@@ -4,10 +4,24 @@ Made by Taksan Tong
 https://github.com/maitelab/maitenotas_v4
 
 Functions related to read/write data """
+import functools
+import json
+import os
 import sqlite3
-from typing import Optional
-from cryptography.fernet import Fernet
-from crypto import encryptTextToData, decryptDataToText
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Iterable, Optional, Dict, Tuple
+from crypto import UserKey, encryptTextToData, decryptDataToText, legacyKdfParams
+from search_index import (SearchIndex, SQL_CREATE_TERM_TABLE, SQL_CREATE_DOCUMENT_TABLE,
+                          SQL_CREATE_VOCABULARY_TABLE, SQL_CREATE_VOCABULARY_SHARD_TABLE)
+import page_chunks
+from page_chunks import PAGE_LAYOUT_CHUNKED
+import page_history
+import attachments
+import instrumentation
+import rekey
 import traceback
 import text_labels
 
@@ -27,14 +41,87 @@ CREATE TABLE IF NOT EXISTS page (
     page_text blob NOT NULL
 ); """
 
+# version 2 of the page table, see migratePageForeignKey
+SQL_CREATE_PAGE_TABLE_V2 = """
+CREATE TABLE page_v2 (
+    book_id integer REFERENCES book(id) ON DELETE CASCADE,
+    id integer PRIMARY KEY AUTOINCREMENT,
+    page_name blob NOT NULL,
+    page_text blob NOT NULL
+); """
+
+SQL_CREATE_PAGE_BOOK_INDEX = "CREATE INDEX IF NOT EXISTS page_book_id ON page(book_id)"
+
+# settings of the vault, a single row; no row means legacy key derivation
+SQL_CREATE_HEADER_TABLE = """
+CREATE TABLE IF NOT EXISTS vault_header (
+    id integer PRIMARY KEY CHECK (id = 1),
+    kdf_algorithm text NOT NULL,
+    kdf_salt blob,
+    kdf_params text NOT NULL
+); """
+
 SQL_INSERT_BOOK = """
 INSERT INTO book(book_name, book_text)
 VALUES(?,?)"""
-    
+
+SQL_INSERT_PAGE = """
+INSERT INTO page(book_id,page_name,page_text)
+VALUES(?,?,?)"""
+
+SQL_UPDATE_PAGE_TEXT = "update page set page_text=?, page_layout=0 where id=?"
+SQL_SET_PAGE_CHUNKED = "update page set page_text=x'', page_layout=1 where id=?"
+SQL_UPDATE_BOOK_TEXT = "update book set book_text=? where id=?"
+SQL_UPDATE_PAGE_NAME = "update page set page_name=? where id=?"
+SQL_UPDATE_BOOK_NAME = "update book set book_name=? where id=?"
+SQL_DELETE_PAGE = "delete from page where id=?"
+SQL_DELETE_BOOK = "delete from book where id=?"
+SQL_READ_BOOK_NAME = "select book_name from book where id=?"
+SQL_READ_BOOK_TEXT = "select book_text from book where id=?"
+SQL_READ_PAGE_TEXT = "select page_text, page_layout from page where id=?"
+SQL_READ_BOOKS = "select id, book_name from book where id >= 2"
+SQL_READ_PAGES_OF_BOOK = "select id, page_name from page where book_id = ?"
+SQL_READ_BOOK_IDS = "select id from book where id >= 2 order by id"
+SQL_READ_RECOVERED_BOOK_IDS = "select id from book where id >= 2 and length(book_name) = 0"
+SQL_NAME_RECOVERED_BOOK = "update book set book_name=?, book_text=? where id=?"
+SQL_READ_PAGE_IDS_OF_BOOK = "select id from page where book_id = ? order by id"
+SQL_READ_BOOK_NAMES = "select id, book_name from book where id in ({})"
+SQL_READ_PAGE_NAMES = "select id, page_name from page where id in ({})"
+SQL_READ_VERIFIER = "SELECT book_name from book where id = ?"
+SQL_READ_PAGE_LOCATIONS = "select id, book_id, page_name from page where id in ({})"
+SQL_EXISTING_BOOK_IDS = "select id from book where id in ({})"
+SQL_EXISTING_PAGE_IDS = "select id from page where id in ({})"
+SQL_READ_HEADER = "select kdf_algorithm, kdf_salt, kdf_params from vault_header where id = 1"
+SQL_WRITE_HEADER = """
+INSERT OR REPLACE INTO vault_header(id, kdf_algorithm, kdf_salt, kdf_params)
+VALUES(1,?,?,?)"""
+
+# every encrypted column, rekey.REKEY_TABLES converts the same ones to a new key
+ENCRYPTED_COLUMNS = {
+    "book": ("book_name", "book_text"),
+    "page": ("page_name", "page_text"),
+    "chunk": ("data",),  # its ids are keyed hashes of the key, see rekey
+    "page_revision": ("data",),
+    "attachment": ("file_name", "mime_type"),  # the frames of attachment_blob are not counted
+}
+
 
 # ****************** DATABASE NAME and main operations
 DATABASE_NAME = r"maitenotas.data"
 
+# connection tuning used by StorageSession
+DEFAULT_CACHE_SIZE = -16000  # negative means KiB, so about 16 MB of page cache
+DEFAULT_MMAP_SIZE = 64 * 1024 * 1024
+DEFAULT_SYNCHRONOUS = "NORMAL"  # safe with WAL, the final flush on close is made durable
+DEFAULT_JOURNAL_MODE = "WAL"
+STATEMENT_CACHE_SIZE = 64
+TITLE_CACHE_SIZE = 100000  # decrypted book/page names kept in memory
+LISTING_CACHE_SIZE = 64  # page listings of this many books are kept sorted in memory
+TEXT_CACHE_BYTES = 64 * 1024 * 1024  # decrypted page/book texts kept in memory
+CHUNKED_PAGE_SIZE = 128 * 1024  # pages of this many characters or more are stored in chunks
+SYNCHRONOUS_MODES = ("OFF", "NORMAL", "FULL", "EXTRA")
+JOURNAL_MODES = ("DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF")
+
 def createConnection(dbfile) -> Optional[sqlite3.Connection]:
     """ create a database connection to the SQLite database
         specified by dbfile
@@ -43,7 +130,9 @@ def createConnection(dbfile) -> Optional[sqlite3.Connection]:
     """
     conn = None
     try:
-        conn = sqlite3.connect(dbfile)
+        # sessions are shared with the storage worker thread, access is serialized by their lock
+        conn = sqlite3.connect(dbfile, cached_statements=STATEMENT_CACHE_SIZE,
+                               check_same_thread=False)
         return conn
     except:
         traceback.print_exc()
@@ -58,345 +147,1284 @@ def createTable(conn: sqlite3.Connection, create_tablesql: str) -> None:
     except:
         traceback.print_exc()
 
-def updatePageText(user_key: Fernet, page_id: int, new_text: str) -> None:
-    """update text of page row"""
-    SQL_UPDATE_PAGE_TEXT = """
-    update page
-    set page_text=?
-    where id=?
-    """
-    try:
-        conn = createConnection(DATABASE_NAME)
-        if conn is not None:
-            cur = conn.cursor()
-            encrypted_data = encryptTextToData(new_text, user_key)
-            datas = (encrypted_data, page_id,)
-            cur.execute(SQL_UPDATE_PAGE_TEXT, datas)
-            conn.commit()
-    except:
-        traceback.print_exc()
-    finally:
-        if conn:
-            conn.close()
 
-def updateBookText(user_key: Fernet, book_id: int, new_text: str) -> None:
-    """update text of book row"""
-    SQL_UPDATE_BOOK_TEXT = """
-    update book
-    set book_text=?
-    where id=?
-    """
-    try:
-        conn = createConnection(DATABASE_NAME)
-        if conn is not None:
-            cur = conn.cursor()
-            encrypted_data = encryptTextToData(new_text, user_key)
-            datas = (encrypted_data, book_id,)
-            cur.execute(SQL_UPDATE_BOOK_TEXT, datas)
-            conn.commit()
-    except:
-        traceback.print_exc()
-    finally:
-        if conn:
-            conn.close()
+# ****************** schema migrations
+# createDatabase creates the version 0 schema (SQL_CREATE_BOOK_TABLE and
+# SQL_CREATE_PAGE_TABLE), every migration below upgrades it by one version.
+# The version of a database file is kept in PRAGMA user_version.
 
+def migratePageBookIndex(conn: sqlite3.Connection) -> None:
+    """version 1: index pages by book"""
+    conn.execute(SQL_CREATE_PAGE_BOOK_INDEX)
 
-def updatePageName(user_key: Fernet, page_id: int, new_name: str) -> None:
-    """update book name"""
-    sql = """
-    update page set page_name=? where id=?
-    """
-    try:
-        conn = createConnection(DATABASE_NAME)
-        if conn is not None:
-            cur = conn.cursor()
-            encrypted_data = encryptTextToData(new_name, user_key)
-            data_forsql = (encrypted_data, page_id)
-            cur.execute(sql, data_forsql)
-            conn.commit()
-    except:
-        traceback.print_exc()
-    finally:
-        if conn:
-            conn.close()
-            
-def updateBookName(user_key: Fernet, book_id: int, new_name: str) -> None:
-    """update book name"""
-    sql = """
-    update book set book_name=? where id=?
-    """
-    try:
-        conn = createConnection(DATABASE_NAME)
-        if conn is not None:
-            cur = conn.cursor()
-            encrypted_data = encryptTextToData(new_name, user_key)
-            data_forsql = (encrypted_data, book_id)
-            cur.execute(sql, data_forsql)
-            conn.commit()
-    except:
-        traceback.print_exc()
-    finally:
-        if conn:
-            conn.close()
+def migratePageForeignKey(conn: sqlite3.Connection) -> None:
+    """version 2: page.book_id references book(id) and is deleted with it"""
+    row = conn.execute("select seq from sqlite_sequence where name='page'").fetchone()
+    conn.execute(SQL_CREATE_PAGE_TABLE_V2)
+    # pages whose book is gone are kept in a book of their own; the migration has
+    # no key, the book is named once the vault is unlocked (nameRecoveredBooks)
+    orphans = conn.execute(
+        "select count(*) from page where book_id is null or book_id not in (select id from book)").fetchone()[0]
+    if orphans:
+        # a new id, never 1 (the password verifier) nor the id of a deleted book
+        lost_book_id = 1 + max(1, *conn.execute("""
+        select coalesce((select max(id) from book), 0), coalesce((select max(book_id) from page), 0),
+               coalesce((select seq from sqlite_sequence where name='book'), 0)""").fetchone())
+        conn.execute("insert into book(id, book_name, book_text) values(?, x'', x'')", (lost_book_id,))
+        conn.execute("update page set book_id=? where book_id is null or book_id not in (select id from book)",
+                     (lost_book_id,))
+        print(f"{orphans} pages without a book were moved to a recovered book")
+    conn.execute("""
+    insert into page_v2(book_id, id, page_name, page_text)
+    select book_id, id, page_name, page_text from page""")
+    conn.execute("drop table page")
+    conn.execute("alter table page_v2 rename to page")
+    conn.execute(SQL_CREATE_PAGE_BOOK_INDEX)
+    if row is not None:
+        # keep ids of deleted pages from being reused
+        conn.execute("update sqlite_sequence set seq=? where name='page'", (row[0],))
 
+def migrateVaultHeader(conn: sqlite3.Connection) -> None:
+    """version 3: table for key derivation settings"""
+    conn.execute(SQL_CREATE_HEADER_TABLE)
 
-def deletePage(page_id: int) -> None:
-    """delete page"""
-    try:
-        conn = createConnection(DATABASE_NAME)
-        if conn is not None:
-            cur = conn.cursor()
-            cur.execute("delete from page where id=?", (page_id,))
-            conn.commit()
-    except:
-        traceback.print_exc()
-    finally:
-        if conn:
-            conn.close()
+def migrateSearchIndex(conn: sqlite3.Connection) -> None:
+    """version 4: tables of the encrypted search index, existing pages are indexed
+    after the vault is unlocked (StorageSession.indexMissingPages)"""
+    conn.execute(SQL_CREATE_TERM_TABLE)
+    conn.execute(SQL_CREATE_DOCUMENT_TABLE)
+    conn.execute(SQL_CREATE_VOCABULARY_TABLE)
 
-def deleteBook(book_id: int) -> None:
-    """delete book"""
-    try:
-        conn = createConnection(DATABASE_NAME)
-        if conn is not None:
-            cur = conn.cursor()
-            # we need to first delete the pages of the book
-            cur.execute("delete from page where book_id=?", (book_id,))
-            # now delete the book
-            cur.execute("delete from book where id=?", (book_id,))
-            conn.commit()
-    except:
-        traceback.print_exc()
-    finally:
-        if conn:
-            conn.close()
+def migrateChunkedPages(conn: sqlite3.Connection) -> None:
+    """version 5: pages can be stored as content addressed chunks (page_chunks.py)"""
+    conn.execute(page_chunks.SQL_ADD_PAGE_LAYOUT)
+    conn.execute(page_chunks.SQL_CREATE_CHUNK_TABLE)
+    conn.execute(page_chunks.SQL_CREATE_PAGE_CHUNK_TABLE)
+    conn.execute(page_chunks.SQL_CREATE_PAGE_CHUNK_INDEX)
 
-def getBookName(user_key: Fernet, book_id: int) -> str:
-    """read book name"""
-    SQL_READ_BOOK_NAME = """
-    select book_name
-    from book
-    where id=?
-    """
-    book_name = ""
-    try:
-        conn = createConnection(DATABASE_NAME)
-        if conn is not None:
-            cur = conn.cursor()
-            cur.execute(SQL_READ_BOOK_NAME, (book_id,))
-            record = cur.fetchall()
-            for row in record:
-                # read columns
-                book_name = decryptDataToText(row[0], user_key)
-    except:
-        traceback.print_exc()
-    finally:
-        if conn:
-            conn.close()
-    return book_name
+def migratePageHistory(conn: sqlite3.Connection) -> None:
+    """version 6: older versions of page texts (page_history.py)"""
+    conn.execute(page_history.SQL_CREATE_REVISION_TABLE)
 
+def migrateAttachments(conn: sqlite3.Connection) -> None:
+    """version 7: files attached to pages (attachments.py)"""
+    conn.execute(attachments.SQL_CREATE_ATTACHMENT_TABLE)
+    conn.execute(attachments.SQL_CREATE_ATTACHMENT_PAGE_INDEX)
+    conn.execute(attachments.SQL_CREATE_ATTACHMENT_BLOB_TABLE)
+    conn.execute(attachments.SQL_CREATE_ATTACHMENT_TRIGGER)
 
-def getBookText(user_key: Fernet, book_id) -> str:
-    """get book text"""
-    result_text = ""
-    SQL_READ_BOOK_TEXT = """
-    select book_text from book where id=?
-    """
-    try:
-        conn = createConnection(DATABASE_NAME)
-        if conn is not None:
-            cur = conn.cursor()
-            cur.execute(SQL_READ_BOOK_TEXT, (book_id,))
-            record = cur.fetchall()
-            for row in record:
-                # read columns
-                result_text = decryptDataToText(row[0], user_key)
-    except:
-        traceback.print_exc()
-    finally:
-        if conn:
-            conn.close()
-    return result_text
+def migrateVocabularyShards(conn: sqlite3.Connection) -> None:
+    """version 8: the search vocabulary is split in shards, the single row of older
+    versions is moved to them when it is first read with the key (search_index.py)"""
+    conn.execute(SQL_CREATE_VOCABULARY_SHARD_TABLE)
 
-def getPageText(user_key: Fernet, page_id) -> str:
-    """get page text"""
-    result_text = ""
-    SQL_READ_PAGE_TEXT = """
-    select page_text from page where id=?
-    """
+def migrateFrameBinding(conn: sqlite3.Connection) -> None:
+    """version 9: frames of new attachments are bound to their place (attachments.py)"""
+    conn.execute(attachments.SQL_ADD_FRAME_BINDING)
+
+SCHEMA_MIGRATIONS = [
+    migratePageBookIndex,
+    migratePageForeignKey,
+    migrateVaultHeader,
+    migrateSearchIndex,
+    migrateChunkedPages,
+    migratePageHistory,
+    migrateAttachments,
+    migrateVocabularyShards,
+    migrateFrameBinding,
+]
+SCHEMA_VERSION = len(SCHEMA_MIGRATIONS)
+
+def getSchemaVersion(conn: sqlite3.Connection) -> int:
+    """version of the schema stored in the database"""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def migrateDatabase(conn: sqlite3.Connection) -> int:
+    """upgrade the schema in place to SCHEMA_VERSION, one transaction per migration.
+    Return the resulting version."""
+    version = getSchemaVersion(conn)
+    if version > SCHEMA_VERSION:
+        raise sqlite3.DatabaseError(
+            f"database schema version {version} is newer than this program ({SCHEMA_VERSION})")
+    if version == SCHEMA_VERSION:
+        return version
+    conn.commit()
+    # foreign keys can only be switched outside a transaction, and must be off
+    # while tables are rebuilt
+    foreign_keys = conn.execute("PRAGMA foreign_keys").fetchone()[0]
+    conn.execute("PRAGMA foreign_keys=OFF")
     try:
-        conn = createConnection(DATABASE_NAME)
-        if conn is not None:
-            cur = conn.cursor()
-            cur.execute(SQL_READ_PAGE_TEXT, (page_id,))
-            record = cur.fetchall()
-            for row in record:
-                # read columns
-                result_text = decryptDataToText(row[0], user_key)
-    except:
-        traceback.print_exc()
+        while version < SCHEMA_VERSION:
+            conn.execute("BEGIN")
+            try:
+                SCHEMA_MIGRATIONS[version](conn)
+                version += 1
+                conn.execute(f"PRAGMA user_version={version}")
+                problems = conn.execute("PRAGMA foreign_key_check").fetchall()
+                if problems:
+                    raise sqlite3.IntegrityError(f"foreign key check failed: {problems[:5]}")
+                conn.commit()
+            except:
+                conn.rollback()
+                raise
     finally:
-        if conn:
-            conn.close()
-    return result_text
+        conn.execute(f"PRAGMA foreign_keys={foreign_keys}")
+    return version
+
+def tableExists(conn: sqlite3.Connection, table_name: str) -> bool:
+    row = conn.execute("select 1 from sqlite_master where type='table' and name=?",
+                       (table_name,)).fetchone()
+    return row is not None
 
 # take the second element for sort
 def take_second(elem):
     return elem[1]
 
-def getBooks(user_key: Fernet) -> list:
-    """read books from database"""
-    leaf_list = []
-    SQL_READ_ALL_JOURNAL = """
-    select id, book_name 
-    from book
-    where id >= 2
+
+def synchronized(method):
+    """run a StorageSession method while holding the session lock, timed as a
+    span (waiting for the lock included)"""
+    name = "storage." + method.__name__
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if not instrumentation.enabled:
+            with self.lock:
+                return method(self, *args, **kwargs)
+        with instrumentation.Span(name, "storage", None), self.lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+class WriteBehindQueue:
+    """Text saves waiting to be written, coalesced so only the latest version
+    of each page/book is kept until the next flush"""
+
+    def __init__(self):
+        self.pendingPages: Dict[int, Tuple[UserKey, str]] = {}
+        self.pendingBooks: Dict[int, Tuple[UserKey, str]] = {}
+        # counters
+        self.savesQueued = 0
+        self.savesCoalesced = 0
+        self.rowsWritten = 0
+        self.flushes = 0
+
+    def __len__(self) -> int:
+        return len(self.pendingPages) + len(self.pendingBooks)
+
+    def queuePageText(self, user_key: UserKey, page_id: int, new_text: str) -> None:
+        """remember the latest text of a page"""
+        self.savesQueued += 1
+        if page_id in self.pendingPages:
+            self.savesCoalesced += 1
+        self.pendingPages[page_id] = (user_key, new_text)
+
+    def queueBookText(self, user_key: UserKey, book_id: int, new_text: str) -> None:
+        """remember the latest text of a book"""
+        self.savesQueued += 1
+        if book_id in self.pendingBooks:
+            self.savesCoalesced += 1
+        self.pendingBooks[book_id] = (user_key, new_text)
+
+    def takeAll(self) -> Tuple[Dict[int, Tuple[UserKey, str]], Dict[int, Tuple[UserKey, str]]]:
+        """return and forget every pending save"""
+        pages, books = self.pendingPages, self.pendingBooks
+        self.pendingPages, self.pendingBooks = {}, {}
+        return pages, books
+
+
+class TitleCache:
+    """Decrypted book and page names, plus the sorted listings built from them.
+
+    A name is cached with the ciphertext it was decrypted from and is only
+    reused while the row still holds that ciphertext. Listings are kept up to
+    date by the session on every create, rename and delete, so listing again
+    needs no query and no decryption at all.
     """
-    try:
-        conn = createConnection(DATABASE_NAME)
-        if conn is not None:
-            cur = conn.cursor()
-            cur.execute(SQL_READ_ALL_JOURNAL)
-            record = cur.fetchall()
-            for row in record:
-                # read columns
-                book_id = row[0]
-                book_name = decryptDataToText(row[1], user_key)
-                leaf_element = book_id, book_name
-                leaf_list.append(leaf_element)
-    except:
-        traceback.print_exc()
-    finally:
-        if conn:
-            conn.close()
-    return sorted(leaf_list, key=take_second) # sort by the second element (book name)
 
-def getPagesOfBook(user_key: Fernet, bookId: int) -> list:
-    """read pages of a book"""
-    leaf_list = []
-    SQL_READ_ALL_JOURNAL = """
-    select id, page_name
-    from page
-    where book_id = ?
+    def __init__(self, max_titles: int = TITLE_CACHE_SIZE, max_listings: int = LISTING_CACHE_SIZE):
+        self.max_titles = max_titles
+        self.max_listings = max_listings
+        self.titles: "OrderedDict[Tuple[str, int], Tuple[bytes, str]]" = OrderedDict()
+        self.bookListing: Optional[list] = None
+        self.pageListings: "OrderedDict[int, list]" = OrderedDict()
+        self.pageBook: Dict[int, int] = {}
+        # counters
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self) -> None:
+        self.titles.clear()
+        self.bookListing = None
+        self.pageListings.clear()
+        self.pageBook.clear()
+
+    def title(self, kind: str, row_id: int, encrypted_data: bytes, user_key: UserKey) -> str:
+        """return the decrypted name, decrypting only if not cached for this ciphertext"""
+        key = (kind, row_id)
+        entry = self.titles.get(key)
+        if entry is not None and entry[0] == encrypted_data:
+            self.hits += 1
+            self.titles.move_to_end(key)
+            return entry[1]
+        self.misses += 1
+        name = decryptDataToText(encrypted_data, user_key)
+        self.remember(kind, row_id, encrypted_data, name)
+        return name
+
+    def remember(self, kind: str, row_id: int, encrypted_data: bytes, name: str) -> None:
+        self.titles[(kind, row_id)] = (encrypted_data, name)
+        self.titles.move_to_end((kind, row_id))
+        while len(self.titles) > self.max_titles:
+            self.titles.popitem(last=False)
+
+    def getPageListing(self, book_id: int) -> Optional[list]:
+        listing = self.pageListings.get(book_id)
+        if listing is not None:
+            self.pageListings.move_to_end(book_id)
+        return listing
+
+    def setPageListing(self, book_id: int, listing: list) -> None:
+        self.pageListings[book_id] = listing
+        for page_id, _ in listing:
+            self.pageBook[page_id] = book_id
+        while len(self.pageListings) > self.max_listings:
+            old_book_id, old_listing = self.pageListings.popitem(last=False)
+            for page_id, _ in old_listing:
+                self.pageBook.pop(page_id, None)
+
+    def putInListing(self, listing: Optional[list], row_id: int, name: str) -> None:
+        """add or rename an entry of a sorted listing"""
+        if listing is None:
+            return
+        for index, entry in enumerate(listing):
+            if entry[0] == row_id:
+                del listing[index]
+                break
+        listing.append((row_id, name))
+        listing.sort(key=take_second)
+
+    def removeFromListing(self, listing: Optional[list], row_id: int) -> None:
+        if listing is None:
+            return
+        for index, entry in enumerate(listing):
+            if entry[0] == row_id:
+                del listing[index]
+                return
+
+    def bookCreated(self, book_id: int, encrypted_name: bytes, name: str) -> None:
+        self.remember("book", book_id, encrypted_name, name)
+        self.putInListing(self.bookListing, book_id, name)
+        self.setPageListing(book_id, [])
+
+    def bookRenamed(self, book_id: int, encrypted_name: bytes, name: str) -> None:
+        self.remember("book", book_id, encrypted_name, name)
+        self.putInListing(self.bookListing, book_id, name)
+
+    def bookDeleted(self, book_id: int) -> None:
+        self.titles.pop(("book", book_id), None)
+        self.removeFromListing(self.bookListing, book_id)
+        self.pageListings.pop(book_id, None)
+        for page_id in [p for p, b in self.pageBook.items() if b == book_id]:
+            del self.pageBook[page_id]
+            self.titles.pop(("page", page_id), None)
+
+    def pageCreated(self, book_id: int, page_id: int, encrypted_name: bytes, name: str) -> None:
+        self.remember("page", page_id, encrypted_name, name)
+        listing = self.pageListings.get(book_id)
+        if listing is not None:
+            self.pageBook[page_id] = book_id
+            self.putInListing(listing, page_id, name)
+
+    def pageRenamed(self, page_id: int, encrypted_name: bytes, name: str) -> None:
+        self.remember("page", page_id, encrypted_name, name)
+        book_id = self.pageBook.get(page_id)
+        if book_id is not None:
+            self.putInListing(self.pageListings.get(book_id), page_id, name)
+
+    def pageDeleted(self, page_id: int) -> None:
+        self.titles.pop(("page", page_id), None)
+        book_id = self.pageBook.pop(page_id, None)
+        if book_id is not None:
+            self.removeFromListing(self.pageListings.get(book_id), page_id)
+
+
+class TextCache:
+    """Decrypted page and book texts, the least recently used are dropped once they
+    hold more than max_bytes.
+
+    The session keeps every entry equal to the stored text: saves put the new
+    text, deletes and re-encryption drop it. Texts bigger than a quarter of the
+    cache are not kept, one huge page would push out everything else.
     """
-    try:
-        conn = createConnection(DATABASE_NAME)
-        if conn is not None:
-            cur = conn.cursor()
-            cur.execute(SQL_READ_ALL_JOURNAL, (bookId,))
-            record = cur.fetchall()
-            for row in record:
-                # read columns
-                page_id = row[0]
-                page_name = decryptDataToText(row[1], user_key)
-                leaf_element = page_id, page_name
-                leaf_list.append(leaf_element)
-    except:
-        traceback.print_exc()
-    finally:
-        if conn:
-            conn.close()
-    return sorted(leaf_list, key=take_second) # sort by the second element (page name)
 
+    def __init__(self, max_bytes: int = TEXT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.texts: "OrderedDict[Tuple[str, int], str]" = OrderedDict()
+        self.bytesHeld = 0
+        self.prefetchedKeys = set()  # loaded ahead and not asked for yet
+        # counters
+        self.hits = 0
+        self.misses = 0
+        self.prefetched = 0
+        self.prefetchHits = 0
 
-def createBook(user_key: Fernet, book_name: str, book_text) -> int:
-    """create book"""
-    try:
-        conn = createConnection(DATABASE_NAME)
-        if conn is not None:
-            cur = conn.cursor()
-            encrypted_data = encryptTextToData(book_name, user_key)
-            encrypted_data2 = encryptTextToData(book_text, user_key)
-            data_tobe_inserted = (encrypted_data, encrypted_data2,)
-            cur.execute(SQL_INSERT_BOOK, data_tobe_inserted)
-            conn.commit()
-            last_row_id = cur.lastrowid
-            return last_row_id
-    except:
-        traceback.print_exc()
-    finally:
-        if conn:
-            conn.close()
-    return 0
+    def __contains__(self, key: Tuple[str, int]) -> bool:
+        return key in self.texts
 
+    def clear(self) -> None:
+        self.texts.clear()
+        self.prefetchedKeys.clear()
+        self.bytesHeld = 0
 
-def createPage(user_key: Fernet, book_id: int, page_name: str, page_text: str) -> int:
-    """create journal"""
-    SQL_INSERT_PAGE = """
-    INSERT INTO page(book_id,page_name,page_text)
-    VALUES(?,?,?)"""
-    try:
-        conn = createConnection(DATABASE_NAME)
-        if conn is not None:
-            cur = conn.cursor()
-            encrypted_data_journal_name = encryptTextToData(page_name, user_key)
-            encrypted_data_journal_text = encryptTextToData(page_text, user_key)
-            data_tobe_inserted = (book_id, encrypted_data_journal_name,
-                                  encrypted_data_journal_text,)
-            cur.execute(SQL_INSERT_PAGE, data_tobe_inserted)
-            conn.commit()
-            last_row_id = cur.lastrowid
-            return last_row_id
-    except:
-        traceback.print_exc()
-    finally:
-        if conn:
-            conn.close()
-    return 0
+    def get(self, kind: str, row_id: int) -> Optional[str]:
+        """cached text, counted as a hit or a miss"""
+        key = (kind, row_id)
+        text = self.texts.get(key)
+        if text is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        if key in self.prefetchedKeys:
+            self.prefetchedKeys.discard(key)
+            self.prefetchHits += 1
+        self.texts.move_to_end(key)
+        return text
 
+    def peek(self, kind: str, row_id: int) -> Optional[str]:
+        """cached text, without counting or refreshing it"""
+        return self.texts.get((kind, row_id))
 
-def createDatabase(user_key: Fernet, user_password: str) -> bool:
-    """create database"""
-    try:
-        # create a database connection
-        conn = createConnection(DATABASE_NAME)
-        # create tables
-        if conn is not None:
-            # create tables
-            createTable(conn, SQL_CREATE_BOOK_TABLE)
-            createTable(conn, SQL_CREATE_PAGE_TABLE)
-            # insert first book (this is a special book not visible to the user)
-            cur = conn.cursor()
-            encrypted_data = encryptTextToData(user_password, user_key)
-            data_tobe_inserted = (encrypted_data, "",)
-            cur.execute(SQL_INSERT_BOOK, data_tobe_inserted)
-            conn.commit()
+    def put(self, kind: str, row_id: int, text: str, prefetched: bool = False) -> None:
+        self.drop(kind, row_id)
+        size = sys.getsizeof(text)
+        if size > self.max_bytes // 4:
+            return
+        key = (kind, row_id)
+        self.texts[key] = text
+        self.bytesHeld += size
+        if prefetched:
+            self.prefetchedKeys.add(key)
+            self.prefetched += 1
+        while self.bytesHeld > self.max_bytes:
+            old_key, old_text = self.texts.popitem(last=False)
+            self.bytesHeld -= sys.getsizeof(old_text)
+            self.prefetchedKeys.discard(old_key)
+
+    def drop(self, kind: str, row_id: int) -> None:
+        key = (kind, row_id)
+        text = self.texts.pop(key, None)
+        if text is not None:
+            self.bytesHeld -= sys.getsizeof(text)
+            self.prefetchedKeys.discard(key)
+
+    def statistics(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.texts),
+            "bytesHeld": self.bytesHeld,
+            "maxBytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hitRate": self.hits / lookups if lookups else 0.0,
+            "prefetched": self.prefetched,
+            "prefetchHits": self.prefetchHits,
+        }
+
+
+class StorageSession:
+    """Keeps one connection open to the database for the whole life of the application.
+
+    The connection keeps its page cache warm between calls and sqlite3 keeps the
+    compiled form of every SQL_* statement above, so repeated reads and writes do
+    not pay for open/parse/close cycles. Methods may be called from any thread,
+    they are serialized by the session lock.
+    """
+
+    def __init__(self, dbfile: str = DATABASE_NAME, cache_size: int = DEFAULT_CACHE_SIZE,
+                 mmap_size: int = DEFAULT_MMAP_SIZE, synchronous: str = DEFAULT_SYNCHRONOUS,
+                 journal_mode: str = DEFAULT_JOURNAL_MODE, compress_bodies: bool = True,
+                 chunked_page_size: Optional[int] = CHUNKED_PAGE_SIZE, keep_history: bool = True,
+                 text_cache_bytes: int = TEXT_CACHE_BYTES):
+        if synchronous.upper() not in SYNCHRONOUS_MODES:
+            raise ValueError(f"invalid synchronous mode: {synchronous}")
+        if journal_mode.upper() not in JOURNAL_MODES:
+            raise ValueError(f"invalid journal mode: {journal_mode}")
+        self.dbfile = dbfile
+        self.cache_size = cache_size
+        self.mmap_size = mmap_size
+        self.synchronous = synchronous.upper()
+        self.journal_mode = journal_mode.upper()
+        # page and book texts are compressed before encryption
+        self.compress_bodies = compress_bodies
+        # big pages are stored in chunks so an edit rewrites only the chunks it touches,
+        # None keeps every page in one value
+        self.chunked_page_size = chunked_page_size
+        self.chunksWritten = 0
+        # the text a save replaces is kept as a revision of the page
+        self.keep_history = keep_history
+        self.revisionsRecorded = 0
+        self.lock = threading.RLock()
+        self.writeQueue = WriteBehindQueue()
+        self.titleCache = TitleCache()
+        self.textCache = TextCache(text_cache_bytes)
+        self.searchIndex = SearchIndex()
+        self.conn = createConnection(dbfile)
+        if self.conn is None:
+            raise sqlite3.OperationalError(f"unable to open database {dbfile}")
+        self.applyPragmas()
+        if tableExists(self.conn, "book"):
+            migrateDatabase(self.conn)
+
+    @synchronized
+    def applyPragmas(self) -> None:
+        """set connection pragmas"""
+        cur = self.conn.cursor()
+        cur.execute(f"PRAGMA journal_mode={self.journal_mode}")
+        cur.execute(f"PRAGMA cache_size={int(self.cache_size)}")
+        cur.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+        cur.execute(f"PRAGMA synchronous={self.synchronous}")
+        cur.execute("PRAGMA foreign_keys=ON")
+
+    @synchronized
+    def close(self) -> None:
+        """write pending saves durably and close the connection"""
+        if self.conn is not None:
+            try:
+                self.flushPendingWrites(durable=True)
+                self.conn.commit()
+                self.conn.close()
+            except:
+                traceback.print_exc()
+            self.conn = None
+
+    @synchronized
+    def queuePageText(self, user_key: UserKey, page_id: int, new_text: str) -> None:
+        """save text of a page on the next flush"""
+        self.writeQueue.queuePageText(user_key, page_id, new_text)
+
+    @synchronized
+    def queueBookText(self, user_key: UserKey, book_id: int, new_text: str) -> None:
+        """save text of a book on the next flush"""
+        self.writeQueue.queueBookText(user_key, book_id, new_text)
+
+    @synchronized
+    def flushPendingWrites(self, durable: bool = False) -> int:
+        """write every queued save in one transaction, return number of rows written.
+        With durable=True the commit is synced to disk and the WAL checkpointed."""
+        if len(self.writeQueue) == 0 and not durable:
+            return 0
+        pages, books = self.writeQueue.takeAll()
+        try:
+            # saves of pages and books deleted since they were queued are dropped,
+            # writing them would fail the whole flush
+            pages = self._keepExisting(SQL_EXISTING_PAGE_IDS, pages)
+            books = self._keepExisting(SQL_EXISTING_BOOK_IDS, books)
+            page_rows = [(encryptTextToData(text, key, self.compress_bodies), page_id)
+                         for page_id, (key, text) in pages.items() if not self._storesChunked(text)]
+            book_rows = [(encryptTextToData(text, key, self.compress_bodies), book_id)
+                         for book_id, (key, text) in books.items()]
+            if durable:
+                self.conn.execute("PRAGMA synchronous=FULL")
+            try:
+                cur = self.conn.cursor()
+                for page_id, (key, text) in pages.items():
+                    self._recordRevision(key, page_id, text)
+                if page_rows:
+                    cur.executemany(SQL_UPDATE_PAGE_TEXT, page_rows)
+                for page_id, (key, text) in pages.items():
+                    if self._storesChunked(text):
+                        self._writeChunkedPage(key, page_id, text)
+                    else:
+                        page_chunks.removeChunkedText(self.conn, page_id)
+                    self._indexPage(key, page_id, text)
+                if book_rows:
+                    cur.executemany(SQL_UPDATE_BOOK_TEXT, book_rows)
+                self.conn.commit()
+                for page_id, (_, text) in pages.items():
+                    self.textCache.put("page", page_id, text)
+                for book_id, (_, text) in books.items():
+                    self.textCache.put("book", book_id, text)
+                if durable and self.journal_mode == "WAL":
+                    self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            except:
+                # the safety level can only be changed outside a transaction
+                self.conn.rollback()
+                raise
+            finally:
+                if durable:
+                    self.conn.execute(f"PRAGMA synchronous={self.synchronous}")
+        except:
+            self.conn.rollback()
+            self.searchIndex.clear()
+            traceback.print_exc()
+            # put back what could not be written, unless newer text arrived meanwhile
+            for page_id, entry in pages.items():
+                self.writeQueue.pendingPages.setdefault(page_id, entry)
+            for book_id, entry in books.items():
+                self.writeQueue.pendingBooks.setdefault(book_id, entry)
+            return 0
+        self.writeQueue.flushes += 1
+        self.writeQueue.rowsWritten += len(pages) + len(book_rows)
+        return len(pages) + len(book_rows)
+
+    def _execute(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+        """run one write statement and commit it"""
+        try:
+            cur = self.conn.execute(sql, params)
+            self.conn.commit()
+            return cur
+        except:
+            self.conn.rollback()
+            raise
+
+    def _keepExisting(self, sql: str, pending: Dict[int, Tuple[UserKey, str]]) -> Dict[int, Tuple[UserKey, str]]:
+        """the entries of pending whose id is still in the table sql reads"""
+        ids = list(pending)
+        existing = set()
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            existing.update(row[0] for row in self.conn.execute(sql.format(",".join("?" * len(chunk))), chunk))
+        return {row_id: entry for row_id, entry in pending.items() if row_id in existing}
+
+    def _storesChunked(self, text: str) -> bool:
+        """True if a page text this big is stored in chunks"""
+        return self.chunked_page_size is not None and len(text) >= self.chunked_page_size
+
+    def _writeChunkedPage(self, user_key: UserKey, page_id: int, text: str) -> None:
+        """store the text of an existing page in chunks, in the current transaction"""
+        self.chunksWritten += page_chunks.writeChunkedText(self.conn, user_key, page_id, text,
+                                                           self.compress_bodies)
+        self.conn.execute(SQL_SET_PAGE_CHUNKED, (page_id,))
+
+    def _writePageText(self, user_key: UserKey, page_id: int, text: str) -> None:
+        """store the text of an existing page in the layout its size calls for"""
+        if self._storesChunked(text):
+            self._writeChunkedPage(user_key, page_id, text)
         else:
+            encrypted_data = encryptTextToData(text, user_key, self.compress_bodies)
+            self.conn.execute(SQL_UPDATE_PAGE_TEXT, (encrypted_data, page_id,))
+            page_chunks.removeChunkedText(self.conn, page_id)
+
+    def _readPageText(self, user_key: UserKey, page_id: int) -> Optional[str]:
+        """text of a page whatever its layout, None if there is no such page"""
+        row = self.conn.execute(SQL_READ_PAGE_TEXT, (page_id,)).fetchone()
+        if row is None:
+            return None
+        if row[1] == PAGE_LAYOUT_CHUNKED:
+            return page_chunks.readChunkedText(self.conn, user_key, page_id)
+        return decryptDataToText(row[0], user_key)
+
+    def _recordRevision(self, user_key: UserKey, page_id: int, new_text: str) -> None:
+        """keep the stored text of a page as a revision before new_text replaces it,
+        in the current transaction. A failure loses that revision, not the save."""
+        if not self.keep_history:
+            return
+        self.conn.execute("SAVEPOINT page_history")
+        try:
+            old_text = self.textCache.peek("page", page_id)
+            if old_text is None:
+                old_text = self._readPageText(user_key, page_id)
+            if old_text is not None and old_text != new_text:
+                if page_history.recordRevision(self.conn, user_key, page_id, old_text, new_text,
+                                               time.time(), self.compress_bodies) is not None:
+                    self.revisionsRecorded += 1
+        except:
+            traceback.print_exc()
+            self.conn.execute("ROLLBACK TO page_history")
+        self.conn.execute("RELEASE page_history")
+
+    def _indexPage(self, user_key: UserKey, page_id: int, text: str) -> None:
+        """update the search index for a new page text, in the current transaction.
+        A failure leaves the page unindexed (picked up by indexMissingPages) instead
+        of failing the save."""
+        self.conn.execute("SAVEPOINT search_index")
+        try:
+            self.searchIndex.updatePage(self.conn, user_key, page_id, text)
+        except:
+            traceback.print_exc()
+            self.conn.execute("ROLLBACK TO search_index")
+            self.conn.execute("delete from search_document where page_id=?", (page_id,))
+            self.searchIndex.clear()
+        self.conn.execute("RELEASE search_index")
+
+    def _readOne(self, sql: str, params: tuple) -> Optional[bytes]:
+        """read the first column of the first row"""
+        row = self.conn.execute(sql, params).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    @synchronized
+    def updatePageText(self, user_key: UserKey, page_id: int, new_text: str) -> None:
+        """update text of page row"""
+        self.writeQueue.pendingPages.pop(page_id, None)
+        try:
+            self._recordRevision(user_key, page_id, new_text)
+            self._writePageText(user_key, page_id, new_text)
+            self._indexPage(user_key, page_id, new_text)
+            self.conn.commit()
+            self.textCache.put("page", page_id, new_text)
+        except:
+            self.conn.rollback()
+            self.searchIndex.clear()
+            self.textCache.drop("page", page_id)
+            traceback.print_exc()
+
+    @synchronized
+    def updateBookText(self, user_key: UserKey, book_id: int, new_text: str) -> None:
+        """update text of book row"""
+        self.writeQueue.pendingBooks.pop(book_id, None)
+        try:
+            encrypted_data = encryptTextToData(new_text, user_key, self.compress_bodies)
+            self._execute(SQL_UPDATE_BOOK_TEXT, (encrypted_data, book_id,))
+            self.textCache.put("book", book_id, new_text)
+        except:
+            self.textCache.drop("book", book_id)
+            traceback.print_exc()
+
+    @synchronized
+    def updatePageName(self, user_key: UserKey, page_id: int, new_name: str) -> None:
+        """update page name"""
+        try:
+            encrypted_data = encryptTextToData(new_name, user_key)
+            self._execute(SQL_UPDATE_PAGE_NAME, (encrypted_data, page_id))
+            self.titleCache.pageRenamed(page_id, encrypted_data, new_name)
+        except:
+            traceback.print_exc()
+
+    @synchronized
+    def updateBookName(self, user_key: UserKey, book_id: int, new_name: str) -> None:
+        """update book name"""
+        try:
+            encrypted_data = encryptTextToData(new_name, user_key)
+            self._execute(SQL_UPDATE_BOOK_NAME, (encrypted_data, book_id))
+            self.titleCache.bookRenamed(book_id, encrypted_data, new_name)
+        except:
+            traceback.print_exc()
+
+    def _unindexPages(self, user_key: UserKey, page_ids: list) -> None:
+        """take pages about to be deleted out of the search index, in the current
+        transaction. A failure leaves postings naming them, which queries filter out,
+        instead of failing the delete."""
+        self.conn.execute("SAVEPOINT search_index")
+        try:
+            self.searchIndex.removePages(self.conn, user_key, page_ids)
+        except:
+            traceback.print_exc()
+            self.conn.execute("ROLLBACK TO search_index")
+            self.searchIndex.clear()
+        self.conn.execute("RELEASE search_index")
+
+    @synchronized
+    def deletePage(self, user_key: UserKey, page_id: int) -> None:
+        """delete page"""
+        self.writeQueue.pendingPages.pop(page_id, None)
+        try:
+            chunk_ids = page_chunks.readManifest(self.conn, page_id)
+            self._unindexPages(user_key, [page_id])
+            # its page_chunk rows go with it (ON DELETE CASCADE)
+            self.conn.execute(SQL_DELETE_PAGE, (page_id,))
+            page_chunks.deleteUnusedChunks(self.conn, chunk_ids)
+            self.conn.commit()
+            self.titleCache.pageDeleted(page_id)
+            self.textCache.drop("page", page_id)
+        except:
+            self.conn.rollback()
+            traceback.print_exc()
+
+    @synchronized
+    def deleteBook(self, user_key: UserKey, book_id: int) -> None:
+        """delete book"""
+        self.writeQueue.pendingBooks.pop(book_id, None)
+        try:
+            chunk_ids = page_chunks.chunksOfBook(self.conn, book_id)
+            page_ids = [row[0] for row in self.conn.execute("select id from page where book_id=?", (book_id,))]
+            for page_id in page_ids:
+                self.writeQueue.pendingPages.pop(page_id, None)
+            self._unindexPages(user_key, page_ids)
+            # pages of the book and their page_chunk rows are deleted by the foreign
+            # keys (ON DELETE CASCADE)
+            self.conn.execute(SQL_DELETE_BOOK, (book_id,))
+            page_chunks.deleteUnusedChunks(self.conn, chunk_ids)
+            self.conn.commit()
+            self.titleCache.bookDeleted(book_id)
+            self.textCache.drop("book", book_id)
+            for page_id in page_ids:
+                self.textCache.drop("page", page_id)
+        except:
+            self.conn.rollback()
+            traceback.print_exc()
+
+    @synchronized
+    def getBookName(self, user_key: UserKey, book_id: int) -> str:
+        """read book name"""
+        try:
+            data = self._readOne(SQL_READ_BOOK_NAME, (book_id,))
+            if data is not None:
+                return self.titleCache.title("book", book_id, data, user_key)
+        except:
+            traceback.print_exc()
+        return ""
+
+    @synchronized
+    def getBookText(self, user_key: UserKey, book_id: int) -> str:
+        """get book text"""
+        pending = self.writeQueue.pendingBooks.get(book_id)
+        if pending is not None:
+            return pending[1]
+        text = self.textCache.get("book", book_id)
+        if text is not None:
+            return text
+        try:
+            data = self._readOne(SQL_READ_BOOK_TEXT, (book_id,))
+            if data is not None:
+                text = decryptDataToText(data, user_key)
+                self.textCache.put("book", book_id, text)
+                return text
+        except:
+            traceback.print_exc()
+        return ""
+
+    @synchronized
+    def getPageText(self, user_key: UserKey, page_id: int) -> str:
+        """get page text"""
+        pending = self.writeQueue.pendingPages.get(page_id)
+        if pending is not None:
+            return pending[1]
+        text = self.textCache.get("page", page_id)
+        if text is not None:
+            return text
+        try:
+            text = self._readPageText(user_key, page_id)
+            if text is not None:
+                self.textCache.put("page", page_id, text)
+                return text
+        except:
+            traceback.print_exc()
+        return ""
+
+    @synchronized
+    def getBooks(self, user_key: UserKey) -> list:
+        """read books from database"""
+        if self.titleCache.bookListing is not None:
+            return list(self.titleCache.bookListing)
+        leaf_list = []
+        try:
+            for row in self.conn.execute(SQL_READ_BOOKS):
+                leaf_list.append((row[0], self.titleCache.title("book", row[0], row[1], user_key)))
+        except:
+            traceback.print_exc()
+            return sorted(leaf_list, key=take_second)
+        self.titleCache.bookListing = sorted(leaf_list, key=take_second) # sort by the second element (book name)
+        return list(self.titleCache.bookListing)
+
+    @synchronized
+    def getPagesOfBook(self, user_key: UserKey, bookId: int) -> list:
+        """read pages of a book"""
+        listing = self.titleCache.getPageListing(bookId)
+        if listing is not None:
+            return list(listing)
+        leaf_list = []
+        try:
+            for row in self.conn.execute(SQL_READ_PAGES_OF_BOOK, (bookId,)):
+                leaf_list.append((row[0], self.titleCache.title("page", row[0], row[1], user_key)))
+        except:
+            traceback.print_exc()
+            return sorted(leaf_list, key=take_second)
+        listing = sorted(leaf_list, key=take_second) # sort by the second element (page name)
+        self.titleCache.setPageListing(bookId, listing)
+        return list(listing)
+
+    @synchronized
+    def getBookIds(self) -> list:
+        """ids of the books without decrypting anything: sorted by name if the book
+        listing is cached, else in creation order"""
+        if self.titleCache.bookListing is not None:
+            return [row[0] for row in self.titleCache.bookListing]
+        try:
+            return [row[0] for row in self.conn.execute(SQL_READ_BOOK_IDS)]
+        except:
+            traceback.print_exc()
+        return []
+
+    @synchronized
+    def getPageIdsOfBook(self, bookId: int) -> list:
+        """ids of the pages of a book without decrypting anything: sorted by name if
+        the page listing is cached, else in creation order"""
+        listing = self.titleCache.getPageListing(bookId)
+        if listing is not None:
+            return [row[0] for row in listing]
+        try:
+            return [row[0] for row in self.conn.execute(SQL_READ_PAGE_IDS_OF_BOOK, (bookId,))]
+        except:
+            traceback.print_exc()
+        return []
+
+    @synchronized
+    def getTitles(self, user_key: UserKey, kind: str, ids: list) -> list:
+        """(id, name) of the given books or pages ("book" or "page"), ids that do
+        not exist are left out"""
+        sql = SQL_READ_BOOK_NAMES if kind == "book" else SQL_READ_PAGE_NAMES
+        titles = []
+        try:
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                for row_id, data in self.conn.execute(sql.format(",".join("?" * len(chunk))), chunk):
+                    titles.append((row_id, self.titleCache.title(kind, row_id, data, user_key)))
+        except:
+            traceback.print_exc()
+        return titles
+
+    @synchronized
+    def createBook(self, user_key: UserKey, book_name: str, book_text: str) -> int:
+        """create book"""
+        try:
+            encrypted_data = encryptTextToData(book_name, user_key)
+            encrypted_data2 = encryptTextToData(book_text, user_key, self.compress_bodies)
+            cur = self._execute(SQL_INSERT_BOOK, (encrypted_data, encrypted_data2,))
+            self.titleCache.bookCreated(cur.lastrowid, encrypted_data, book_name)
+            return cur.lastrowid
+        except:
+            traceback.print_exc()
+        return 0
+
+    @synchronized
+    def createPage(self, user_key: UserKey, book_id: int, page_name: str, page_text: str) -> int:
+        """create page"""
+        try:
+            encrypted_data_page_name = encryptTextToData(page_name, user_key)
+            chunked = self._storesChunked(page_text)
+            # a chunked page gets its chunks once it has an id
+            encrypted_data_page_text = b"" if chunked else encryptTextToData(page_text, user_key,
+                                                                             self.compress_bodies)
+            data_tobe_inserted = (book_id, encrypted_data_page_name,
+                                  encrypted_data_page_text,)
+            cur = self.conn.execute(SQL_INSERT_PAGE, data_tobe_inserted)
+            if chunked:
+                self._writeChunkedPage(user_key, cur.lastrowid, page_text)
+            self._indexPage(user_key, cur.lastrowid, page_text)
+            self.conn.commit()
+            self.titleCache.pageCreated(book_id, cur.lastrowid, encrypted_data_page_name, page_name)
+            return cur.lastrowid
+        except:
+            self.conn.rollback()
+            self.searchIndex.clear()
+            traceback.print_exc()
+        return 0
+
+    @synchronized
+    def prefetchPage(self, user_key: UserKey, page_id: int) -> bool:
+        """decrypt a page into the text cache unless it is there already, return True
+        if it was read"""
+        if page_id in self.writeQueue.pendingPages or ("page", page_id) in self.textCache:
             return False
-    except:
-        traceback.print_exc()
+        try:
+            text = self._readPageText(user_key, page_id)
+            if text is not None:
+                self.textCache.put("page", page_id, text, prefetched=True)
+                return True
+        except:
+            traceback.print_exc()
         return False
-    finally:
-        if conn:
-            conn.close()
-    return True
 
+    def prefetchPages(self, user_key: UserKey, page_ids: Iterable[int],
+                      isWanted: Callable[[], bool] = lambda: True) -> int:
+        """Read pages ahead into the text cache, return how many were read. The lock
+        is taken page by page so other calls are not kept waiting, and the loop
+        stops as soon as isWanted() is False."""
+        count = 0
+        for page_id in page_ids:
+            if not isWanted():
+                break
+            if self.prefetchPage(user_key, page_id):
+                count += 1
+        return count
 
-def verifyDatabasePassword(user_key: Fernet, user_password: str) -> bool:
-    """verify db pass"""
-    try:
-        # create a database connection
-        conn = createConnection(DATABASE_NAME)
-        # create tables
-        if conn is not None:
+    @synchronized
+    def getTextCacheStatistics(self) -> dict:
+        return self.textCache.statistics()
+
+    @synchronized
+    def findPages(self, user_key: UserKey, text: str, prefix: bool = False) -> list:
+        """(book_id, page_id, page_name) of pages containing every word of text, from
+        the search index. With prefix=True words match any word they start."""
+        self.flushPendingWrites()
+        try:
+            page_ids = self.searchIndex.query(self.conn, user_key, text, prefix)
+            # the first read of a vocabulary of an older version moves it to shards
+            self.conn.commit()
+            found = []
+            for start in range(0, len(page_ids), 500):
+                chunk = page_ids[start:start + 500]
+                sql = SQL_READ_PAGE_LOCATIONS.format(",".join("?" * len(chunk)))
+                for page_id, book_id, data in self.conn.execute(sql, chunk):
+                    found.append((book_id, page_id, self.titleCache.title("page", page_id, data,
+                                                                          user_key)))
+            return sorted(found)
+        except:
+            self.conn.rollback()
+            self.searchIndex.clear()
+            traceback.print_exc()
+        return []
+
+    @synchronized
+    def nameRecoveredBooks(self, user_key: UserKey) -> int:
+        """Name the books schema migrations created for pages that had lost their
+        book (their name stays empty until the key is known), return how many.
+        Called right after unlocking, before books are listed."""
+        try:
+            book_ids = [row[0] for row in self.conn.execute(SQL_READ_RECOVERED_BOOK_IDS)]
+            if not book_ids:
+                return 0
+            for book_id in book_ids:
+                self.conn.execute(SQL_NAME_RECOVERED_BOOK, (encryptTextToData(text_labels.RECOVERED_BOOK_NAME, user_key),
+                                                            encryptTextToData(text_labels.RECOVERED_BOOK_TEXT, user_key),
+                                                            book_id))
+            self.conn.commit()
+            self.titleCache.clear()
+            return len(book_ids)
+        except:
+            self.conn.rollback()
+            traceback.print_exc()
+        return 0
+
+    @synchronized
+    def indexMissingPages(self, user_key: UserKey) -> int:
+        """add pages that are not in the search index yet, return how many were added"""
+        self.flushPendingWrites()
+        try:
+            count = self.searchIndex.indexMissingPages(
+                self.conn, user_key, lambda page_id: self._readPageText(user_key, page_id))
+            self.conn.commit()
+            return count
+        except:
+            self.conn.rollback()
+            self.searchIndex.clear()
+            traceback.print_exc()
+        return 0
+
+    @synchronized
+    def rebuildSearchIndex(self, user_key: UserKey) -> int:
+        """build the search index again from every page, return number of pages indexed"""
+        self.flushPendingWrites()
+        try:
+            count = self.searchIndex.rebuild(
+                self.conn, user_key, lambda page_id: self._readPageText(user_key, page_id))
+            self.conn.commit()
+            return count
+        except:
+            self.conn.rollback()
+            self.searchIndex.clear()
+            traceback.print_exc()
+        return -1
+
+    @synchronized
+    def getPageHistory(self, page_id: int) -> list:
+        """(revision, replaced_at, kind, stored bytes) of the older versions of a page,
+        oldest first. replaced_at is the time.time() a newer text was saved."""
+        self.flushPendingWrites()
+        try:
+            return page_history.listRevisions(self.conn, page_id)
+        except:
+            traceback.print_exc()
+        return []
+
+    @synchronized
+    def getPageRevision(self, user_key: UserKey, page_id: int, revision: int) -> Optional[str]:
+        """text of an older version of a page, None if there is no such revision"""
+        self.flushPendingWrites()
+        try:
+            return page_history.readRevision(self.conn, user_key, page_id, revision,
+                                             lambda: self._readPageText(user_key, page_id))
+        except:
+            traceback.print_exc()
+        return None
+
+    @synchronized
+    def thinHistory(self, user_key: UserKey) -> int:
+        """apply the retention policy to the history of every page, return number of
+        revisions dropped"""
+        self.flushPendingWrites()
+        try:
+            dropped = 0
+            now = time.time()
+            page_ids = [row[0] for row in self.conn.execute("select distinct page_id from page_revision")]
+            for page_id in page_ids:
+                dropped += page_history.thinRevisions(self.conn, user_key, page_id,
+                                                      self._readPageText(user_key, page_id), now,
+                                                      self.compress_bodies)
+            self.conn.commit()
+            return dropped
+        except:
+            self.conn.rollback()
+            traceback.print_exc()
+        return -1
+
+    @synchronized
+    def addAttachment(self, user_key: UserKey, page_id: int, file_path: str) -> int:
+        """attach a file to a page, return the attachment id (0 on failure)"""
+        self.flushPendingWrites()
+        try:
+            with open(file_path, "rb") as source:
+                size = os.fstat(source.fileno()).st_size
+                attachment_id = attachments.addAttachment(self.conn, user_key, page_id,
+                                                          os.path.basename(file_path), source, size,
+                                                          time.time())
+            self.conn.commit()
+            return attachment_id
+        except:
+            self.conn.rollback()
+            traceback.print_exc()
+        return 0
+
+    @synchronized
+    def getAttachment(self, user_key: UserKey, attachment_id: int) -> Optional[attachments.AttachmentInfo]:
+        try:
+            return attachments.getAttachment(self.conn, user_key, attachment_id)
+        except:
+            traceback.print_exc()
+        return None
+
+    @synchronized
+    def getAttachmentsOfPage(self, user_key: UserKey, page_id: int) -> list:
+        """(id, file name, media type, size, added_at) of the files attached to a page"""
+        try:
+            return attachments.listAttachments(self.conn, user_key, page_id)
+        except:
+            traceback.print_exc()
+        return []
+
+    @synchronized
+    def readAttachment(self, user_key: UserKey, info: attachments.AttachmentInfo, start: int, end: int) -> bytes:
+        """bytes start to end (excluded) of an attachment, the caller keeps the range
+        small: a frame or a few"""
+        return attachments.readRange(self.conn, user_key, info, start, end)
+
+    def exportAttachment(self, user_key: UserKey, attachment_id: int, destination: str) -> bool:
+        """Write a decrypted attachment to a file. The lock is taken per frame, other
+        calls go on while a big file is written."""
+        try:
+            info = self.getAttachment(user_key, attachment_id)
+            if info is None:
+                return False
+            partial = destination + ".partial"
+            try:
+                with open(partial, "wb") as output:
+                    for start in range(0, info.size, info.frame_size):
+                        output.write(self.readAttachment(user_key, info, start, start + info.frame_size))
+                os.replace(partial, destination)
+            finally:
+                if os.path.exists(partial):
+                    os.remove(partial)
+            return True
+        except:
+            traceback.print_exc()
+        return False
+
+    @synchronized
+    def deleteAttachment(self, attachment_id: int) -> bool:
+        try:
+            attachments.deleteAttachment(self.conn, attachment_id)
+            self.conn.commit()
+            return True
+        except:
+            self.conn.rollback()
+            traceback.print_exc()
+        return False
+
+    @synchronized
+    def getKdfParams(self) -> dict:
+        """key derivation settings of the vault"""
+        if not tableExists(self.conn, "vault_header"):
+            return legacyKdfParams()
+        row = self.conn.execute(SQL_READ_HEADER).fetchone()
+        if row is None:
+            return legacyKdfParams()
+        params = json.loads(row[2])
+        params["algorithm"] = row[0]
+        params["salt"] = row[1]
+        return params
+
+    def _writeKdfParams(self, kdf_params: dict) -> None:
+        """store key derivation settings, the caller commits"""
+        cost = {k: v for k, v in kdf_params.items() if k not in ("algorithm", "salt")}
+        self.conn.execute(SQL_WRITE_HEADER, (kdf_params["algorithm"], kdf_params.get("salt"),
+                                             json.dumps(cost, sort_keys=True)))
+
+    @synchronized
+    def reencryptVault(self, old_key: UserKey, new_key: UserKey, user_password: str,
+                       kdf_params: Optional[dict] = None, workers: Optional[int] = None,
+                       progress: Optional[Callable[[int, int], None]] = None) -> bool:
+        """Encrypt every row again with new_key, store user_password in the verifier and
+        kdf_params (if given), in one transaction: on failure nothing changes. Used to
+        change the password, to move a vault to new key derivation settings or to
+        another cipher engine. Rows are converted by worker processes, see rekey."""
+        try:
+            self.flushPendingWrites()
+            rekey.rekeyRows(self.conn, self.searchIndex, old_key, new_key, self.compress_bodies,
+                            workers, progress)
+            # the verifier holds the password itself
+            self.conn.execute("update book set book_name=? where id=1",
+                              (encryptTextToData(user_password, new_key),))
+            if kdf_params is not None:
+                self._writeKdfParams(kdf_params)
+            self.conn.commit()
+        except:
+            self.conn.rollback()
+            self.searchIndex.clear()
+            traceback.print_exc()
+            return False
+        self.titleCache.clear()
+        self.textCache.clear()
+        return True
+
+    @synchronized
+    def vacuum(self) -> None:
+        """rebuild the database file so freed space is given back"""
+        self.flushPendingWrites()
+        self.conn.execute(page_chunks.SQL_DELETE_ALL_UNUSED_CHUNKS)
+        self.conn.commit()
+        self.conn.execute("VACUUM")
+
+    @synchronized
+    def getFormatStatistics(self) -> dict:
+        """number of encrypted values and their bytes per format byte"""
+        statistics = {}
+        for table, columns in ENCRYPTED_COLUMNS.items():
+            for column in columns:
+                sql = (f"select substr({column}, 1, 1), count(*), sum(length({column})) "
+                       f"from {table} where length({column}) > 0 group by 1")
+                for first_byte, count, size in self.conn.execute(sql):
+                    format_id = first_byte[0] if isinstance(first_byte, bytes) else ord(first_byte)
+                    rows, total = statistics.get(format_id, (0, 0))
+                    statistics[format_id] = (rows + count, total + size)
+        return statistics
+
+    @synchronized
+    def createDatabase(self, user_key: UserKey, user_password: str,
+                       kdf_params: Optional[dict] = None) -> bool:
+        """create database"""
+        try:
+            createTable(self.conn, SQL_CREATE_BOOK_TABLE)
+            createTable(self.conn, SQL_CREATE_PAGE_TABLE)
+            migrateDatabase(self.conn)
+            # insert first book (this is a special book not visible to the user)
+            encrypted_data = encryptTextToData(user_password, user_key)
+            self.conn.execute(SQL_INSERT_BOOK, (encrypted_data, "",))
+            if kdf_params is not None:
+                self._writeKdfParams(kdf_params)
+            self.conn.commit()
+        except:
+            self.conn.rollback()
+            traceback.print_exc()
+            return False
+        return True
+
+    @synchronized
+    def verifyDatabasePassword(self, user_key: UserKey, user_password: str) -> bool:
+        """verify db pass"""
+        try:
             # read book name from the first record
-            cur = conn.cursor()
-            cur.execute("SELECT book_name from book where id = ?", (1,))
-            record = cur.fetchall()
-            for row in record:
-                # get encrypted blob
-                encrypted_data = row[0]
+            encrypted_data = self._readOne(SQL_READ_VERIFIER, (1,))
+            if encrypted_data is not None:
                 # do decrypt and validate
                 decrypted_text = decryptDataToText(encrypted_data, user_key)
                 if decrypted_text != user_password:
                     print("stored password does not match with provided pass")
                     return False
-        else:
+        except:
+            traceback.print_exc()
             return False
+        return True
+
+
+# ****************** default session used by the module level functions
+_defaultSession: Optional[StorageSession] = None
+
+def getDefaultSession() -> StorageSession:
+    """return the application wide session, opening it on first use"""
+    global _defaultSession
+    if _defaultSession is None:
+        _defaultSession = StorageSession(DATABASE_NAME)
+    return _defaultSession
+
+def closeDefaultSession() -> None:
+    """close the application wide session"""
+    global _defaultSession
+    if _defaultSession is not None:
+        _defaultSession.close()
+        _defaultSession = None
+
+
+def updatePageText(user_key: UserKey, page_id: int, new_text: str) -> None:
+    """update text of page row"""
+    getDefaultSession().updatePageText(user_key, page_id, new_text)
+
+def updateBookText(user_key: UserKey, book_id: int, new_text: str) -> None:
+    """update text of book row"""
+    getDefaultSession().updateBookText(user_key, book_id, new_text)
+
+def updatePageName(user_key: UserKey, page_id: int, new_name: str) -> None:
+    """update page name"""
+    getDefaultSession().updatePageName(user_key, page_id, new_name)
+
+def updateBookName(user_key: UserKey, book_id: int, new_name: str) -> None:
+    """update book name"""
+    getDefaultSession().updateBookName(user_key, book_id, new_name)
+
+def deletePage(user_key: UserKey, page_id: int) -> None:
+    """delete page"""
+    getDefaultSession().deletePage(user_key, page_id)
+
+def deleteBook(user_key: UserKey, book_id: int) -> None:
+    """delete book"""
+    getDefaultSession().deleteBook(user_key, book_id)
+
+def getBookName(user_key: UserKey, book_id: int) -> str:
+    """read book name"""
+    return getDefaultSession().getBookName(user_key, book_id)
+
+def getBookText(user_key: UserKey, book_id) -> str:
+    """get book text"""
+    return getDefaultSession().getBookText(user_key, book_id)
+
+def getPageText(user_key: UserKey, page_id) -> str:
+    """get page text"""
+    return getDefaultSession().getPageText(user_key, page_id)
+
+def getBooks(user_key: UserKey) -> list:
+    """read books from database"""
+    return getDefaultSession().getBooks(user_key)
+
+def getPagesOfBook(user_key: UserKey, bookId: int) -> list:
+    """read pages of a book"""
+    return getDefaultSession().getPagesOfBook(user_key, bookId)
+
+def createBook(user_key: UserKey, book_name: str, book_text) -> int:
+    """create book"""
+    return getDefaultSession().createBook(user_key, book_name, book_text)
+
+def createPage(user_key: UserKey, book_id: int, page_name: str, page_text: str) -> int:
+    """create page"""
+    return getDefaultSession().createPage(user_key, book_id, page_name, page_text)
+
+def createDatabase(user_key: UserKey, user_password: str, kdf_params: Optional[dict] = None) -> bool:
+    """create database"""
+    try:
+        return getDefaultSession().createDatabase(user_key, user_password, kdf_params)
     except:
         traceback.print_exc()
-        return False
-    finally:
-        if conn:
-            conn.close()
-    return True
+    return False
+
+def getKdfParams() -> dict:
+    """key derivation settings of the vault"""
+    return getDefaultSession().getKdfParams()
+
+def verifyDatabasePassword(user_key: UserKey, user_password: str) -> bool:
+    """verify db pass"""
+    try:
+        return getDefaultSession().verifyDatabasePassword(user_key, user_password)
+    except:
+        traceback.print_exc()
+    return False
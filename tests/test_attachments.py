@@ -0,0 +1,110 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas_v4
+
+Tests of attachment frames """
+import os
+import tempfile
+import unittest
+
+import attachments
+from cryptography.exceptions import InvalidTag
+
+from crypto import generateUserKey, newKdfParams, KDF_PBKDF2, ENGINE_FERNET
+from storage import StorageSession
+
+PASSWORD = "test"
+
+
+class AttachmentFramesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        kdf_params = newKdfParams(KDF_PBKDF2, iterations=1000)
+        self.user_key = generateUserKey(PASSWORD, kdf_params)
+        self.session = StorageSession(os.path.join(self.tmp.name, "pages.data"))
+        self.session.createDatabase(self.user_key, PASSWORD, kdf_params)
+        book = self.session.createBook(self.user_key, "book", "")
+        self.page = self.session.createPage(self.user_key, book, "page", "text")
+
+    def tearDown(self):
+        self.session.close()
+        self.tmp.cleanup()
+
+    def attach(self, data: bytes, user_key=None) -> attachments.AttachmentInfo:
+        file_path = os.path.join(self.tmp.name, "file.bin")
+        with open(file_path, "wb") as output:
+            output.write(data)
+        attachment_id = self.session.addAttachment(user_key or self.user_key, self.page, file_path)
+        self.assertNotEqual(attachment_id, 0)
+        return self.session.getAttachment(self.user_key, attachment_id)
+
+    def readFrame(self, info: attachments.AttachmentInfo, index: int) -> bytes:
+        row, offset = info.frameLocation(index)
+        with self.session.conn.blobopen("attachment_blob", "data", row, readonly=True) as blob:
+            blob.seek(offset)
+            return blob.read(info.stored_frame_size)
+
+    def writeFrame(self, info: attachments.AttachmentInfo, index: int, frame: bytes) -> None:
+        row, offset = info.frameLocation(index)
+        with self.session.conn.blobopen("attachment_blob", "data", row) as blob:
+            blob.seek(offset)
+            blob.write(frame)
+        self.session.conn.commit()
+
+    def swapFirstFrames(self, info: attachments.AttachmentInfo) -> None:
+        first, second = self.readFrame(info, 0), self.readFrame(info, 1)
+        self.writeFrame(info, 0, second)
+        self.writeFrame(info, 1, first)
+
+    def test_range_read(self):
+        data = os.urandom(attachments.FRAME_SIZE * 2 + 1000)
+        info = self.attach(data)
+        self.assertTrue(info.bound_frames)
+        start, end = attachments.FRAME_SIZE - 10, attachments.FRAME_SIZE * 2 + 10
+        self.assertEqual(self.session.readAttachment(self.user_key, info, start, end), data[start:end])
+
+    def test_swapped_frames_fail_to_decrypt(self):
+        for engine in (None, ENGINE_FERNET):
+            user_key = self.user_key.withEngine(engine) if engine else self.user_key
+            info = self.attach(b"a" * attachments.FRAME_SIZE + b"b" * attachments.FRAME_SIZE, user_key)
+            self.swapFirstFrames(info)
+            with self.assertRaises((InvalidTag, ValueError)):
+                self.session.readAttachment(self.user_key, info, 0, 10)
+
+    def test_frame_of_another_attachment_fails_to_decrypt(self):
+        first = self.attach(b"a" * 100)
+        second = self.attach(b"b" * 100)
+        self.writeFrame(second, 0, self.readFrame(first, 0))
+        with self.assertRaises((InvalidTag, ValueError)):
+            self.session.readAttachment(self.user_key, second, 0, 100)
+
+    def test_frames_stored_before_binding_are_read(self):
+        info = self.attach(b"c" * 100)
+        self.writeFrame(info, 0, self.user_key.encrypt(b"c" * 100))
+        self.session.conn.execute("update attachment set bound_frames=0 where id=?", (info.id,))
+        self.session.conn.commit()
+        info = self.session.getAttachment(self.user_key, info.id)
+        self.assertEqual(self.session.readAttachment(self.user_key, info, 0, 100), b"c" * 100)
+
+    def test_rekey_binds_frames_stored_before_binding(self):
+        size = attachments.FRAME_SIZE
+        data = os.urandom(size * 2 + 100)
+        info = self.attach(data)
+        for index in range(3):
+            self.writeFrame(info, index, self.user_key.encrypt(data[index * size:(index + 1) * size]))
+        self.session.conn.execute("update attachment set bound_frames=0 where id=?", (info.id,))
+        self.session.conn.commit()
+        new_key = generateUserKey("new", newKdfParams(KDF_PBKDF2, iterations=1000))
+        self.assertTrue(self.session.reencryptVault(self.user_key, new_key, "new", workers=0))
+        info = self.session.getAttachment(new_key, info.id)
+        self.assertTrue(info.bound_frames)
+        self.assertEqual(self.session.readAttachment(new_key, info, 0, info.size), data)
+        self.swapFirstFrames(info)
+        with self.assertRaises((InvalidTag, ValueError)):
+            self.session.readAttachment(new_key, info, 0, 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
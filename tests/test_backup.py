@@ -0,0 +1,113 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas_v4
+
+Tests of backups, archive export and restore """
+import os
+import tempfile
+import unittest
+
+import backup
+from crypto import generateUserKey, newKdfParams, KDF_PBKDF2
+from storage import StorageSession
+
+PASSWORD = "test"
+
+
+class BackupTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.kdf_params = newKdfParams(KDF_PBKDF2, iterations=1000)
+        self.user_key = generateUserKey(PASSWORD, self.kdf_params)
+        # small pages are stored in chunks too, archives hold both layouts
+        self.session = StorageSession(self.path("pages.data"), chunked_page_size=2000)
+        self.session.createDatabase(self.user_key, PASSWORD, self.kdf_params)
+        for number in range(3):
+            book = self.session.createBook(self.user_key, f"book {number}", f"about book {number}")
+            for page in range(5):
+                text = f"page {page} of book {number} ñandú 😀\n" + "some text\n" * (page * 100)
+                self.session.createPage(self.user_key, book, f"page {page}", text)
+        self.queued = self.session.getPageIdsOfBook(2)[0]
+        self.session.queuePageText(self.user_key, self.queued, "saved but still queued")
+        self.expected = self.contents(self.session, self.user_key)
+
+    def tearDown(self):
+        self.session.close()
+        self.tmp.cleanup()
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.tmp.name, name)
+
+    def contents(self, session: StorageSession, user_key) -> dict:
+        """{book name: (book text, {page name: page text})}"""
+        books = {}
+        for book_id in session.getBookIds():
+            pages = {name: session.getPageText(user_key, page_id)
+                     for page_id, name in session.getTitles(user_key, "page", session.getPageIdsOfBook(book_id))}
+            books[session.getBookName(user_key, book_id)] = (session.getBookText(user_key, book_id), pages)
+        return books
+
+    def restored(self, dbfile: str, password: str) -> dict:
+        session = StorageSession(dbfile)
+        try:
+            user_key = generateUserKey(password, session.getKdfParams())
+            self.assertTrue(session.verifyDatabasePassword(user_key, password))
+            self.assertEqual(len(session.findPages(user_key, "ñandú")), 14)
+            self.assertEqual([hit[1] for hit in session.findPages(user_key, "queued")], [self.queued])
+            return self.contents(session, user_key)
+        finally:
+            session.close()
+
+    def test_raw_archive_round_trip(self):
+        archive = self.path("vault.bak")
+        counts = backup.exportArchive(self.session, archive, workers=0)
+        self.assertEqual(counts["books"], 3)
+        self.assertEqual(counts["pages"], 15)
+        header = backup.readArchiveHeader(archive)
+        self.assertEqual(header["mode"], backup.MODE_RAW)
+        self.assertEqual(header["kdf"], self.session.getKdfParams())
+        backup.restoreArchive(archive, self.path("restored.data"), self.user_key, self.user_key, PASSWORD,
+                              header["kdf"], workers=0)
+        self.assertEqual(self.restored(self.path("restored.data"), PASSWORD), self.expected)
+
+    def test_reencrypted_archive_round_trip(self):
+        archive = self.path("vault.bak")
+        backup_kdf = newKdfParams(KDF_PBKDF2, iterations=1000)
+        backup_key = generateUserKey("backup", backup_kdf)
+        backup.exportArchive(self.session, archive, backup.MODE_REENCRYPTED, self.user_key, backup_key,
+                             "backup", backup_kdf, workers=2)
+        kdf_params = newKdfParams(KDF_PBKDF2, iterations=1000)
+        vault_key = generateUserKey("restored", kdf_params)
+        backup.restoreArchive(archive, self.path("restored.data"), backup_key, vault_key, "restored",
+                              kdf_params, workers=2)
+        self.assertEqual(self.restored(self.path("restored.data"), "restored"), self.expected)
+
+    def test_damaged_archive_restores_nothing(self):
+        archive = self.path("vault.bak")
+        backup.exportArchive(self.session, archive, workers=0)
+        with open(archive, "r+b") as data:
+            data.seek(os.path.getsize(archive) // 2)
+            byte = data.read(1)
+            data.seek(-1, os.SEEK_CUR)
+            data.write(bytes([byte[0] ^ 0xFF]))
+        with self.assertRaises(ValueError):
+            backup.restoreArchive(archive, self.path("restored.data"), self.user_key, self.user_key, PASSWORD,
+                                  self.kdf_params, workers=0)
+        self.assertFalse(os.path.exists(self.path("restored.data")))
+        self.assertFalse(os.path.exists(self.path("restored.data.partial")))
+
+    def test_hot_backup_opens_with_the_same_password(self):
+        backup.hotBackup(self.session, self.path("copy.data"))
+        self.assertEqual(self.restored(self.path("copy.data"), PASSWORD), self.expected)
+
+    def test_markdown_export(self):
+        counts = backup.exportMarkdown(self.session, self.user_key, self.path("markdown"), workers=0)
+        self.assertEqual((counts["books"], counts["pages"]), (3, 15))
+        with open(self.path(os.path.join("markdown", "book 1", "page 2.md")), encoding="utf-8") as page:
+            self.assertEqual(page.read(), self.expected["book 1"][1]["page 2"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas_v4
+
+Tests of the cipher engines and their storage formats """
+import os
+import unittest
+
+from cryptography.exceptions import InvalidTag
+
+from crypto import UserKey, FernetEngine, detectFormat, formatName, encryptTextToData, decryptDataToText, \
+    chooseCompression, ENGINE_AESGCM, ENGINE_CHACHA20, ENGINE_FERNET, FORMAT_AESGCM, FORMAT_CHACHA20, \
+    FORMAT_FERNET, COMPRESSION_NONE, COMPRESSION_ZLIB, COMPRESSION_LZMA, COMPRESS_MIN_SIZE, LZMA_MIN_SIZE
+
+KEY_BYTES = bytes(range(32))
+
+
+class FormatTest(unittest.TestCase):
+
+    def test_each_engine_writes_its_format(self):
+        for engine, format_id in ((ENGINE_FERNET, FORMAT_FERNET), (ENGINE_AESGCM, FORMAT_AESGCM),
+                                  (ENGINE_CHACHA20, FORMAT_CHACHA20)):
+            data = UserKey(KEY_BYTES, engine).encrypt(b"some text")
+            self.assertEqual(detectFormat(data), (format_id, COMPRESSION_NONE))
+            self.assertEqual(formatName(data[0]), engine)
+
+    def test_any_format_is_read_with_the_same_key(self):
+        texts = {engine: encryptTextToData(f"written by {engine}", UserKey(KEY_BYTES, engine))
+                 for engine in (ENGINE_FERNET, ENGINE_AESGCM, ENGINE_CHACHA20)}
+        reader = UserKey(KEY_BYTES)
+        for engine, data in texts.items():
+            self.assertEqual(decryptDataToText(data, reader), f"written by {engine}")
+
+    def test_unknown_or_empty_data_is_rejected(self):
+        key = UserKey(KEY_BYTES)
+        with self.assertRaises(ValueError):
+            detectFormat(b"")
+        with self.assertRaises(ValueError):
+            key.decrypt(bytes([0x0F]) + os.urandom(40))
+
+    def test_format_byte_is_authenticated(self):
+        data = bytearray(UserKey(KEY_BYTES, ENGINE_AESGCM).encrypt(b"some text"))
+        data[0] = FORMAT_CHACHA20
+        with self.assertRaises(InvalidTag):
+            UserKey(KEY_BYTES).decrypt(bytes(data))
+
+
+class CompressionTest(unittest.TestCase):
+
+    def test_compression_round_trip_in_the_format_nibble(self):
+        data = b"a compressible line of text\n" * 1000
+        for engine in (ENGINE_AESGCM, ENGINE_CHACHA20):
+            key = UserKey(KEY_BYTES, engine)
+            for compression in (COMPRESSION_ZLIB, COMPRESSION_LZMA):
+                encrypted = key.encrypt(data, compression)
+                self.assertEqual(detectFormat(encrypted), (key.writer.format_id, compression))
+                self.assertLess(len(encrypted), len(data))
+                self.assertEqual(UserKey(KEY_BYTES).decrypt(encrypted), data)
+                self.assertTrue(formatName(encrypted[0]).endswith("+" + ("zlib", "lzma")[compression - 1]))
+
+    def test_incompressible_data_is_stored_plain(self):
+        data = os.urandom(4096)
+        encrypted = UserKey(KEY_BYTES).encrypt(data, COMPRESSION_ZLIB)
+        self.assertEqual(detectFormat(encrypted)[1], COMPRESSION_NONE)
+        self.assertEqual(UserKey(KEY_BYTES).decrypt(encrypted), data)
+
+    def test_fernet_is_never_compressed(self):
+        key = UserKey(KEY_BYTES, ENGINE_FERNET)
+        data = b"x" * 10000
+        encrypted = key.encrypt(data, COMPRESSION_ZLIB)
+        self.assertEqual(detectFormat(encrypted), (FORMAT_FERNET, COMPRESSION_NONE))
+        self.assertEqual(key.decrypt(encrypted), data)
+        with self.assertRaises(ValueError):
+            FernetEngine(KEY_BYTES).encrypt(data, COMPRESSION_ZLIB)
+
+    def test_compressed_text_round_trip(self):
+        text = "página con acentos y 😀\n" * 2000
+        key = UserKey(KEY_BYTES)
+        self.assertEqual(decryptDataToText(encryptTextToData(text, key, compress=True), key), text)
+        self.assertEqual(chooseCompression(COMPRESS_MIN_SIZE - 1), COMPRESSION_NONE)
+        self.assertEqual(chooseCompression(COMPRESS_MIN_SIZE), COMPRESSION_ZLIB)
+        self.assertEqual(chooseCompression(LZMA_MIN_SIZE), COMPRESSION_LZMA)
+
+
+if __name__ == "__main__":
+    unittest.main()
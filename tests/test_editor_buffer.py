@@ -0,0 +1,130 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas_v4
+
+Tests of the python side copy of the editor text """
+import unittest
+
+from editor_buffer import TextBuffer, DirtyTracker
+
+
+class TextBufferTest(unittest.TestCase):
+
+    def test_columns_are_utf16_code_units(self):
+        # each emoji is two UTF-16 code units, CodeMirror columns count both
+        buffer = TextBuffer("a😀b😀c\nsecond")
+        self.assertTrue(buffer.applyChanges(0, [[0, 3, 0, 4, "B"]]))
+        self.assertEqual(buffer.getText(), "a😀B😀c\nsecond")
+        self.assertTrue(buffer.applyChanges(1, [[0, 4, 0, 6, ""], [0, 1, 0, 1, "𝄞"]]))
+        self.assertEqual(buffer.getText(), "a𝄞😀Bc\nsecond")
+        self.assertEqual(buffer.revision, 3)
+
+    def test_change_across_lines(self):
+        buffer = TextBuffer("one 😀\r\ntwo\nthree")
+        self.assertTrue(buffer.applyChanges(0, [[0, 4, 2, 2, "x\ny"]]))
+        self.assertEqual(buffer.getText(), "one x\nyree")
+
+    def test_batch_on_another_revision_is_refused(self):
+        buffer = TextBuffer("text")
+        self.assertFalse(buffer.applyChanges(1, [[0, 0, 0, 0, "x"]]))
+        self.assertEqual(buffer.getText(), "text")
+        self.assertEqual(buffer.revision, 0)
+
+    def test_failed_batch_changes_nothing(self):
+        buffer = TextBuffer("first\nsecond")
+        self.assertFalse(buffer.applyChanges(0, [[0, 0, 0, 0, "x"], [5, 0, 5, 0, "y"]]))
+        self.assertEqual(buffer.getText(), "first\nsecond")
+        self.assertEqual(buffer.revision, 0)
+
+
+class SaveWaiterTest(unittest.TestCase):
+
+    def test_save_waits_for_the_flushed_revision(self):
+        buffer = TextBuffer("text")
+        saved = []
+        buffer.addWaiter(saved.append)
+        buffer.flushed(2)  # the editor sent two edits not received yet
+        self.assertEqual(saved, [])
+        self.assertTrue(buffer.applyChanges(0, [[0, 4, 0, 4, "!"]]))
+        self.assertEqual(saved, [])
+        self.assertTrue(buffer.applyChanges(1, [[0, 0, 0, 0, "a "]]))
+        self.assertEqual(saved, ["a text!"])
+        self.assertEqual(buffer.waiters, [])
+
+    def test_document_no_longer_shown_saves_at_once(self):
+        buffer = TextBuffer("text")
+        saved = []
+        buffer.addWaiter(saved.append)
+        buffer.flushed(-1)
+        self.assertEqual(saved, ["text"])
+
+    def test_resync_fires_waiters(self):
+        buffer = TextBuffer("old")
+        saved = []
+        buffer.addWaiter(saved.append)
+        buffer.flushed(5)
+        buffer.reset("new text", 5)
+        self.assertEqual(saved, ["new text"])
+
+    def test_waiter_finished_early(self):
+        buffer = TextBuffer("text")
+        saved = []
+        waiter = buffer.addWaiter(saved.append)
+        buffer.finishWaiter(waiter)
+        buffer.flushed(0)
+        self.assertEqual(saved, ["text"])
+
+
+class LargeDocumentTest(unittest.TestCase):
+
+    def test_edits_far_into_a_large_document(self):
+        lines = [f"log line {number}" for number in range(50000)]
+        buffer = TextBuffer("\n".join(lines))
+        self.assertTrue(buffer.applyChanges(0, [[49999, 0, 49999, 3, "LOG"], [25000, 9, 25001, 0, ""]]))
+        lines[49999] = "LOG" + lines[49999][3:]
+        lines[25000:25002] = [lines[25000][:9] + lines[25001]]
+        self.assertEqual(buffer.getText(), "\n".join(lines))
+
+    def test_paste_of_many_lines(self):
+        buffer = TextBuffer("before\nafter")
+        pasted = "\n".join(f"pasted {number}" for number in range(10000))
+        self.assertTrue(buffer.applyChanges(0, [[0, 6, 1, 0, "\n" + pasted + "\n"]]))
+        self.assertEqual(len(buffer.lines), 10002)
+        self.assertEqual(buffer.getText(), "before\n" + pasted + "\nafter")
+
+
+class DirtyTrackerTest(unittest.TestCase):
+
+    def test_crlf_text_shown_unchanged_needs_no_save(self):
+        stored = "first line\r\nsecond line\r\n\r\nlast\rline"
+        tracker = DirtyTracker()
+        tracker.loaded(("page", 1), stored)
+        # what the editor sends back for the same text
+        self.assertFalse(tracker.needsSave(("page", 1), TextBuffer(stored).getText()))
+        self.assertEqual(tracker.savesSkipped, 1)
+
+    def test_edited_crlf_text_needs_save(self):
+        tracker = DirtyTracker()
+        tracker.loaded(("page", 1), "a\r\nb")
+        self.assertTrue(tracker.needsSave(("page", 1), "a\nb\nc"))
+        self.assertFalse(tracker.needsSave(("page", 1), "a\nb\nc"))
+
+    def test_documents_are_tracked_apart(self):
+        tracker = DirtyTracker()
+        tracker.loaded(("page", 1), "same text")
+        tracker.loaded(("book", 1), "other text")
+        self.assertFalse(tracker.needsSave(("page", 1), "same text"))
+        self.assertTrue(tracker.needsSave(("book", 1), "same text"))
+        self.assertTrue(tracker.needsSave(("page", 2), "same text"))
+        self.assertEqual((tracker.savesWritten, tracker.savesSkipped), (2, 1))
+
+    def test_forgotten_document_is_saved(self):
+        tracker = DirtyTracker()
+        tracker.loaded(("page", 1), "text")
+        tracker.forget(("page", 1))
+        self.assertTrue(tracker.needsSave(("page", 1), "text"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas_v4
+
+Tests of the markdown folder import """
+import os
+import tempfile
+import unittest
+
+from crypto import generateUserKey, newKdfParams, KDF_PBKDF2
+from markdown_import import importMarkdown
+from storage import StorageSession
+
+PASSWORD = "test"
+
+
+class ImportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        kdf_params = newKdfParams(KDF_PBKDF2, iterations=1000)
+        self.user_key = generateUserKey(PASSWORD, kdf_params)
+        self.session = StorageSession(os.path.join(self.tmp.name, "pages.data"))
+        self.session.createDatabase(self.user_key, PASSWORD, kdf_params)
+
+    def tearDown(self):
+        self.session.close()
+        self.tmp.cleanup()
+
+    def writeTree(self, pages: dict) -> str:
+        folder = os.path.join(self.tmp.name, "notes", "Imported")
+        os.makedirs(folder)
+        for name, text in pages.items():
+            with open(os.path.join(folder, name + ".md"), "w", encoding="utf-8") as output:
+                output.write(text)
+        return os.path.dirname(folder)
+
+    def test_import_does_not_reuse_deleted_page_ids(self):
+        session, key = self.session, self.user_key
+        book = session.createBook(key, "book", "")
+        session.createPage(key, book, "first", "apple")
+        deleted = session.createPage(key, book, "second", "secretword banana")
+        session.deletePage(key, deleted)
+        importMarkdown(session, key, self.writeTree({"new": "cherry"}), workers=0)
+        self.assertNotIn(deleted, session.getPageIdsOfBook(session.getBookIds()[-1]))
+        self.assertEqual(session.findPages(key, "secretword"), [])
+        self.assertEqual(session.findPages(key, "banana"), [])
+        # later pages do not take the ids of the imported ones
+        imported = [page_id for _, page_id, _ in session.findPages(key, "cherry")]
+        self.assertEqual(len(imported), 1)
+        self.assertGreater(imported[0], deleted)
+        self.assertGreater(session.createPage(key, book, "third", "date"), imported[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas_v4
+
+Tests of the schema migrations, from a vault written by the first version """
+import contextlib
+import io
+import os
+import sqlite3
+import tempfile
+import unittest
+
+import text_labels
+from crypto import generateUserKey, legacyKdfParams, encryptTextToData
+from storage import (StorageSession, SCHEMA_VERSION, SQL_CREATE_BOOK_TABLE, SQL_CREATE_PAGE_TABLE,
+                     getSchemaVersion, tableExists)
+
+PASSWORD = "test"
+
+
+class MigrationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dbfile = os.path.join(self.tmp.name, "pages.data")
+        self.user_key = generateUserKey(PASSWORD, legacyKdfParams())
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def writeVersion0(self, pages: list) -> None:
+        """a vault as the first version wrote it: the verifier book, one book, and
+        pages given as (book_id, text)"""
+        key = self.user_key
+        conn = sqlite3.connect(self.dbfile)
+        conn.execute(SQL_CREATE_BOOK_TABLE)
+        conn.execute(SQL_CREATE_PAGE_TABLE)
+        conn.execute("insert into book(book_name, book_text) values(?, '')", (encryptTextToData(PASSWORD, key),))
+        conn.execute("insert into book(book_name, book_text) values(?, ?)",
+                     (encryptTextToData("book", key), encryptTextToData("book text", key)))
+        for book_id, text in pages:
+            conn.execute("insert into page(book_id, page_name, page_text) values(?, ?, ?)",
+                         (book_id, encryptTextToData("page", key), encryptTextToData(text, key)))
+        conn.commit()
+        conn.close()
+
+    def test_version0_vault_is_upgraded(self):
+        self.writeVersion0([(2, "first page"), (2, "second page")])
+        session = StorageSession(self.dbfile)
+        try:
+            self.assertEqual(getSchemaVersion(session.conn), SCHEMA_VERSION)
+            for table in ("search_document", "page_chunk", "page_revision", "attachment"):
+                self.assertTrue(tableExists(session.conn, table), table)
+            self.assertTrue(session.verifyDatabasePassword(self.user_key, PASSWORD))
+            self.assertEqual(session.getBookIds(), [2])
+            self.assertEqual([session.getPageText(self.user_key, page_id) for page_id in session.getPageIdsOfBook(2)],
+                             ["first page", "second page"])
+            # older pages are indexed once the vault is unlocked
+            self.assertEqual(session.indexMissingPages(self.user_key), 2)
+            self.assertEqual(len(session.findPages(self.user_key, "second")), 1)
+        finally:
+            session.close()
+
+    def test_pages_without_a_book_are_kept(self):
+        self.writeVersion0([(2, "kept"), (9, "orphan of a deleted book"), (None, "orphan without book")])
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            session = StorageSession(self.dbfile)
+        try:
+            self.assertIn("2 pages without a book", output.getvalue())
+            self.assertEqual(session.nameRecoveredBooks(self.user_key), 1)
+            self.assertEqual(session.nameRecoveredBooks(self.user_key), 0)
+            self.assertTrue(session.verifyDatabasePassword(self.user_key, PASSWORD))
+            recovered = [book_id for book_id in session.getBookIds() if book_id != 2]
+            self.assertEqual(len(recovered), 1)
+            self.assertGreater(recovered[0], 9)
+            self.assertEqual(session.getBookName(self.user_key, recovered[0]), text_labels.RECOVERED_BOOK_NAME)
+            texts = sorted(session.getPageText(self.user_key, page_id)
+                           for page_id in session.getPageIdsOfBook(recovered[0]))
+            self.assertEqual(texts, ["orphan of a deleted book", "orphan without book"])
+            self.assertEqual(session.conn.execute("PRAGMA foreign_key_check").fetchall(), [])
+        finally:
+            session.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas_v4
+
+Tests of the chunked storage of big pages """
+import os
+import random
+import tempfile
+import unittest
+
+import page_chunks
+from crypto import generateUserKey, newKdfParams, KDF_PBKDF2
+from page_chunks import CHUNK_MAX_CHARS, CHUNK_MIN_CHARS, chunkText, readChunkedText, readManifest, \
+    writeChunkedText
+from storage import StorageSession
+
+PASSWORD = "test"
+
+
+def bigText(lines: int, seed: int = 1) -> str:
+    generator = random.Random(seed)
+    return "".join(f"line {number} {generator.random()}\n" for number in range(lines))
+
+
+class ChunkTextTest(unittest.TestCase):
+
+    def test_chunks_rebuild_the_text(self):
+        text = bigText(20000)
+        chunks = chunkText(text)
+        self.assertEqual("".join(chunks), text)
+        self.assertGreater(len(chunks), 2)
+        for chunk in chunks[:-1]:
+            self.assertTrue(CHUNK_MIN_CHARS <= len(chunk) <= CHUNK_MAX_CHARS)
+        self.assertEqual(chunkText(""), [""])
+
+    def test_long_line_is_cut(self):
+        text = "x" * (CHUNK_MAX_CHARS * 2 + 10)
+        chunks = chunkText(text)
+        self.assertEqual([len(chunk) for chunk in chunks], [CHUNK_MAX_CHARS, CHUNK_MAX_CHARS, 10])
+
+    def test_edit_changes_only_nearby_chunks(self):
+        text = bigText(20000)
+        lines = text.splitlines(keepends=True)
+        lines[10000] = "an edited line\n"
+        before = chunkText(text)
+        after = chunkText("".join(lines))
+        self.assertLessEqual(len(set(after).difference(before)), 2)
+
+
+class WriteChunkedTextTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        kdf_params = newKdfParams(KDF_PBKDF2, iterations=1000)
+        self.user_key = generateUserKey(PASSWORD, kdf_params)
+        self.session = StorageSession(os.path.join(self.tmp.name, "pages.data"))
+        self.session.createDatabase(self.user_key, PASSWORD, kdf_params)
+        book = self.session.createBook(self.user_key, "book", "")
+        self.first = self.session.createPage(self.user_key, book, "first", "")
+        self.second = self.session.createPage(self.user_key, book, "second", "")
+        self.conn = self.session.conn
+
+    def tearDown(self):
+        self.conn.commit()
+        self.session.close()
+        self.tmp.cleanup()
+
+    def chunkCount(self) -> int:
+        return self.conn.execute("select count(*) from chunk").fetchone()[0]
+
+    def test_equal_chunks_are_stored_once(self):
+        text = bigText(20000)
+        written = writeChunkedText(self.conn, self.user_key, self.first, text)
+        self.assertEqual(written, len(chunkText(text)))
+        self.assertEqual(writeChunkedText(self.conn, self.user_key, self.second, text), 0)
+        self.assertEqual(self.chunkCount(), written)
+        self.assertEqual(readChunkedText(self.conn, self.user_key, self.second), text)
+
+    def test_edit_updates_only_changed_manifest_positions(self):
+        text = bigText(20000)
+        writeChunkedText(self.conn, self.user_key, self.first, text)
+        before = readManifest(self.conn, self.first)
+        lines = text.splitlines(keepends=True)
+        lines[10000] = "an edited line\n"
+        edited = "".join(lines)
+        self.assertLessEqual(writeChunkedText(self.conn, self.user_key, self.first, edited), 2)
+        after = readManifest(self.conn, self.first)
+        self.assertEqual(len(after), len(before))
+        self.assertLessEqual(sum(old != new for old, new in zip(before, after)), 2)
+        self.assertEqual(readChunkedText(self.conn, self.user_key, self.first), edited)
+        # the replaced chunks are no longer stored
+        self.assertEqual(self.chunkCount(), len(set(after)))
+
+    def test_shrinking_trims_manifest_and_keeps_shared_chunks(self):
+        text = bigText(20000)
+        writeChunkedText(self.conn, self.user_key, self.first, text)
+        writeChunkedText(self.conn, self.user_key, self.second, text)
+        stored = self.chunkCount()
+        short = bigText(10)
+        writeChunkedText(self.conn, self.user_key, self.first, short)
+        self.assertEqual(len(readManifest(self.conn, self.first)), 1)
+        self.assertEqual(readChunkedText(self.conn, self.user_key, self.first), short)
+        # the second page still uses every chunk of the long text
+        self.assertEqual(self.chunkCount(), stored + 1)
+        self.assertEqual(readChunkedText(self.conn, self.user_key, self.second), text)
+        page_chunks.removeChunkedText(self.conn, self.second)
+        self.assertEqual(self.chunkCount(), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
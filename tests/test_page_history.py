@@ -0,0 +1,118 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas_v4
+
+Tests of the page revision history """
+import os
+import tempfile
+import unittest
+
+import page_history
+from crypto import generateUserKey, newKdfParams, KDF_PBKDF2
+from page_history import REVISION_DELTA, REVISION_SNAPSHOT
+from storage import StorageSession
+
+PASSWORD = "test"
+DAY = 86400
+
+
+def pageText(version: int) -> str:
+    lines = [f"line {number}\n" for number in range(50)]
+    lines[version % 50] = f"edited in version {version}\n"
+    return "".join(lines)
+
+
+class PageHistoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        kdf_params = newKdfParams(KDF_PBKDF2, iterations=1000)
+        self.user_key = generateUserKey(PASSWORD, kdf_params)
+        self.session = StorageSession(os.path.join(self.tmp.name, "pages.data"))
+        self.session.createDatabase(self.user_key, PASSWORD, kdf_params)
+        book = self.session.createBook(self.user_key, "book", "")
+        self.page = self.session.createPage(self.user_key, book, "page", "")
+        self.conn = self.session.conn
+        self.current = ""
+
+    def tearDown(self):
+        self.conn.commit()
+        self.session.close()
+        self.tmp.cleanup()
+
+    def replace(self, text: str, now: float):
+        revision = page_history.recordRevision(self.conn, self.user_key, self.page, self.current, text, now)
+        self.current = text
+        return revision
+
+    def read(self, revision: int) -> str:
+        return page_history.readRevision(self.conn, self.user_key, self.page, revision, lambda: self.current)
+
+    def test_delta_chain_rebuilds_every_version(self):
+        count = page_history.HISTORY_MAX_CHAIN * 2 + 5
+        texts = {}
+        previous = ""
+        for version in range(count):
+            text = pageText(version)
+            revision = self.replace(text, version * 1000.0)
+            if revision is not None:
+                texts[revision] = previous
+            previous = text
+        self.assertEqual(len(texts), count)
+        kinds = [row[2] for row in page_history.listRevisions(self.conn, self.page)]
+        self.assertIn(REVISION_DELTA, kinds)
+        self.assertGreater(kinds.count(REVISION_SNAPSHOT), 1)
+        run = longest = 0
+        for kind in kinds:
+            run = run + 1 if kind == REVISION_DELTA else 0
+            longest = max(longest, run)
+        self.assertLess(longest, page_history.HISTORY_MAX_CHAIN)
+        for revision, text in texts.items():
+            self.assertEqual(self.read(revision), text)
+        self.assertIsNone(self.read(count + 10))
+
+    def test_short_lived_version_is_coalesced(self):
+        shared = "".join(f"shared line {number}\n" for number in range(40))
+        self.assertEqual(self.replace("first\n" + shared, 0.0), 1)
+        self.assertEqual(self.replace("second\n" + shared, 1000.0), 2)
+        self.assertEqual(self.replace("third\n" + shared, 2000.0), 3)
+        # "third" lived ten seconds, it is not kept and the delta of revision 3 now starts from "fourth"
+        self.assertIsNone(self.replace("fourth\n" + shared, 2010.0))
+        self.assertEqual([row[2] for row in page_history.listRevisions(self.conn, self.page)],
+                         [REVISION_SNAPSHOT, REVISION_DELTA, REVISION_DELTA])
+        self.assertEqual(self.read(3), "second\n" + shared)
+        self.assertEqual(self.read(2), "first\n" + shared)
+        self.assertEqual(self.read(1), "")
+
+    def test_revisions_to_keep(self):
+        now = 1000 * DAY
+        revisions = [(1, now - 200 * DAY), (2, now - 10 * DAY + 10), (3, now - 10 * DAY + 20),
+                     (4, now - 3 * DAY), (5, now - DAY), (6, now - 60)]
+        self.assertEqual(page_history.revisionsToKeep(revisions, now), {3, 4, 5, 6})
+
+    def test_thinning_keeps_kept_versions_readable(self):
+        now = 1000 * DAY
+        texts = {}
+        previous = ""
+        # one version an hour for four days, the first two days are thinned to one a day
+        for hour in range(4 * 24):
+            text = pageText(hour)
+            revision = self.replace(text, now - (4 * 24 - hour) * 3600)
+            if revision is not None:
+                texts[revision] = previous
+            previous = text
+        # recordRevision thins every HISTORY_THIN_EVERY revisions, this thins the rest
+        page_history.thinRevisions(self.conn, self.user_key, self.page, self.current, now)
+        rows = page_history.listRevisions(self.conn, self.page)
+        kept = [row[0] for row in rows]
+        self.assertEqual(set(kept), page_history.revisionsToKeep([row[:2] for row in rows], now))
+        older = [row for row in rows if now - row[1] > page_history.HISTORY_KEEP_ALL_SECONDS]
+        self.assertEqual(len(older), len({int(row[1] // DAY) for row in older}))
+        self.assertLess(len(kept), len(texts))
+        for revision in kept:
+            self.assertEqual(self.read(revision), texts[revision])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas_v4
+
+Tests of re-keying a vault (password change) """
+import os
+import tempfile
+import unittest
+
+import page_chunks
+from crypto import generateUserKey, newKdfParams, KDF_PBKDF2, ENGINE_CHACHA20
+from storage import StorageSession
+
+PASSWORD = "test"
+NEW_PASSWORD = "new password"
+
+
+class RekeyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        kdf_params = newKdfParams(KDF_PBKDF2, iterations=1000)
+        self.user_key = generateUserKey(PASSWORD, kdf_params)
+        # small pages are stored in chunks too
+        self.session = StorageSession(os.path.join(self.tmp.name, "pages.data"), chunked_page_size=2000)
+        self.session.createDatabase(self.user_key, PASSWORD, kdf_params)
+        session, key = self.session, self.user_key
+        self.book = session.createBook(key, "book", "book text")
+        self.pages = {}
+        for number in range(10):
+            text = f"page {number} walrus\n" + "line of text\n" * (number * 50)
+            self.pages[session.createPage(key, self.book, f"page {number}", text)] = text
+        self.chunked = next(page for page, text in self.pages.items() if len(text) >= 2000)
+        # an older version of the chunked page in its history
+        session.updatePageText(key, self.chunked, self.pages[self.chunked] + "edited\n")
+        self.history_text = self.pages[self.chunked]
+        self.pages[self.chunked] += "edited\n"
+        file_path = os.path.join(self.tmp.name, "file.bin")
+        self.attachment_data = os.urandom(600 * 1024)
+        with open(file_path, "wb") as output:
+            output.write(self.attachment_data)
+        self.attachment = session.addAttachment(key, self.chunked, file_path)
+        self.assertNotEqual(self.attachment, 0)
+        self.new_kdf = newKdfParams(KDF_PBKDF2, iterations=2000)
+        self.new_key = generateUserKey(NEW_PASSWORD, self.new_kdf)
+
+    def tearDown(self):
+        self.session.close()
+        self.tmp.cleanup()
+
+    def assertVaultReadsWith(self, user_key, password: str) -> None:
+        session = self.session
+        self.assertTrue(session.verifyDatabasePassword(user_key, password))
+        self.assertEqual(session.getBookName(user_key, self.book), "book")
+        self.assertEqual(session.getBookText(user_key, self.book), "book text")
+        for page_id, text in self.pages.items():
+            self.assertEqual(session.getPageText(user_key, page_id), text)
+        revision = session.getPageHistory(self.chunked)[-1][0]
+        self.assertEqual(session.getPageRevision(user_key, self.chunked, revision), self.history_text)
+        info = session.getAttachment(user_key, self.attachment)
+        self.assertEqual(session.readAttachment(user_key, info, 0, info.size), self.attachment_data)
+        self.assertEqual(len(session.findPages(user_key, "walrus")), len(self.pages))
+        self.assertEqual(len(session.findPages(user_key, "wal", prefix=True)), len(self.pages))
+
+    def rekey(self, new_key, workers: int) -> None:
+        chunks_before = {row[0] for row in self.session.conn.execute("select id from chunk")}
+        self.assertTrue(self.session.reencryptVault(self.user_key, new_key, NEW_PASSWORD, self.new_kdf, workers))
+        self.session.titleCache.clear()
+        self.session.textCache.clear()
+        self.session.searchIndex.clear()
+        # chunk ids are keyed hashes, every one changes with the key
+        chunks_after = {row[0] for row in self.session.conn.execute("select id from chunk")}
+        self.assertEqual(len(chunks_after), len(chunks_before))
+        self.assertFalse(chunks_before & chunks_after)
+        self.assertEqual(page_chunks.readManifest(self.session.conn, self.chunked),
+                         [page_chunks.chunkId(new_key, chunk) for chunk in
+                          page_chunks.chunkText(self.pages[self.chunked])])
+        self.assertEqual(self.session.getKdfParams(), self.new_kdf)
+        self.assertFalse(self.session.verifyDatabasePassword(self.user_key, PASSWORD))
+        self.assertVaultReadsWith(new_key, NEW_PASSWORD)
+
+    def test_rekey_in_process(self):
+        self.assertVaultReadsWith(self.user_key, PASSWORD)
+        self.rekey(self.new_key, workers=0)
+
+    def test_rekey_in_worker_processes_to_another_engine(self):
+        self.rekey(self.new_key.withEngine(ENGINE_CHACHA20), workers=2)
+
+    def test_failed_rekey_changes_nothing(self):
+        wrong_key = generateUserKey("wrong", self.new_kdf)
+        self.assertFalse(self.session.reencryptVault(wrong_key, self.new_key, NEW_PASSWORD, self.new_kdf, 0))
+        self.session.searchIndex.clear()
+        self.assertNotEqual(self.session.getKdfParams(), self.new_kdf)
+        self.assertVaultReadsWith(self.user_key, PASSWORD)
+
+
+if __name__ == "__main__":
+    unittest.main()
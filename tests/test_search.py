@@ -0,0 +1,89 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas_v4
+
+Tests of the full vault search """
+import os
+import tempfile
+import unittest
+
+from crypto import generateUserKey, newKdfParams, KDF_PBKDF2
+from page_chunks import PAGE_LAYOUT_CHUNKED
+from search import PageMatcher, searchVault, SEARCH_REGEX
+from storage import StorageSession
+
+PASSWORD = "test"
+
+
+class PageMatcherTest(unittest.TestCase):
+
+    def test_substring_and_snippet(self):
+        matcher = PageMatcher("needle", snippet_chars=5)
+        text = "hay hay hay needle\nhay hay"
+        span = matcher.find(text)
+        self.assertEqual(span, (12, 18))
+        self.assertEqual(matcher.snippet(text, span), "... hay needle hay ...")
+        self.assertIsNone(matcher.find("Needle"))
+
+    def test_ignore_case_and_regex(self):
+        self.assertEqual(PageMatcher("NEEDLE", ignore_case=True).find("a needle"), (2, 8))
+        self.assertEqual(PageMatcher("a+\\.b", SEARCH_REGEX).find("x aaa.b"), (2, 7))
+        self.assertEqual(PageMatcher("needle.", ignore_case=True).find("NEEDLEx needle."), (8, 15))
+        with self.assertRaises(ValueError):
+            PageMatcher("x", "glob")
+
+
+class SearchVaultTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        kdf_params = newKdfParams(KDF_PBKDF2, iterations=1000)
+        self.user_key = generateUserKey(PASSWORD, kdf_params)
+        # small pages are stored in chunks too, the search reads both layouts
+        self.session = StorageSession(os.path.join(self.tmp.name, "pages.data"), chunked_page_size=2000)
+        self.session.createDatabase(self.user_key, PASSWORD, kdf_params)
+        self.book = self.session.createBook(self.user_key, "book", "")
+        self.expected = set()
+        for number in range(30):
+            text = f"page {number} " + ("filler text\n" * (number * 20))
+            if number % 3 == 0:
+                text += "the needle is here"
+            page = self.session.createPage(self.user_key, self.book, f"page {number}", text)
+            if number % 3 == 0:
+                self.expected.add(page)
+
+    def tearDown(self):
+        self.session.close()
+        self.tmp.cleanup()
+
+    def search(self, query: str, **options) -> set:
+        return {page_id for _, page_id, _ in searchVault(self.session, self.user_key, query, **options)}
+
+    def test_finds_inline_and_chunked_pages(self):
+        chunked = self.session.conn.execute("select count(*) from page where page_layout=?",
+                                            (PAGE_LAYOUT_CHUNKED,)).fetchone()[0]
+        self.assertGreater(chunked, 0)
+        self.assertEqual(self.search("needle", workers=0, batch_size=4), self.expected)
+        self.assertEqual(self.search("NEEDLE", workers=0, ignore_case=True), self.expected)
+        self.assertEqual(self.search("nothing like this", workers=0), set())
+
+    def test_worker_processes_find_the_same_pages(self):
+        self.assertEqual(self.search("need+le", workers=2, batch_size=4, mode=SEARCH_REGEX), self.expected)
+
+    def test_queued_save_is_searched(self):
+        page = self.session.createPage(self.user_key, self.book, "late", "nothing yet")
+        self.session.queuePageText(self.user_key, page, "now a needle too")
+        self.assertIn(page, self.search("needle", workers=0))
+
+    def test_hits_stream_before_the_end(self):
+        hits = searchVault(self.session, self.user_key, "needle", workers=0, batch_size=1)
+        book_id, page_id, snippet = next(hits)
+        hits.close()
+        self.assertEqual(book_id, self.book)
+        self.assertIn(page_id, self.expected)
+        self.assertIn("needle", snippet)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas_v4
+
+Tests of the encrypted search index """
+import os
+import tempfile
+import unittest
+
+from crypto import generateUserKey, newKdfParams, KDF_PBKDF2, COMPRESSION_ZLIB
+from search_index import encodeTokens
+from storage import StorageSession
+
+PASSWORD = "test"
+
+
+class SearchIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        kdf_params = newKdfParams(KDF_PBKDF2, iterations=1000)
+        self.user_key = generateUserKey(PASSWORD, kdf_params)
+        self.session = StorageSession(os.path.join(self.tmp.name, "pages.data"))
+        self.session.createDatabase(self.user_key, PASSWORD, kdf_params)
+        self.book = self.session.createBook(self.user_key, "book", "")
+
+    def tearDown(self):
+        self.session.close()
+        self.tmp.cleanup()
+
+    def postings(self, word: str) -> int:
+        term = self.session.searchIndex.termHash(self.user_key, word)
+        return self.session.conn.execute("select count(*) from search_term where term=?", (term,)).fetchone()[0]
+
+    def vocabulary(self, prefix: str) -> list:
+        index = self.session.searchIndex
+        index.clear()  # read what is stored, not the decrypted copy
+        return index.expandPrefix(self.session.conn, self.user_key, prefix)
+
+    def shardRows(self) -> dict:
+        return dict(self.session.conn.execute("select shard, tokens from search_vocabulary_shard"))
+
+    def test_deleted_page_leaves_no_postings_nor_words(self):
+        session, key = self.session, self.user_key
+        deleted = session.createPage(key, self.book, "deleted", "zebra apple")
+        kept = session.createPage(key, self.book, "kept", "apple")
+        session.deletePage(key, deleted)
+        self.assertEqual(self.postings("zebra"), 0)
+        self.assertEqual(self.vocabulary("ze"), [])
+        self.assertEqual(self.vocabulary("ap"), ["apple"])
+        self.assertEqual([page_id for _, page_id, _ in session.findPages(key, "apple")], [kept])
+        self.assertIsNone(session.conn.execute("select 1 from search_document where page_id=?",
+                                               (deleted,)).fetchone())
+
+    def test_deleted_book_leaves_no_postings_nor_words(self):
+        session, key = self.session, self.user_key
+        other = session.createBook(key, "other", "")
+        session.createPage(key, other, "one", "walrus penguin")
+        session.createPage(key, other, "two", "walrus")
+        kept = session.createPage(key, self.book, "kept", "penguin")
+        session.deleteBook(key, other)
+        self.assertEqual(self.postings("walrus"), 0)
+        self.assertEqual(self.vocabulary("wa"), [])
+        self.assertEqual([page_id for _, page_id, _ in session.findPages(key, "penguin")], [kept])
+
+    def test_save_rewrites_only_the_shards_it_touches(self):
+        session, key = self.session, self.user_key
+        page = session.createPage(key, self.book, "page", "alpha beta gamma delta epsilon")
+        before = self.shardRows()
+        self.assertEqual(len(before), 5)
+        session.queuePageText(key, page, "alpha beta gamma delta epsilon zeta")
+        session.flushPendingWrites()
+        after = self.shardRows()
+        changed = [shard for shard in after if before.get(shard) != after[shard]]
+        self.assertEqual(len(changed), 1)
+        self.assertEqual(self.vocabulary("ze"), ["zeta"])
+
+    def test_single_row_vocabulary_is_moved_to_shards(self):
+        session, key = self.session, self.user_key
+        session.createPage(key, self.book, "page", "orange olive")
+        conn = session.conn
+        # the vocabulary as versions before the shards stored it
+        conn.execute("delete from search_vocabulary_shard")
+        conn.execute("insert into search_vocabulary(id, tokens) values(1, ?)",
+                     (key.encrypt(encodeTokens(["olive", "orange"]), COMPRESSION_ZLIB),))
+        conn.commit()
+        session.searchIndex.clear()
+        self.assertEqual(len(session.findPages(key, "or", prefix=True)), 1)
+        self.assertIsNone(conn.execute("select 1 from search_vocabulary").fetchone())
+        self.assertEqual(self.vocabulary("ol"), ["olive"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas_v4
+
+Tests of the storage session: queued saves and their flush """
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+
+from crypto import generateUserKey, newKdfParams, KDF_PBKDF2
+from storage import StorageSession, CHUNKED_PAGE_SIZE
+
+PASSWORD = "test"
+
+
+class FlushTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        kdf_params = newKdfParams(KDF_PBKDF2, iterations=1000)
+        self.user_key = generateUserKey(PASSWORD, kdf_params)
+        self.session = StorageSession(os.path.join(self.tmp.name, "pages.data"))
+        self.session.createDatabase(self.user_key, PASSWORD, kdf_params)
+
+    def tearDown(self):
+        self.session.close()
+        self.tmp.cleanup()
+
+    def test_delete_book_with_pending_chunked_save(self):
+        session, key = self.session, self.user_key
+        book_x = session.createBook(key, "x", "")
+        book_y = session.createBook(key, "y", "")
+        page_x = session.createPage(key, book_x, "big", "")
+        page_y = session.createPage(key, book_y, "small", "old text")
+        session.queuePageText(key, page_x, "a" * CHUNKED_PAGE_SIZE)
+        session.queuePageText(key, page_y, "new text")
+        session.deleteBook(key, book_x)
+        self.assertEqual(session.flushPendingWrites(durable=True), 1)
+        self.assertEqual(len(session.writeQueue), 0)
+        session.textCache.clear()
+        self.assertEqual(session.getPageText(key, page_y), "new text")
+
+    def test_flush_skips_pages_deleted_meanwhile(self):
+        session, key = self.session, self.user_key
+        book = session.createBook(key, "book", "")
+        kept = session.createPage(key, book, "kept", "")
+        deleted = session.createPage(key, book, "deleted", "")
+        session.queuePageText(key, kept, "kept text")
+        session.queuePageText(key, deleted, "b" * CHUNKED_PAGE_SIZE)
+        # deleted behind the queue's back, as another connection would
+        session.conn.execute("delete from page where id=?", (deleted,))
+        session.conn.commit()
+        self.assertEqual(session.flushPendingWrites(durable=True), 1)
+        self.assertEqual(len(session.writeQueue), 0)
+        session.textCache.clear()
+        self.assertEqual(session.getPageText(key, kept), "kept text")
+
+    def test_failed_durable_flush_keeps_its_saves(self):
+        session, key = self.session, self.user_key
+        page = session.createPage(key, session.createBook(key, "book", ""), "page", "")
+        session.queuePageText(key, page, "text")
+        session.conn.execute("create trigger fail before update on page begin select raise(abort, 'no'); end")
+        session.conn.commit()
+        errors = io.StringIO()
+        with contextlib.redirect_stderr(errors):
+            self.assertEqual(session.flushPendingWrites(durable=True), 0)
+        # the error reported is the one of the write, not of resetting the safety level
+        self.assertIn("IntegrityError: no", errors.getvalue())
+        self.assertNotIn("Safety level", errors.getvalue())
+        self.assertFalse(session.conn.in_transaction)
+        self.assertEqual(len(session.writeQueue), 1)
+        session.conn.execute("drop trigger fail")
+        session.conn.commit()
+        self.assertEqual(session.flushPendingWrites(durable=True), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
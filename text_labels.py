@@ -36,5 +36,29 @@ MENU_TEXT_EXIT = "Exit application"
 MENU_TEXT_PAGE = "Page"
 MENU_TEXT_ADD_PAGE = "Add page"
 MENU_TEXT_DELETE_PAGE = "Delete page"
+MENU_TEXT_ATTACH_FILE = "Attach file"
+MENU_TEXT_SAVE_ATTACHMENT = "Save attachment"
 MENU_TEXT_ABOUT = "About"
-MENU_TEXT_SYSTEM = "System"
\ No newline at end of file
+MENU_TEXT_SYSTEM = "System"
+MENU_TEXT_UPGRADE_KDF = "Upgrade password protection"
+MENU_TEXT_CHANGE_PASSWORD = "Change password"
+
+KDF_ALREADY_CURRENT = "Password protection is already up to date"
+KDF_UPGRADE_DONE = "Password protection upgraded"
+KDF_UPGRADE_FAILED = "Password protection could not be upgraded"
+PASSWORD_CHANGE_DONE = "Password changed"
+PASSWORD_CHANGE_FAILED = "Password could not be changed"
+ATTACH_FILE_FAILED = "The file could not be attached"
+NO_ATTACHMENTS = "This page has no attachments"
+CHOOSE_ATTACHMENT = "Attachment to save"
+SAVE_ATTACHMENT_FAILED = "The attachment could not be saved"
+MENU_TEXT_PERFORMANCE = "Performance"
+PERFORMANCE_RECORD = "Record"
+PERFORMANCE_RESET = "Reset"
+PERFORMANCE_EXPORT_TRACE = "Export trace"
+PERFORMANCE_EXPORT_FAILED = "The trace could not be written"
+PERFORMANCE_SPANS = "Timed calls"
+PERFORMANCE_COUNTERS = "Counters"
+ADD_BOOK_FAILED = "The book could not be created"
+RECOVERED_BOOK_NAME = "Recovered pages"
+RECOVERED_BOOK_TEXT = "Pages found without a book when the vault was upgraded"
\ No newline at end of file
@@ -36,5 +36,29 @@ MENU_TEXT_EXIT = "Salir"
 MENU_TEXT_PAGE = "Página"
 MENU_TEXT_ADD_PAGE = "Agregar página"
 MENU_TEXT_DELETE_PAGE = "Borrar página"
+MENU_TEXT_ATTACH_FILE = "Adjuntar archivo"
+MENU_TEXT_SAVE_ATTACHMENT = "Guardar adjunto"
 MENU_TEXT_ABOUT = "Acerca de"
-MENU_TEXT_SYSTEM = "Sistema"
\ No newline at end of file
+MENU_TEXT_SYSTEM = "Sistema"
+MENU_TEXT_UPGRADE_KDF = "Mejorar protección de la contraseña"
+MENU_TEXT_CHANGE_PASSWORD = "Cambiar contraseña"
+
+KDF_ALREADY_CURRENT = "La protección de la contraseña ya está actualizada"
+KDF_UPGRADE_DONE = "Protección de la contraseña mejorada"
+KDF_UPGRADE_FAILED = "No se pudo mejorar la protección de la contraseña"
+PASSWORD_CHANGE_DONE = "Contraseña cambiada"
+PASSWORD_CHANGE_FAILED = "No se pudo cambiar la contraseña"
+ATTACH_FILE_FAILED = "No se pudo adjuntar el archivo"
+NO_ATTACHMENTS = "Esta página no tiene adjuntos"
+CHOOSE_ATTACHMENT = "Adjunto a guardar"
+SAVE_ATTACHMENT_FAILED = "No se pudo guardar el adjunto"
+MENU_TEXT_PERFORMANCE = "Rendimiento"
+PERFORMANCE_RECORD = "Registrar"
+PERFORMANCE_RESET = "Reiniciar"
+PERFORMANCE_EXPORT_TRACE = "Exportar traza"
+PERFORMANCE_EXPORT_FAILED = "No se pudo escribir la traza"
+PERFORMANCE_SPANS = "Llamadas medidas"
+PERFORMANCE_COUNTERS = "Contadores"
+ADD_BOOK_FAILED = "No se pudo crear el libro"
+RECOVERED_BOOK_NAME = "Páginas recuperadas"
+RECOVERED_BOOK_TEXT = "Páginas sin libro encontradas al actualizar el diario"
\ No newline at end of file
@@ -0,0 +1,50 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas_v4
+
+Batches of rows processed in a pool of worker processes, results come back in
+order and only a few batches are in flight, so memory use does not grow with
+the number of rows. A worker gets its keys once, from the initializer. """
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterable, Iterator
+
+
+def batched(rows: Iterable, size: int) -> Iterator[list]:
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def mapBatches(batches: Iterable[list], function: Callable[[list], list], workers: int,
+               initializer: Callable, initargs: tuple) -> Iterator[list]:
+    """function(batch) for every batch, in order, in a pool of worker processes
+    with at most two batches per worker in flight (workers=0 runs in this process)"""
+    if workers == 0:
+        initializer(*initargs)
+        for batch in batches:
+            yield function(batch)
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs) as pool:
+        running = deque()
+        try:
+            for batch in batches:
+                running.append(pool.submit(function, batch))
+                if len(running) >= workers * 2:
+                    yield running.popleft().result()
+            while running:
+                yield running.popleft().result()
+        finally:
+            for future in running:
+                future.cancel()
+
+
+def flatten(batches: Iterable[list]) -> Iterator:
+    for batch in batches:
+        yield from batch